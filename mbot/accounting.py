@@ -0,0 +1,124 @@
+import time
+import threading
+
+from .scope import current_scope, scope_owner
+
+# Resources which are counted by `PluginAccounting.charge`.
+HTTP_CALLS = 'http_calls'
+EXECUTOR_JOBS = 'executor_jobs'
+
+
+def _new_counters():
+    return {'cpu': 0, 'wall': 0, 'runs': 0, HTTP_CALLS: 0, EXECUTOR_JOBS: 0}
+
+
+class _Measured(object):
+    '''
+    Awaitable which runs a coroutine and charges the CPU time of each of its steps, and its wall
+    time once it is done, to a plugin. Only the time spent in the coroutine itself is counted as
+    CPU time, not the time of other tasks which run while it is suspended.
+    '''
+    __slots__ = ('coro', 'counters')
+
+    def __init__(self, coro, counters):
+        self.coro = coro
+        self.counters = counters
+
+    def __await__(self):
+        steps = self.coro.__await__()
+        start = time.monotonic()
+        value, error = None, None
+
+        try:
+            while True:
+                cpu = time.thread_time()
+
+                try:
+                    if error is not None:
+                        yielded = steps.throw(error)
+                    else:
+                        yielded = steps.send(value)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    self.counters['cpu'] += time.thread_time() - cpu
+
+                try:
+                    value, error = (yield yielded), None
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            self.counters['wall'] += time.monotonic() - start
+            self.counters['runs'] += 1
+
+
+class PluginAccounting(object):
+    '''
+    Resources used by each plugin, so that expensive plugins can be found (and disabled with `gdp`).
+
+    Handlers, commands and tasks are all started through `TaskSupervisor.spawn`, which runs them
+    through `measure` to count their CPU and wall time. HTTP calls and executor jobs are charged
+    to the plugin of the current scope as they are made; database operations, REST calls and
+    spawned tasks are already counted per scope or per plugin elsewhere, and are only collected
+    by `stats`.
+    '''
+    def __init__(self, mbot):
+        self.mbot = mbot
+
+        # HTTP calls are charged from the loop, but this keeps `charge` safe to call from any thread.
+        self._lock = threading.Lock()
+
+        # _plugins:
+        #   {plugin_name: {'cpu': float, 'wall': float, 'runs': int, HTTP_CALLS: int, EXECUTOR_JOBS: int}, ...}
+        self._plugins = {}
+
+    def _counters(self, plugin):
+        counters = self._plugins.get(plugin)
+
+        if counters is None:
+            counters = self._plugins[plugin] = _new_counters()
+
+        return counters
+
+    def measure(self, plugin, coro):
+        '''Return a coroutine which runs `coro` and charges its CPU and wall time to `plugin`.'''
+        async def measured():
+            return await _Measured(coro, self._counters(plugin))
+
+        return measured()
+
+    def charge(self, resource, amount=1):
+        '''Charge `amount` of `resource` to the plugin which owns the current scope.'''
+        with self._lock:
+            self._counters(scope_owner(current_scope.get()))[resource] += amount
+
+    def stats(self):
+        '''
+        :returns: `{plugin_name: {resource: amount, ...}, ...}`, sorted by CPU time. CPU and wall time
+            are in seconds, and `runs` is the number of handlers, commands and tasks which finished.
+        '''
+        derived = {'mongo_ops': 0, 'mongo_seconds': 0, 'rest_calls': 0, 'rest_rate_limited': 0, 'tasks': 0}
+
+        with self._lock:
+            plugins = {plugin: {**counters, **derived} for plugin, counters in self._plugins.items()}
+
+        def counters(owner):
+            if owner not in plugins:
+                plugins[owner] = {**_new_counters(), **derived}
+
+            return plugins[owner]
+
+        for scope, (ops, seconds) in list(self.mbot.db_monitor.scopes.items()):
+            plugin = counters(scope_owner(scope))
+            plugin['mongo_ops'] += ops
+            plugin['mongo_seconds'] += seconds
+
+        for (_, scope), (calls, rate_limited, _, _) in list(self.mbot.rest.totals.items()):
+            plugin = counters(scope_owner(scope))
+            plugin['rest_calls'] += calls
+            plugin['rest_rate_limited'] += rate_limited
+
+        for group, stats in self.mbot.tasks.stats().items():
+            counters(scope_owner(group))['tasks'] += stats['spawned']
+
+        return dict(sorted(plugins.items(), key=lambda item: item[1]['cpu'], reverse=True))
@@ -0,0 +1,99 @@
+import logging
+
+import asyncio
+from pymongo.errors import PyMongoError
+
+log = logging.getLogger(__name__)
+
+
+class BlacklistIndex(object):
+    '''
+    In-memory copy of the global user blacklist and of the per-server user blacklists
+    managed by the `Moderator` plugin. The commands which edit the blacklists update the
+    index of their own shard directly; edits made outside of the bot or on other shards are
+    picked up by periodically reloading both blacklists from the database, so they can take
+    up to `reconcile_interval` seconds to apply.
+
+    Lookups wait up to `load_timeout` seconds for the blacklists to be loaded once, so that
+    blacklisted users are not let through while the bot is starting; after that, they query
+    the database directly until the first load succeeds.
+    '''
+    def __init__(self, mbot, reconcile_interval=60*5, load_timeout=2):
+        self.mbot = mbot
+        self.reconcile_interval = reconcile_interval
+        self.load_timeout = load_timeout
+
+        # global_users:
+        #   {user_id, ...}
+        self.global_users = set()
+
+        # server_users:
+        #   {(server_id, user_id), ...}
+        self.server_users = set()
+
+        # Set once the blacklists have been loaded from the database.
+        self.loaded = asyncio.Event()
+
+        self.mbot.tasks.spawn(self.reconcile_loop(), 'mbot', 'reconcile_blacklists')
+
+    async def is_blacklisted(self, user_id, server_id=None):
+        '''Return a tuple of bools `(globally_blacklisted, blacklisted_in_server)`.'''
+        try:
+            await asyncio.wait_for(self.loaded.wait(), self.load_timeout)
+        except asyncio.TimeoutError:
+            return await self._query(user_id, server_id)
+
+        return user_id in self.global_users, (server_id, user_id) in self.server_users
+
+    async def _query(self, user_id, server_id=None):
+        '''Look `user_id` up in the database, for when the blacklists are not loaded; fails open.'''
+        global_doc = server_doc = None
+
+        try:
+            global_doc = await self.mbot.mongo.bot_data.global_blacklist.find_one({'user_id': user_id}, {'_id': 1})
+
+            if server_id is not None:
+                server_doc = await self.mbot.mongo.plugin_data.moderator.find_one(
+                    {'server_id': server_id, 'users_blacklist.user_id': user_id}, {'_id': 1}
+                )
+        except PyMongoError:
+            log.exception(f'could not look up whether {user_id} is blacklisted; letting them through')
+
+        return global_doc is not None, server_doc is not None
+
+    def add_global(self, user_id):
+        self.global_users.add(user_id)
+
+    def remove_global(self, user_id):
+        self.global_users.discard(user_id)
+
+    def add_local(self, server_id, user_id):
+        self.server_users.add((server_id, user_id))
+
+    def remove_local(self, server_id, user_id):
+        self.server_users.discard((server_id, user_id))
+
+    async def load(self):
+        global_users, server_users = set(), set()
+
+        async for doc in self.mbot.mongo.bot_data.global_blacklist.find({}, {'user_id': 1}):
+            global_users.add(doc['user_id'])
+
+        async for doc in self.mbot.mongo.plugin_data.moderator.find(
+                {'users_blacklist.0': {'$exists': True}}, {'server_id': 1, 'users_blacklist.user_id': 1}):
+            for user in doc['users_blacklist']:
+                server_users.add((doc['server_id'], user['user_id']))
+
+        self.global_users, self.server_users = global_users, server_users
+        self.loaded.set()
+        log.debug(f'loaded {len(global_users)} global and {len(server_users)} server blacklist entries')
+
+    async def reconcile_loop(self):
+        while not self.mbot.is_closed:
+            try:
+                await self.load()
+            except PyMongoError:
+                log.exception('could not load user blacklists')
+
+            # Messages are held until the first load, so it is retried sooner.
+            await asyncio.sleep(self.reconcile_interval if self.loaded.is_set() else min(self.reconcile_interval, 10))
@@ -0,0 +1,239 @@
+import re
+import time
+import logging
+import functools
+from copy import deepcopy
+from collections import OrderedDict
+
+import asyncio
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache(object):
+    '''
+    Simple size bounded LRU cache where every entry also has a time to live.
+    Expired entries are dropped lazily when they are accessed, and the least recently
+    used entries are evicted once the cache grows past `maxsize`.
+    '''
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # _data:
+        #   {key: (expires_at, value), ...}
+        self._data = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _count=False) is not None
+
+    def get(self, key, default=None, _count=True):
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            if _count:
+                self.misses += 1
+
+            return default
+
+        if expires < time.monotonic():
+            del self._data[key]
+
+            if _count:
+                self.misses += 1
+
+            return default
+
+        self._data.move_to_end(key)
+
+        if _count:
+            self.hits += 1
+
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+_MISSING = object()
+
+
+def _normalize(value, casefold=False):
+    '''
+    Turn request parameters into a hashable key, ignoring surrounding whitespace and dict order.
+    Case is only ignored with `casefold`, which must only be used for case-insensitive APIs.
+    '''
+    if isinstance(value, str):
+        value = re.sub(r'\s+', ' ', value.strip())
+        return value.casefold() if casefold else value
+
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _normalize(v, casefold)) for k, v in value.items()))
+
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v, casefold) for v in value)
+
+    # Sets have no order of their own; sorted by repr, since their elements may not be comparable.
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted((_normalize(v, casefold) for v in value), key=repr))
+
+    return value
+
+
+class ResponseCache(object):
+    '''
+    Cache for the responses of external APIs, shared by all plugins.
+    Responses are cached per endpoint with the endpoint's own time to live, and the least
+    recently used responses are evicted first. Concurrent misses for the same request are
+    coalesced, so only one of them actually calls the API while the others wait for its result.
+    Failed requests are never cached.
+
+    Cached responses are shared between callers, so they must not be modified.
+    '''
+    def __init__(self, maxsize=1024, ttl=300, ttls=None):
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self._cache = TTLCache(maxsize, ttl)
+
+        # _inflight:
+        #   {key: Future, ...}
+        self._inflight = {}
+
+        # _counters:
+        #   {endpoint: {'hits': int, 'misses': int, 'coalesced': int}, ...}
+        self._counters = {}
+
+    def _count(self, endpoint, counter):
+        counters = self._counters.setdefault(endpoint, {'hits': 0, 'misses': 0, 'coalesced': 0})
+        counters[counter] += 1
+
+    async def fetch(self, endpoint, params, func, ttl=None, casefold=False):
+        '''
+        Return the cached response for `params` on `endpoint`, or call the coroutine
+        function `func` to get it and cache the result for `ttl` seconds (which defaults
+        to the ttl configured for `endpoint`). With `casefold`, `params` which only differ
+        in case share a response.
+        '''
+        key = (endpoint, _normalize(params, casefold))
+        value = self._cache.get(key, _MISSING, _count=False)
+
+        if value is not _MISSING:
+            self._count(endpoint, 'hits')
+            return value
+
+        inflight = self._inflight.get(key)
+
+        if inflight is not None:
+            self._count(endpoint, 'coalesced')
+
+            # Shielded so that a waiter being cancelled does not cancel the request for everyone else.
+            return await asyncio.shield(inflight)
+
+        self._count(endpoint, 'misses')
+
+        future = self._inflight[key] = asyncio.ensure_future(func())
+        future.add_done_callback(functools.partial(self._done, key, ttl or self.ttls.get(endpoint, self.ttl)))
+
+        return await asyncio.shield(future)
+
+    def _done(self, key, ttl, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+        if not future.cancelled() and future.exception() is None:
+            self._cache.set(key, future.result(), ttl)
+
+    def invalidate(self, endpoint=None):
+        '''Drop all cached responses of `endpoint`, or every cached response if `endpoint` is `None`.'''
+        if endpoint is None:
+            self._cache.clear()
+        else:
+            for key in [key for key in self._cache._data if key[0] == endpoint]:
+                self._cache.pop(key)
+
+    def stats(self):
+        return {
+            'size': len(self._cache),
+            'maxsize': self._cache.maxsize,
+            'inflight': len(self._inflight),
+            'endpoints': {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
+        }
+
+
+def cached_response(endpoint, ttl=None, casefold=False):
+    '''
+    Decorator for plugin methods which query an external API. The response is cached in
+    `mbot.responses` and keyed on the (normalized) arguments of the call, see `ResponseCache.fetch`.
+    Only use this for user-facing lookups, whose responses do not have to be fresh.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            return await self.mbot.responses.fetch(
+                endpoint, (args, kwargs), functools.partial(func, self, *args, **kwargs), ttl, casefold
+            )
+
+        return wrapper
+
+    return decorator
+
+
+class GuildConfigCache(object):
+    '''
+    Shared cache of server configuration documents (`bot_data.config`).
+    All reads of a server config on the hot path should go through `get`, and
+    anything which writes to a config document must call `invalidate` afterwards.
+    `get` returns a copy, so callers may modify the document they get.
+    '''
+    def __init__(self, mbot, maxsize=2048, ttl=300):
+        self.mbot = mbot
+        self._cache = TTLCache(maxsize, ttl)
+
+        # Bumped on every invalidation so that a lookup which raced with a write
+        # does not put a stale document back into the cache.
+        self._generation = 0
+
+    async def get(self, server_id):
+        cfg = self._cache.get(server_id)
+
+        if cfg is None:
+            generation = self._generation
+            cfg = await self.mbot.mongo.config.find_one({'server_id': server_id})
+
+            if cfg is not None and generation == self._generation:
+                self._cache.set(server_id, cfg)
+
+        return deepcopy(cfg)
+
+    def invalidate(self, server_id=None):
+        '''Drop the cached config of a server, or of all servers if `server_id` is `None`.'''
+        self._generation += 1
+
+        if server_id is None:
+            log.debug('invalidating all cached server configs')
+            self._cache.clear()
+        else:
+            self._cache.pop(server_id)
+
+    def stats(self):
+        return self._cache.stats()
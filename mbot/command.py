@@ -6,6 +6,10 @@ from functools import wraps
 import asyncio
 from discord import Forbidden
 
+from .outbound import send_priority, PRIORITY_REPLY
+from .executors import ExecutorBusy
+from .scope import current_scope
+
 log = logging.getLogger(__name__)
 
 
@@ -27,16 +31,16 @@ def command(*, regex='', usage='', description='', name='', call_on_message=Fals
     '''
 
     def decorator(func):
-        if aliases:
-            pat, cmd_name = regex or f'^{name or func.__name__}$', name or func.__name__
+        # Pattern defaults to function name.
+        pat, cmd_name = regex or f'^{name or func.__name__}$', name or func.__name__
 
+        if aliases:
             pattern = re.compile(pat.replace(
                 cmd_name,
                 f'(?:{cmd_name}|{"|".join(aliases)})'
             ))
         else:
-            # Pattern defaults to function name.
-            pattern = re.compile(regex or f'^{name or func.__name__}$')
+            pattern = re.compile(pat)
 
         @wraps(func)
         async def wrapper(self, message, check_perms=True):
@@ -51,40 +55,42 @@ def command(*, regex='', usage='', description='', name='', call_on_message=Fals
             if ch is not None and issubclass(ch, ABORT_COMMAND):
                 return
 
-            log.debug(f'running command {wrapper.info["name"]} in server {message.server.id} {match.groups()}')
+            start = time.perf_counter()
 
-            # Check if command history exists. Create it if not.
-            doc = await self.mbot.mongo.cmd_history.find_one(
-                {'user_id': message.author.id}
-            )
-
-            if doc is None:
-                await self.mbot.mongo.cmd_history.insert_one(
-                    {
-                        'user_id': message.author.id,
-                        'commands': []
-                    }
-                )
+            try:
+                with self.mbot.tracer.span(f'command:{wrapper.info["name"]}'):
+                    return await run(self, message, match, check_perms)
+            finally:
+                self.mbot.metrics.observe_command(wrapper.info['name'], time.perf_counter() - start)
 
-                history = {}
-            else:
-                history = dict([(cmd['name'], cmd['timestamp']) for cmd in doc['commands']])
+        # Everything after the command was matched; timed by `wrapper`.
+        async def run(self, message, match, check_perms):
+            tracer = self.mbot.tracer
 
-            await self.mbot.update_stats({'commands_received': 1}, scopes=['global', message.server])
+            log.debug(f'running command {wrapper.info["name"]} in server {message.server.id} {match.groups()}')
+
+            # Everything sent from here on is a reply to this command.
+            send_priority.set(PRIORITY_REPLY)
+            current_scope.set(f'{wrapper.info["plugin"]}.command:{wrapper.info["name"]}')
+
+            with tracer.span('stats'):
+                await self.mbot.update_stats({'commands_received': 1}, scopes=['global', message.server])
 
             # Check cooldown
             if cooldown and not self.mbot.perms_check(message.author, su=True):  # SU can bypass cooldown.
-                timestamp = history.get(wrapper.info['name'], None)
+                with tracer.span('cooldown'):
+                    remaining = self.mbot.cooldowns.remaining(message.author.id, wrapper.info['name'])
 
-                if timestamp is not None and timestamp + cooldown > time.time():
+                if remaining > 0:
                     return await self.mbot.send_message(
                         message.channel,
                         f'**{message.author.name}, slow down there (this command has a cooldown)...\n'
-                        f'*{max(int((timestamp + cooldown) - time.time()), 1)}* second(s) remaining.**'
+                        f'*{max(int(remaining), 1)}* second(s) remaining.**'
                     )
 
             # Check NSFW status
-            config = await self.mbot.mongo.config.find_one({'server_id': message.server.id})
+            with tracer.span('nsfw_check'):
+                config = await self.mbot.guild_configs.get(message.server.id)
 
             if nsfw and message.channel.id not in config['nsfw_channels']:
                 return await self.mbot.send_message(message.channel, '*You cannot use NSFW commands here...*')
@@ -94,21 +100,10 @@ def command(*, regex='', usage='', description='', name='', call_on_message=Fals
                 return await self.mbot.send_message(message.channel, '*You do not have permission to do that...*')
 
             try:
-                await func(self, message, *match.groups())
-
-                await self.mbot.mongo.stats.update_many(
-                    {
-                        'scope': {'$in': ['global', message.server.id]},
-                        'commands_executed.command': {'$ne': wrapper.info['name']}
-                    },
-                    {'$addToSet': {'commands_executed': {'command': wrapper.info['name'], 'n': 0}}}
-                )
+                with tracer.span('execute'):
+                    await func(self, message, *match.groups())
 
-                await self.mbot.update_stats(
-                    {'commands_executed.$.n': 1},
-                    scopes=['global', message.server],
-                    query={'commands_executed': {'$elemMatch': {'command': wrapper.info['name']}}}
-                )
+                self.mbot.stats.command_executed(wrapper.info['name'], scopes=['global', message.server.id])
 
             except Forbidden:
                 log.error(
@@ -122,6 +117,12 @@ def command(*, regex='', usage='', description='', name='', call_on_message=Fals
 
                 await asyncio.sleep(5)
                 await self.mbot.delete_message(msg)
+            except ExecutorBusy:
+                log.warning(f'executor busy while running {wrapper.info["name"]} in server {message.server.id}')
+                await self.mbot.send_message(message.channel, '*I\'m a bit busy right now, try again in a moment...*')
+            except asyncio.TimeoutError:
+                log.warning(f'timed out while running {wrapper.info["name"]} in server {message.server.id}')
+                await self.mbot.send_message(message.channel, '*That took too long... Please try again later.*')
             except Exception:
                 log.exception(f'error while running {wrapper.info["name"]} in server {message.server.id}')
 
@@ -129,22 +130,15 @@ def command(*, regex='', usage='', description='', name='', call_on_message=Fals
                 await self.on_message(message)
 
             # Update timestamps
-            if wrapper.info['name'] not in history:
-                await self.mbot.mongo.cmd_history.update_one(
-                    {'user_id': message.author.id},
-                    {'$push': {'commands': {'name': wrapper.info['name'], 'timestamp': time.time()}}}
-                )
-            else:
-                tstamp = time.time()
-                await self.mbot.mongo.cmd_history.update_one(
-                    {'user_id': message.author.id, 'commands': {'$elemMatch': {'name': wrapper.info['name']}}},
-                    {'$set': {'commands.$.timestamp': tstamp}}
-                )
+            with tracer.span('history'):
+                self.mbot.cooldowns.record(message.author.id, wrapper.info['name'], cooldown)
 
         wrapper._command = True
         wrapper._func = func
         wrapper._pattern = pattern
+        wrapper._regex = pat  # Raw pattern, without aliases; used by the command index.
         wrapper._mutex = mutex
+        wrapper._cooldown = cooldown
 
         wrapper.info = {
             'usage': usage or '',
@@ -29,14 +29,37 @@ class Config(object):
             self.yml['mbot']['cmd_prefix']
         )
 
+        # The mongo section is only needed by the (default) mongo storage backend.
+        mongo = self.yml.get('mongo') or {}
         self.mongo = self._Mongo(
-            self.yml['mongo']['host'],
-            self.yml['mongo']['port'],
-            self.yml['mongo']['username'],
-            self.yml['mongo']['password']
+            mongo.get('host', 'localhost'),
+            mongo.get('port', 27017),
+            mongo.get('username'),
+            mongo.get('password')
         )
 
         self.superusers = [str(su) for su in self.yml['superusers']]
         self.plugin_data = self.yml.get('plugin_data', {})
+        self.storage = self.yml.get('storage') or {}
+        self.cache = self.yml.get('cache') or {}
+        self.stats = self.yml.get('stats') or {}
+        self.cooldowns = self.yml.get('cooldowns') or {}
+        self.blacklist = self.yml.get('blacklist') or {}
+        self.outbound = self.yml.get('outbound') or {}
+        self.http = self.yml.get('http') or {}
+        self.rest = self.yml.get('rest') or {}
+        self.executors = self.yml.get('executors') or {}
+        self.render = self.yml.get('render') or {}
+        self.metrics = self.yml.get('metrics') or {}
+        self.tracing = self.yml.get('tracing') or {}
+        self.watchdog = self.yml.get('watchdog') or {}
+        self.tasks = self.yml.get('tasks') or {}
+
+        # Command rate limits; `{scope: (commands, seconds), ...}`.
+        self.ratelimits = {'user': (1, 1)}
+        self.ratelimits.update({
+            scope: (limit['commands'], limit['seconds']) if limit else None
+            for scope, limit in (self.yml.get('ratelimits') or {}).items()
+        })
 
         log.debug(f'loaded config from {self._path}')
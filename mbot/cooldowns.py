@@ -0,0 +1,126 @@
+import time
+import logging
+from datetime import datetime, timedelta
+
+import asyncio
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+log = logging.getLogger(__name__)
+
+
+class CooldownManager(object):
+    '''
+    Keeps track of when users last ran each command, in order to enforce command cooldowns.
+    Cooldowns are checked purely in memory; the command history is written to `cmd_history`
+    in batches in the background, as one small document per (user, command) which
+    expires after `retention` seconds.
+
+    Each shard only knows about the commands it ran itself (and those loaded from the history
+    at startup), so cooldowns are not enforced across shards: a user can run a command on
+    a server of another shard while it is on cooldown. The history documents are removed by
+    the TTL index on `expires_at` (see `Storage.indexes`); if it cannot be created, it is
+    logged and listed by the `indexes` command.
+    '''
+    def __init__(self, mbot, flush_interval=10, retention=60*60*24):
+        self.mbot = mbot
+        self.flush_interval = flush_interval
+        self.retention = retention
+
+        # _expires:
+        #   {(user_id, command_name): cooldown_expires_at, ...}
+        self._expires = {}
+
+        # _pending:
+        #   {(user_id, command_name): timestamp, ...}
+        self._pending = {}
+
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = self.mbot.tasks.spawn(self.flush_loop(), 'mbot', 'flush_cooldowns')
+
+    def _cooldown_for(self, command_name):
+        cmd = self.mbot.plugin_manager.commands.get(command_name)
+        return cmd[2]._cooldown if cmd is not None else None
+
+    def remaining(self, user_id, command_name):
+        '''Return the number of seconds until `user_id` can run `command_name` again.'''
+        expires = self._expires.get((user_id, command_name))
+
+        if expires is None:
+            return 0
+
+        return max(expires - time.time(), 0)
+
+    def record(self, user_id, command_name, cooldown=None, timestamp=None):
+        '''Record a command run. Only commands with a `cooldown` are kept in memory.'''
+        timestamp = timestamp or time.time()
+
+        if cooldown:
+            self._expires[(user_id, command_name)] = timestamp + cooldown
+
+        self._pending[(user_id, command_name)] = timestamp
+
+    async def load(self):
+        '''Load the cooldowns which are still active from the database, e.g. after a restart.'''
+        cooldowns = [c[2]._cooldown for c in self.mbot.plugin_manager.commands.values() if c[2]._cooldown]
+
+        if not cooldowns:
+            return
+
+        now = time.time()
+
+        # History documents expire `retention` seconds after they are written, which is after the
+        # command ran; so every command run in the last `max(cooldowns)` seconds expires after
+        # `now + retention - max(cooldowns)`. Filtering on `expires_at` uses its TTL index.
+        expires_after = datetime.utcnow() + timedelta(seconds=max(self.retention - max(cooldowns), 0))
+
+        async for doc in self.mbot.mongo.cmd_history.find({'expires_at': {'$gt': expires_after}}):
+            cooldown = self._cooldown_for(doc['command'])
+            key = (doc['user_id'], doc['command'])
+
+            if cooldown and doc['timestamp'] + cooldown > now and key not in self._expires:
+                self._expires[key] = doc['timestamp'] + cooldown
+
+        log.debug(f'loaded {len(self._expires)} active cooldown(s)')
+
+    async def flush(self):
+        '''Write the pending command history to the database and forget expired cooldowns.'''
+        async with self._flush_lock:
+            now = time.time()
+            self._expires = {k: v for k, v in self._expires.items() if v > now}
+
+            pending, self._pending = self._pending, {}
+
+            if not pending:
+                return
+
+            expires_at = datetime.utcnow() + timedelta(seconds=self.retention)
+
+            try:
+                # Shielded, so that the history which is being written is not lost when the bot closes.
+                await asyncio.shield(self.mbot.mongo.cmd_history.bulk_write([
+                    UpdateOne(
+                        {'user_id': user_id, 'command': command_name},
+                        {'$set': {'timestamp': timestamp, 'expires_at': expires_at}},
+                        upsert=True
+                    ) for (user_id, command_name), timestamp in pending.items()
+                ], ordered=False))
+            except PyMongoError:
+                log.exception('error while writing command history')
+
+                for key, timestamp in pending.items():
+                    self._pending.setdefault(key, timestamp)
+
+    async def flush_loop(self):
+        try:
+            await self.load()
+        except PyMongoError:
+            log.exception('could not load command cooldowns')
+
+        while not self.mbot.is_closed:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        self._flush_task.cancel()
+        await self.flush()
@@ -1,28 +1,50 @@
 import logging
+
 from motor.motor_asyncio import AsyncIOMotorClient as MongoClient
 
+from .storage import Storage, MemoryStorage, SQLiteStorage
+
 log = logging.getLogger(__name__)
 
 
-class Mongo(object):
+class Mongo(Storage):
     '''
-    Base class which manages the global database used by the bot.
-    Plugins should not use this class, instead all plugins should
-    access the database through the `mongo` attribute of the `mbot` class.
+    Storage backend which keeps the global database used by the bot in mongo, through motor.
+    This is the default backend, see `open_storage`.
     '''
-    def __init__(self, config):
+    def __init__(self, config, monitor=None):
         self.client = MongoClient(
             config.mongo.host, config.mongo.port,
-            username=config.mongo.username, password=config.mongo.password
+            username=config.mongo.username, password=config.mongo.password,
+            event_listeners=[monitor] if monitor is not None else []
         )
 
-        self.bot_data = self.client.bot_data
+        super().__init__(self.client.bot_data, self.client.plugin_data)
+        self.monitor = monitor
 
-        self.config = self.bot_data.config
-        self.cmd_history = self.bot_data.cmd_history
-        self.stats = self.bot_data.stats
-        self.bot_guilds = self.bot_data.bot_guilds
+        log.debug(f'connected to mongo instance at {config.mongo.host}:{config.mongo.port}')
 
-        self.plugin_data = self.client.plugin_data
+    def close(self):
+        self.client.close()
 
-        log.debug(f'connected to mongo instance at {config.mongo.host}:{config.mongo.port}')
+
+def open_storage(config, monitor=None):
+    '''
+    Open the storage backend selected in the `storage` section of the config:
+    `mongo` (the default), `sqlite` for a single node deployment without a mongo server,
+    or `memory` for benchmarks and load tests, which loses all data when the bot exits.
+    All operations are reported to `monitor`, a `DatabaseMonitor`, if given.
+    '''
+    backend = config.storage.get('backend', 'mongo')
+
+    if backend == 'mongo':
+        return Mongo(config, monitor)
+    elif backend == 'sqlite':
+        storage = SQLiteStorage(config.storage.get('path', 'mbot.sqlite3'))
+    elif backend == 'memory':
+        storage = MemoryStorage()
+    else:
+        raise ValueError(f'unknown storage backend {backend}')
+
+    storage.monitor = monitor
+    return storage
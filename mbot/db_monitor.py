@@ -0,0 +1,172 @@
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+from .histogram import Histogram, percentile
+from .tracing import current_span
+from .scope import current_scope
+
+log = logging.getLogger(__name__)
+
+# The `MessageOps` of the message handled by the current task, see `mBot.on_message`.
+# Tasks created while handling a message (such as plugin `on_message` handlers) inherit it.
+message_ops = ContextVar('message_ops', default=None)
+
+# Commands which are sent by the driver itself rather than by the bot.
+IGNORED_COMMANDS = {
+    'hello', 'ismaster', 'isMaster', 'ping', 'buildinfo', 'buildInfo', 'endSessions',
+    'saslStart', 'saslContinue', 'authenticate', 'getnonce', 'killCursors'
+}
+
+
+class MessageOps(object):
+    '''Database operations triggered by a single message.'''
+    __slots__ = ('ops', 'seconds')
+
+    def __init__(self):
+        self.ops = 0
+        self.seconds = 0
+
+
+class DatabaseMonitor(monitoring.CommandListener):
+    '''
+    Records the latency of every database operation per collection and operation, and attributes
+    it to the current scope and message. Registered as a command listener of the motor client;
+    the other storage backends report their operations through `observe`.
+
+    pymongo calls the listener from the threads of motor's executor, which run with a copy of the
+    context of the task which issued the operation, so the context variables can be read there.
+    '''
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+
+        # _pending:
+        #   {(connection_id, request_id): (collection, operation, scope, message_ops, span), ...}
+        self._pending = {}
+
+        # operations:
+        #   {(collection, operation): Histogram, ...}
+        self.operations = {}
+
+        # failures:
+        #   {(collection, operation): count, ...}
+        self.failures = {}
+
+        # scopes:
+        #   {scope: [ops, seconds], ...}
+        self.scopes = {}
+
+        # The operations of the last `window` messages.
+        self.messages = deque(maxlen=window)
+
+    def message_started(self):
+        '''Start counting the operations of the message handled by the current task.'''
+        ops = MessageOps()
+
+        message_ops.set(ops)
+        self.messages.append(ops)
+
+        return ops
+
+    def record(self, collection, operation, seconds, scope=None, ops=None, failed=False, span=None):
+        key = (collection, operation)
+
+        if span is not None:
+            span.record(f'mongo {operation}', seconds, collection=collection, failed=failed)
+
+        scope = scope or 'background'
+
+        with self._lock:
+            if key not in self.operations:
+                self.operations[key] = Histogram()
+
+            self.operations[key].observe(seconds)
+
+            if failed:
+                self.failures[key] = self.failures.get(key, 0) + 1
+
+            totals = self.scopes.setdefault(scope, [0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+
+            if ops is not None:
+                ops.ops += 1
+                ops.seconds += seconds
+
+    def observe(self, collection, operation, seconds, failed=False):
+        '''Record an operation issued from the current task.'''
+        self.record(collection, operation, seconds, current_scope.get(), message_ops.get(), failed, current_span.get())
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+
+        # The collection is the value of the command name, e.g. `{'find': 'ranking', ...}`; except for `getMore`.
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        else:
+            collection = event.command.get(event.command_name)
+
+        if not isinstance(collection, str):
+            collection = None
+
+        collection = f'{event.database_name}.{collection}' if collection else event.database_name
+
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                collection, event.command_name, current_scope.get(), message_ops.get(), current_span.get()
+            )
+
+    def _finished(self, event, failed):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+
+        if pending is not None:
+            collection, operation, scope, ops, span = pending
+            self.record(collection, operation, event.duration_micros / 1e6, scope, ops, failed, span)
+
+    def succeeded(self, event):
+        self._finished(event, False)
+
+    def failed(self, event):
+        self._finished(event, True)
+
+    def stats(self, top=10):
+        '''
+        :returns: The `top` operations and scopes by total time, and percentiles of the
+            number of operations per message over the last messages.
+        '''
+        with self._lock:
+            operations = [
+                {
+                    'collection': collection, 'operation': operation,
+                    'failed': self.failures.get((collection, operation), 0), **histogram.stats()
+                }
+                for (collection, operation), histogram in self.operations.items()
+            ]
+
+            scopes = [
+                {'scope': scope, 'count': count, 'sum': seconds, 'avg': seconds / count}
+                for scope, (count, seconds) in self.scopes.items()
+            ]
+
+            counts = [ops.ops for ops in self.messages]
+
+        operations.sort(key=lambda op: op['sum'], reverse=True)
+        scopes.sort(key=lambda scope: scope['sum'], reverse=True)
+
+        return {
+            'operations': operations[:top],
+            'scopes': scopes[:top],
+            'ops_per_message': {
+                'messages': len(counts),
+                'avg': sum(counts) / len(counts) if counts else 0,
+                'p50': percentile(counts, 0.5),
+                'p90': percentile(counts, 0.9),
+                'p99': percentile(counts, 0.99),
+                'max': max(counts, default=0)
+            }
+        }
@@ -0,0 +1,165 @@
+import logging
+from string import whitespace
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+# Characters which can safely be treated as literals at the start of a command pattern.
+_LITERAL_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_ ')
+_QUANTIFIERS = ('?', '*', '+', '{')
+
+
+def _has_top_level_alternation(pattern):
+    depth, in_class, escaped = 0, False, False
+
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+
+    return False
+
+
+def pattern_key(pattern):
+    '''
+    Work out which literal words any string matched by `pattern` has to start with.
+    Returns a tuple `(key, prefix)`; `key` is a string of complete, space separated words
+    (or `None` if not even the first word is known) and `prefix` is the literal text
+    every match starts with, which may end in the middle of a word.
+    '''
+    if _has_top_level_alternation(pattern):
+        return None, ''
+
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+
+    end = 0
+    while end < len(pattern) and pattern[end] in _LITERAL_CHARS:
+        end += 1
+
+    literal, rest = pattern[:end], pattern[end:]
+
+    # A quantifier applies to the last literal char, so that char is optional (or repeated).
+    if rest.startswith(_QUANTIFIERS) and literal:
+        literal, rest = literal[:-1], literal[-1] + rest
+
+    if not rest or rest.startswith('$') or rest.startswith('(?: '):
+        key = literal.rstrip(' ')
+    elif ' ' in literal:
+        key = literal[:literal.rfind(' ')].rstrip(' ')
+    else:
+        key = None
+
+    return key or None, literal
+
+
+class CommandIndex(object):
+    '''
+    Index of all loaded commands, used to avoid matching every single command pattern
+    (or every command name) against every message. Commands are indexed by the leading
+    literal words of their patterns, including the patterns of their aliases; commands whose
+    pattern can't be keyed fall back to a cheap `startswith` check on their literal prefix.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # _keyed:
+        #   {'badges craft': {order: command, ...}, ...}
+        self._keyed = defaultdict(dict)
+
+        # _unkeyed:
+        #   [(order, prefix, command), ...]
+        self._unkeyed = []
+
+        # _names / _aliases:
+        #   {first_word: {name: command, ...}, ...}
+        self._names = defaultdict(dict)
+        self._aliases = defaultdict(dict)
+
+        self.aliases = {}
+        self._max_words = 1
+
+    def build(self, commands):
+        '''Rebuild the index from an iterable of command objects, in load order.'''
+        self.clear()
+
+        for order, command in enumerate(commands):
+            name, aliases = command.info['name'], command.info['aliases']
+            patterns = [command._regex] + [command._regex.replace(name, alias) for alias in aliases]
+
+            for pattern in patterns:
+                key, prefix = pattern_key(pattern)
+
+                if key is not None:
+                    self._keyed[key][order] = command
+                    self._max_words = max(self._max_words, len(key.split(' ')))
+                else:
+                    self._unkeyed.append((order, prefix, command))
+
+            self._names[name.split(' ')[0]][name] = command
+
+            for alias in aliases:
+                self._aliases[alias.split(' ')[0]][alias] = command
+                self.aliases[alias] = command
+
+        log.debug(
+            f'indexed {sum(len(x) for x in self._keyed.values())} command pattern(s) under {len(self._keyed)} '
+            f'key(s); {len(self._unkeyed)} pattern(s) could not be keyed'
+        )
+
+    def candidates(self, string):
+        '''Return, in load order, the commands whose pattern could possibly match `string`.'''
+        matched = {}
+        words = string.split(' ', self._max_words)
+
+        for i in range(1, min(len(words), self._max_words) + 1):
+            keyed = self._keyed.get(' '.join(words[:i]))
+
+            if keyed:
+                matched.update(keyed)
+
+        for order, prefix, command in self._unkeyed:
+            if string.startswith(prefix):
+                matched[order] = command
+
+        return [matched[order] for order in sorted(matched)]
+
+    @staticmethod
+    def _longest_match(string, names):
+        # A name matches if the string is equal to it, or starts with it followed by whitespace.
+        matches = [
+            name for name in names
+            if string.startswith(name) and (len(string) == len(name) or string[len(name)] in whitespace)
+        ]
+
+        if matches:
+            return names[max(matches, key=len)]
+
+    def lookup(self, string, ignore_aliases=True):
+        '''
+        Return the command whose name (or alias, if `ignore_aliases` is `False`)
+        is the longest match for the start of `string`.
+        '''
+        words = string.split(None, 1)
+
+        if not words:
+            return
+
+        command = self._longest_match(string, self._names.get(words[0], {}))
+
+        if command is None and not ignore_aliases:
+            command = self._longest_match(string, self._aliases.get(words[0], {}))
+
+        return command
@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+
+from .accounting import EXECUTOR_JOBS
+
+log = logging.getLogger(__name__)
+
+# Workload classes of `long_running_task`.
+IO = 'io'  # Blocking I/O (praw, youtube_dl, ...); runs on a thread pool.
+CPU = 'cpu'  # CPU bound work (PIL, Wand, imageio, ...); runs on the worker processes of `RenderService`.
+
+
+class ExecutorBusy(Exception):
+    '''Raised when a job is submitted to an executor whose queue is full.'''
+
+
+class WorkloadExecutor(object):
+    '''
+    Executor for a single workload class. At most `workers` jobs run at a time, and at most
+    `max_queue` more may wait for a free worker; any further jobs are rejected with
+    `ExecutorBusy` instead of piling up. Jobs which are not done within `timeout` seconds
+    (including the time spent queued) raise `asyncio.TimeoutError` in the caller. A job which
+    has already started keeps its worker until it finishes.
+    '''
+    def __init__(self, name, executor, workers, max_queue=32, timeout=60):
+        self.name = name
+        self.executor = executor
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._slots = asyncio.Semaphore(workers)
+        self.queued = 0
+        self.running = 0
+
+        self.started = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.total_wait = 0
+        self.max_wait = 0
+
+    async def run(self, loop, func, *args, timeout=None):
+        if self._slots.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ExecutorBusy(f'{self.name} executor is busy ({self.queued} jobs queued)')
+
+        timeout = timeout or self.timeout
+        queued_at = time.monotonic()
+        self.queued += 1
+
+        # The timeout includes the time spent waiting for a worker; jobs which time out
+        # (or whose caller is cancelled) before a worker is free are never started.
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        finally:
+            self.queued -= 1
+
+        wait = time.monotonic() - queued_at
+        self.started += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        self.running += 1
+
+        try:
+            future = loop.run_in_executor(self.executor, func, *args)
+        except BaseException:
+            self._release()
+            raise
+
+        # The worker is only free again once the job is done, even if the caller has given up on it.
+        future.add_done_callback(lambda f: self._release())
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), max(timeout - wait, 0))
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            log.warning(f'{self.name} job {getattr(func, "__name__", func)} timed out')
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+
+        self.completed += 1
+        return result
+
+    def _release(self):
+        self.running -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'queued': self.queued,
+            'max_queue': self.max_queue,
+            'started': self.started,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'failed': self.failed,
+            'avg_wait': self.total_wait / self.started if self.started else 0,
+            'max_wait': self.max_wait
+        }
+
+
+class Executors(object):
+    '''
+    The executor used by `long_running_task`, a thread pool for `IO` jobs. The thread pool
+    is also the default executor of the loop.
+    '''
+    def __init__(self, mbot, io=None):
+        self.mbot = mbot
+
+        io = io or {}
+        io_workers = io.get('workers') or min(32, (os.cpu_count() or 1) * 5)
+
+        self.io = WorkloadExecutor(
+            IO, ThreadPoolExecutor(io_workers), io_workers,
+            max_queue=io.get('max_queue', 64), timeout=io.get('timeout', 60)
+        )
+
+        self.mbot.loop.set_default_executor(self.io.executor)
+
+    async def run(self, func, *args, timeout=None):
+        '''Run `func(*args)` on the thread pool and return the result.'''
+        self.mbot.accounting.charge(EXECUTOR_JOBS)
+
+        return await self.io.run(self.mbot.loop, func, *args, timeout=timeout)
+
+    def stats(self):
+        return {IO: self.io.stats()}
+
+    def shutdown(self):
+        self.io.executor.shutdown(wait=False)
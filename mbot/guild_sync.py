@@ -0,0 +1,107 @@
+import logging
+from collections import OrderedDict
+
+import asyncio
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+log = logging.getLogger(__name__)
+
+
+class GuildSync(object):
+    '''
+    Keeps the guild metadata in `bot_data.bot_guilds` up to date incrementally.
+    Channel changes only touch the affected element of the `channels` array. They are
+    buffered for `delay` seconds, so that bursts (such as a channel reorder, which fires an
+    update for every channel) are coalesced into a single `bulk_write`.
+    '''
+    def __init__(self, mbot, delay=2):
+        self.mbot = mbot
+        self.delay = delay
+
+        # _pending:
+        #   {(server_id, channel_id): (op, channel_doc), ...}
+        self._pending = OrderedDict()
+
+    @staticmethod
+    def _channel_doc(channel):
+        return {'id': channel.id, 'name': channel.name, 'type': str(channel.type)}
+
+    def _queue(self, channel, op):
+        key = (channel.server.id, channel.id)
+        pending = self._pending.get(key)
+
+        # A channel which was created during this window still has to be pushed, just with the newest data.
+        if pending is not None and pending[0] == 'create' and op == 'update':
+            op = 'create'
+
+        self._pending[key] = (op, self._channel_doc(channel))
+
+        # Keyed, so that changes queued while a flush is scheduled are written by that flush.
+        self.mbot.tasks.spawn(self._flush_later(), 'mbot', 'sync_channels', key='flush')
+
+    def channel_created(self, channel):
+        self._queue(channel, 'create')
+
+    def channel_deleted(self, channel):
+        self._queue(channel, 'delete')
+
+    def channel_updated(self, before, after):
+        # Only the name and type are stored, other changes (eg. position) can be ignored.
+        if (before.name, str(before.type)) != (after.name, str(after.type)):
+            self._queue(after, 'update')
+
+    async def server_updated(self, before, after):
+        fields = {}
+
+        if before.name != after.name:
+            fields['name'] = after.name
+
+        if before.icon != after.icon:
+            fields['icon'] = after.icon
+
+        if before.owner.id != after.owner.id:
+            fields['owner'] = after.owner.id
+
+        if fields:
+            await self.mbot.mongo.bot_guilds.update_one({'server_id': after.id}, {'$set': fields})
+
+    def _requests(self, pending):
+        requests = []
+
+        for (server_id, channel_id), (op, doc) in pending.items():
+            if op == 'create':
+                requests.append(UpdateOne(
+                    {'server_id': server_id, 'channels.id': {'$ne': channel_id}},
+                    {'$push': {'channels': doc}}
+                ))
+            elif op == 'update':
+                requests.append(UpdateOne(
+                    {'server_id': server_id, 'channels.id': channel_id},
+                    {'$set': {'channels.$.name': doc['name'], 'channels.$.type': doc['type']}}
+                ))
+            else:
+                requests.append(UpdateOne(
+                    {'server_id': server_id},
+                    {'$pull': {'channels': {'id': channel_id}}}
+                ))
+
+        return requests
+
+    async def flush(self):
+        pending, self._pending = self._pending, OrderedDict()
+
+        if not pending:
+            return
+
+        try:
+            await self.mbot.mongo.bot_guilds.bulk_write(self._requests(pending), ordered=False)
+            log.debug(f'synced {len(pending)} channel change(s)')
+        except PyMongoError:
+            log.exception('error while syncing channel changes')
+
+    async def _flush_later(self):
+        # Changes queued while a flush is being written are flushed after another delay.
+        while self._pending:
+            await asyncio.sleep(self.delay)
+            await self.flush()
@@ -0,0 +1,59 @@
+from bisect import bisect_left
+
+# Default bucket bounds for latencies, in seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def percentile(values, q):
+    '''Return the `q`-th percentile (`0 <= q <= 1`) of `values` by the nearest rank method.'''
+    if not values:
+        return 0
+
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class Histogram(object):
+    '''
+    Histogram with fixed buckets, which are cumulative over the lifetime of the histogram.
+    A value falls into the first bucket whose bound is greater than or equal to it; values
+    larger than the last bound fall into an overflow bucket.
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        '''Estimate the `q`-th quantile as the bound of the bucket it falls into.'''
+        if not self.count:
+            return 0
+
+        seen = 0
+
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+
+            if seen >= q * self.count:
+                return min(bound, self.max)
+
+        return self.max
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max
+        }
@@ -0,0 +1,161 @@
+import json
+import time
+import logging
+
+import asyncio
+import aiohttp
+
+from .accounting import HTTP_CALLS
+
+log = logging.getLogger(__name__)
+
+
+class ResponseTooLarge(aiohttp.ClientError):
+    pass
+
+
+class BadStatus(aiohttp.ClientError):
+    '''Raised for responses with a status other than 2xx, so that error pages are never used (or cached).'''
+    def __init__(self, url, status):
+        super().__init__(f'{url} returned {status}')
+        self.url = url
+        self.status = status
+
+
+class HTTPClient(object):
+    '''
+    Bot-wide HTTP client. All plugins share a single `aiohttp.ClientSession`, so connections
+    (and their TLS sessions) are pooled per host and kept alive between requests, and resolved
+    hosts are cached. Every request is bounded by a timeout and response bodies are read
+    up to `max_size` bytes.
+
+    This sticks to the API of aiohttp 1.0, which discord.py depends on: its connector only
+    limits the connections per host and caches hosts forever, so the total number of requests
+    is limited with a semaphore and the DNS cache is cleared every `dns_ttl` seconds.
+
+    Plugins should use this through `mbot.http_client` rather than creating their own sessions.
+    '''
+    def __init__(self, mbot, limit=100, limit_per_host=10, dns_ttl=300, keepalive=30, timeout=15,
+                 max_size=10*1024*1024):
+        self.mbot = mbot
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.max_size = max_size
+
+        self._session = None
+        self._slots = None
+        self._dns_cleared = 0
+
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def session(self):
+        '''The shared session, which is created lazily since it has to be bound to the running loop.'''
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit_per_host,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive,
+                loop=self.mbot.loop
+            )
+
+            self._session = aiohttp.ClientSession(connector=connector, loop=self.mbot.loop)
+            self._slots = asyncio.Semaphore(self.limit)
+            self._dns_cleared = time.monotonic()
+        elif time.monotonic() - self._dns_cleared > self.dns_ttl:
+            self._session.connector.clear_dns_cache()
+            self._dns_cleared = time.monotonic()
+
+        return self._session
+
+    def stats(self):
+        return {'requests': self.requests, 'errors': self.errors}
+
+    async def _read_body(self, response, max_size):
+        length = response.headers.get('Content-Length', '')
+
+        if length.isdigit() and int(length) > max_size:
+            raise ResponseTooLarge(f'{response.url} is {length} bytes, limit is {max_size}')
+
+        body = bytearray()
+
+        while True:
+            chunk = await response.content.read(64*1024)
+
+            if not chunk:
+                break
+
+            body.extend(chunk)
+
+            if len(body) > max_size:
+                raise ResponseTooLarge(f'{response.url} is over the limit of {max_size} bytes')
+
+        return bytes(body)
+
+    async def _request(self, method, url, read, max_size, check_status, **kwargs):
+        session = self.session
+
+        async with self._slots:
+            async with session.request(method, url, **kwargs) as r:
+                if check_status and not 200 <= r.status < 300:
+                    raise BadStatus(url, r.status)
+
+                if not read:
+                    return r, None
+
+                return r, await self._read_body(r, max_size)
+
+    @staticmethod
+    def _charset(response):
+        '''Return the charset of the `Content-Type` of `response`, if any.'''
+        return aiohttp.helpers.parse_mimetype(response.headers.get('Content-Type', ''))[3].get('charset')
+
+    async def request(self, method, url, *, timeout=None, max_size=None, read=True, check_status=True, **kwargs):
+        '''
+        Make a request and return a tuple of `(response, body)`. The body is `None` if
+        `read` is `False`. Any keyword arguments are passed on to `ClientSession.request`.
+
+        :raises asyncio.TimeoutError: If the request (including reading the body) takes
+            longer than `timeout` seconds.
+        :raises ResponseTooLarge: If the body is larger than `max_size` bytes.
+        :raises BadStatus: If the status of the response is not 2xx, unless `check_status` is `False`.
+        '''
+        self.requests += 1
+        self.mbot.accounting.charge(HTTP_CALLS)
+
+        try:
+            return await asyncio.wait_for(
+                self._request(method, url, read, max_size or self.max_size, check_status, **kwargs),
+                timeout or self.timeout
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors += 1
+            raise
+
+    async def read(self, url, *, method='GET', **kwargs):
+        '''Return the body of the response as bytes.'''
+        _, body = await self.request(method, url, **kwargs)
+        return body
+
+    async def text(self, url, *, method='GET', encoding=None, **kwargs):
+        '''Return the body of the response decoded as text.'''
+        r, body = await self.request(method, url, **kwargs)
+        return body.decode(encoding or self._charset(r) or 'utf-8', errors='replace')
+
+    async def json(self, url, *, method='GET', **kwargs):
+        '''Return the body of the response decoded as json.'''
+        r, body = await self.request(method, url, **kwargs)
+        return json.loads(body.decode(self._charset(r) or 'utf-8'))
+
+    async def head(self, url, **kwargs):
+        '''Return the headers of a `HEAD` request.'''
+        r, _ = await self.request('HEAD', url, read=False, **kwargs)
+        return r.headers
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
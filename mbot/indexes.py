@@ -0,0 +1,184 @@
+import logging
+
+from pymongo.errors import PyMongoError, OperationFailure
+
+log = logging.getLogger(__name__)
+
+
+def index_name(keys):
+    '''Return the name mongo gives an index on `keys` if it is not named explicitly.'''
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+
+def _plan_stages(plan):
+    '''Return the stages of a query plan from the root down, e.g. `['FETCH', 'IXSCAN']`.'''
+    stages = []
+
+    while plan:
+        stages.append(plan.get('stage', '?'))
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+
+    return stages
+
+
+def _plan_index(plan):
+    while plan:
+        if 'indexName' in plan:
+            return plan['indexName']
+
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+
+
+class IndexRegistry(object):
+    '''
+    The indexes which the bot relies on. `Storage` declares the indexes of the `bot_data`
+    collections, and every plugin declares the indexes of its `plugin_data` collections
+    in its `indexes` attribute:
+
+        indexes = {
+            'reminders': [([('expires', ASCENDING)], {})]
+        }
+
+    All declared indexes are created at startup; creating an index which already exists is a no-op.
+    '''
+    def __init__(self, mbot):
+        self.mbot = mbot
+
+        # _declared:
+        #   {(database_name, collection_name): {index_name: (keys, options, owner), ...}, ...}
+        self._declared = {}
+
+        # failed:
+        #   {(database_name, collection_name, index_name): error, ...}
+        self.failed = {}
+
+        self.ensured = False
+
+    def declare(self, database, collection, keys, owner=None, **options):
+        '''Declare an index on `keys`, a list of `(field, direction)` pairs, of `database.collection`.'''
+        keys = [(field, direction) for field, direction in keys]
+        name = options.pop('name', None) or index_name(keys)
+
+        self._declared.setdefault((database, collection), {})[name] = (keys, options, owner)
+
+    def collect(self):
+        '''(Re)build the declared indexes from the storage backend and the loaded plugins.'''
+        self._declared = {}
+
+        for collection, indexes in self.mbot.mongo.indexes.items():
+            for keys, options in indexes:
+                self.declare('bot_data', collection, keys, owner='Storage', **options)
+
+        for plugin in self.mbot.plugin_manager.plugins:
+            if not isinstance(plugin.indexes, dict):
+                log.error(f'the indexes of {plugin.__class__.__name__} are not a dict, ignoring them')
+                continue
+
+            for collection, indexes in plugin.indexes.items():
+                for keys, options in indexes:
+                    self.declare('plugin_data', collection, keys, owner=plugin.__class__.__name__, **options)
+
+    def _collection(self, database, collection):
+        return getattr(self.mbot.mongo, database)[collection]
+
+    async def ensure(self):
+        '''Create all declared indexes. Indexes which cannot be created are logged and kept in `failed`.'''
+        self.collect()
+        self.failed = {}
+
+        created = 0
+
+        for (database, collection), indexes in self._declared.items():
+            for name, (keys, options, owner) in indexes.items():
+                try:
+                    await self._collection(database, collection).create_index(keys, name=name, **options)
+                    created += 1
+                except PyMongoError as e:
+                    # E.g. duplicate keys for a unique index, or an index with the same name but other options.
+                    log.error(f'could not create index {name} of {database}.{collection} (declared by {owner}): {e}')
+                    self.failed[(database, collection, name)] = str(e)
+
+        self.ensured = True
+        log.info(f'ensured {created} index(es), {len(self.failed)} failed')
+
+    async def _index_stats(self, database, collection):
+        '''Return `{index_name: (key, ops, since), ...}` of the existing indexes of a collection.'''
+        coll = self._collection(database, collection)
+        indexes = {}
+
+        try:
+            async for doc in coll.aggregate([{'$indexStats': {}}]):
+                accesses = doc.get('accesses', {})
+                indexes[doc['name']] = (dict(doc['key']), accesses.get('ops'), accesses.get('since'))
+        except OperationFailure:
+            # `$indexStats` needs the `indexStats` privilege; fall back to the index definitions.
+            for name, info in (await coll.index_information()).items():
+                indexes[name] = (dict(info['key']), None, None)
+
+        return indexes
+
+    async def report(self):
+        '''
+        Compare the declared indexes against the existing ones, for every collection of `bot_data`
+        and `plugin_data`. Index usage is counted by mongo since the index was created, or since
+        the last restart of the server.
+
+        :returns: `{'database.collection': {'missing': [...], 'undeclared': [...], 'unused': [...]}, ...}`,
+            only listing collections which have any issues.
+        '''
+        self.collect()
+
+        collections = set(self._declared)
+
+        for database in ('bot_data', 'plugin_data'):
+            for collection in await getattr(self.mbot.mongo, database).list_collection_names():
+                if not collection.startswith('system.'):
+                    collections.add((database, collection))
+
+        report = {}
+
+        for database, collection in sorted(collections):
+            declared = self._declared.get((database, collection), {})
+            existing = await self._index_stats(database, collection)
+
+            issues = {
+                'missing': [name for name in declared if name not in existing],
+                'undeclared': [name for name in existing if name != '_id_' and name not in declared],
+                'unused': [
+                    {'name': name, 'since': str(since)} for name, (_, ops, since) in existing.items()
+                    if name != '_id_' and ops == 0
+                ]
+            }
+
+            if any(issues.values()):
+                report[f'{database}.{collection}'] = issues
+
+        return report
+
+    async def explain(self, database, collection, query, sort=None):
+        '''
+        Explain the plan mongo picks for `find(query)` on `database.collection`.
+
+        :returns: A dict with the stages of the winning plan, the index it uses (if any),
+            whether it scans the whole collection and its execution statistics.
+        '''
+        cursor = self._collection(database, collection).find(query)
+
+        if sort:
+            cursor = cursor.sort(sort)
+
+        plan = await cursor.explain()
+
+        winning = plan.get('queryPlanner', {}).get('winningPlan', {})
+        execution = plan.get('executionStats', {})
+        stages = _plan_stages(winning)
+
+        return {
+            'stages': stages,
+            'index': _plan_index(winning),
+            'collection_scan': 'COLLSCAN' in stages,
+            'returned': execution.get('nReturned'),
+            'keys_examined': execution.get('totalKeysExamined'),
+            'docs_examined': execution.get('totalDocsExamined'),
+            'time_ms': execution.get('executionTimeMillis')
+        }
@@ -23,18 +23,39 @@ import struct
 import signal
 import asyncio
 import logging
-from collections import defaultdict, OrderedDict
+from functools import partial
+from collections import defaultdict
 
 import gevent
-import aiohttp
 import discord
 from discord import Permissions, Forbidden
-from concurrent.futures import ThreadPoolExecutor
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 from .status import Status
+from .cache import GuildConfigCache, ResponseCache
+from .stats import StatsAggregator
+from .cooldowns import CooldownManager
+from .blacklist import BlacklistIndex
+from .ratelimit import RateLimiter
+from .guild_sync import GuildSync
+from .outbound import OutboundQueue
+from .http_client import HTTPClient
+from .executors import Executors
+from .render import RenderService
+from .menus import MenuSessions, format_options
 from .rpc import RPC, RPCServer
 from .plugin_manager import PluginManager
-from .database import Mongo
+from .indexes import IndexRegistry
+from .metrics import Metrics
+from .tracing import Tracer
+from .watchdog import LoopWatchdog
+from .tasks import TaskSupervisor
+from .accounting import PluginAccounting
+from .rest_budget import RestBudget
+from .database import open_storage
+from .db_monitor import DatabaseMonitor
+from .scope import current_scope
 
 log = logging.getLogger(__name__)
 
@@ -63,7 +84,46 @@ class mBot(discord.Client):
         self.config = config
         self.key = config.mbot.key
 
-        self.mongo = Mongo(config)
+        # Traces of a sample of the messages, see `Tracer`.
+        self.tracer = Tracer(
+            sample_rate=config.tracing.get('sample_rate', 0), buffer=config.tracing.get('buffer', 1000),
+            path=config.tracing.get('path')
+        )
+
+        # The database; mongo by default, see `open_storage`. Every operation is recorded by `self.db_monitor`.
+        self.db_monitor = DatabaseMonitor(window=config.storage.get('monitor_window', 1000))
+        self.mongo = open_storage(config, self.db_monitor)
+
+        # Background tasks of the bot and the plugins, and the resources used by each plugin;
+        # these must exist before anything which spawns tasks is created, and before the plugins are loaded.
+        self.accounting = PluginAccounting(self)
+        self.tasks = TaskSupervisor(self, caps=config.tasks.get('caps'))
+
+        guild_config_cache = config.cache.get('guild_config') or {}
+        self.guild_configs = GuildConfigCache(
+            self, maxsize=guild_config_cache.get('maxsize', 2048), ttl=guild_config_cache.get('ttl', 300)
+        )
+
+        response_cache = config.cache.get('responses') or {}
+        self.responses = ResponseCache(
+            maxsize=response_cache.get('maxsize', 1024), ttl=response_cache.get('ttl', 300),
+            ttls=response_cache.get('ttls')
+        )
+
+        self.stats = StatsAggregator(
+            self, flush_interval=config.stats.get('flush_interval', 10),
+            max_pending=config.stats.get('max_pending', 500)
+        )
+
+        self.cooldowns = CooldownManager(
+            self, flush_interval=config.cooldowns.get('flush_interval', 10),
+            retention=config.cooldowns.get('retention', 60*60*24)
+        )
+
+        self.blacklists = BlacklistIndex(
+            self, reconcile_interval=config.blacklist.get('reconcile_interval', 60*5),
+            load_timeout=config.blacklist.get('load_timeout', 2)
+        )
 
         # Load opus on Windows. On linux it should be already loaded.
         if os.name in ['nt', 'ce']:
@@ -73,43 +133,57 @@ class mBot(discord.Client):
         self.plugin_manager.load_plugins()
         self.plugin_manager.load_commands()
 
+        # Indexes are declared by the storage backend and the plugins,
+        # so they can only be created once the plugins are loaded.
+        self.indexes = IndexRegistry(self)
+        self.tasks.spawn(self.indexes.ensure(), 'mbot', 'ensure_indexes')
+
         self.rpc = RPC(self)
         self.rpc_server = None
 
-        self.executor = ThreadPoolExecutor()
-        self.loop.set_default_executor(self.executor)
+        self.executors = Executors(self, io=config.executors.get('io'))
+        self.render = RenderService(self, **config.render)
 
         self.status = Status(self)
 
-        # recent_commands:
-        #   {user_id: [cmd_timestamp, ...], ...}
-        self.recent_commands = defaultdict(list)
+        self.ratelimiter = RateLimiter(config.ratelimits)
+        self.guild_sync = GuildSync(self)
+        self.outbound = OutboundQueue(
+            self, messages=config.outbound.get('messages', 5), seconds=config.outbound.get('seconds', 5)
+        )
+        self.http_client = HTTPClient(self, **config.http)
+        self.rest = RestBudget(window=config.rest.get('window', 300))
         self.mutexes = defaultdict(asyncio.Lock)
 
+        self.watchdog = LoopWatchdog(
+            self, interval=config.watchdog.get('interval', 0.25), threshold=config.watchdog.get('threshold', 0.5),
+            history=config.watchdog.get('history', 50)
+        )
+        self.loop.call_soon(self.watchdog.start)
+
+        self.metrics = Metrics(
+            self, host=config.metrics.get('host', '127.0.0.1'), port=config.metrics.get('port', 9242)
+        )
+
+        if config.metrics.get('enabled', True):
+            self.loop.create_task(self.metrics.start())
+
+        # Users the bot is waiting on to reply to a menu, see `wait_for_input`.
+        self.menus = MenuSessions(self)
+
         # Set of all message ID's which are to be ignored when the `on_message` event is triggered.
-        # This is used to skip the `on_message` event for user input in menu-based interactions.
+        # Replies to menus are skipped by `self.menus` instead.
         self.ignored_messages = set()
 
     async def is_user_blacklisted(self, user_id, server_id=None):
         if self.perms_check(discord.User(id=user_id), su=True):
             return False, False
 
-        global_blacklist, local_blacklist = False, False
-
-        if await self.mongo.bot_data.global_blacklist.find_one({'user_id': user_id}):
-            global_blacklist = True
-
-        if server_id is not None:
-            moderator = self.plugin_manager.get_plugin('Moderator')
-
-            if await moderator.is_user_blacklisted(user_id, server_id):
-                local_blacklist = True
-
-        return global_blacklist, local_blacklist
+        return await self.blacklists.is_blacklisted(user_id, server_id)
 
     async def run_command(self, message, cfg=None, fail_silently=False, check_perms=True, global_commands=False):
         if cfg is None:
-            cfg = await self.mongo.config.find_one({'server_id': message.server.id})
+            cfg = await self.guild_configs.get(message.server.id)
 
         matched_cmd = None
 
@@ -122,21 +196,31 @@ class mBot(discord.Client):
             else:
                 return
 
-        if max(self.recent_commands.get(message.author.id, [0])) + 1 > time.time():
+        limited = self.ratelimiter.limited(message.author.id, message.channel.id, message.server.id)
+
+        if limited is not None:
             if not fail_silently:
-                await self.send_message(
-                    message.channel, f'**Whoah! You\'re doing that too often {message.author.name}!**'
-                )
+                if limited == 'user':
+                    await self.send_message(
+                        message.channel, f'**Whoah! You\'re doing that too often {message.author.name}!**'
+                    )
+                else:
+                    await self.send_message(
+                        message.channel, f'**Whoah! Too many commands are being run in this {limited}!**'
+                    )
         else:
             if not global_commands:
                 commands = await self.plugin_manager.commands_for_server(message.server.id)
             else:
                 commands = {x[0]: x[1][2] for x in self.plugin_manager.commands.items()}
 
-            for command in commands.values():
-                if command._pattern.match(message.content):
-                    self.loop.create_task(
-                        self._run_command(message, command, fail_silently=fail_silently, check_perms=check_perms)
+            # Only commands which could possibly match are checked, see `CommandIndex`.
+            for command in self.plugin_manager.command_index.candidates(message.content):
+                if command.info['name'] in commands and command._pattern.match(message.content):
+                    self.ratelimiter.hit(message.author.id, message.channel.id, message.server.id)
+                    self.tasks.spawn(
+                        self._run_command(message, command, fail_silently=fail_silently, check_perms=check_perms),
+                        command.info['plugin'], 'command'
                     )
 
                     matched_cmd = command
@@ -157,8 +241,6 @@ class mBot(discord.Client):
         return matched_cmd
 
     async def _run_command(self, message, command, fail_silently=False, check_perms=True):
-        self.recent_commands[message.author.id].append(time.time())
-
         if command._mutex is not None:
             if self.mutexes[command._mutex].locked():
                 await asyncio.sleep(5)
@@ -193,22 +275,28 @@ class mBot(discord.Client):
             Each item can take on a value of any discord.py destination objects (such
             as `Server`, `Channel`, etc.) or the string "global" to indicate a global stat.
             If a destination object has no `id` attribute the error will be ignored silently.
+
+        Plain increments are aggregated by `self.stats` and written to the database in batches.
         '''
         if op not in ('$inc', '$set'):
             op = '$inc'
 
+        scopes = [scope if isinstance(scope, str) else getattr(scope, 'id', None) for scope in scopes]
+        scopes = [scope for scope in scopes if scope is not None]
+
+        # Anything other than a plain increment is written straight away.
+        if op == '$inc' and query is None:
+            return self.stats.inc(kwargs, scopes)
+
         if query is None:
             query = {}
 
         for scope in scopes:
-            try:
-                await self.mongo.stats.update_one(
-                    {'scope': scope if isinstance(scope, str) else scope.id, **query},
-                    {op: kwargs},
-                    upsert=True
-                )
-            except AttributeError:
-                pass
+            await self.mongo.stats.update_one(
+                {'scope': scope, **query},
+                {op: kwargs},
+                upsert=True
+            )
 
     async def wait_for_input(self, message, text, timeout=20, check=None, cleanup=True):
         '''
@@ -223,20 +311,13 @@ class mBot(discord.Client):
         m = await self.send_message(message.channel, text)
 
         def check_input(msg):
-            self.ignored_messages.add(msg.id)
-
             if check is not None:
                 return check(msg) or msg.content in ['cancel', 'exit']
 
             return True
 
-        resp = await self.wait_for_message(
-            author=message.author, channel=message.channel,
-            timeout=timeout, check=check_input
-        )
-
-        if resp is not None:
-            self.ignored_messages.add(resp.id)
+        # Replies are consumed by `self.menus` in `on_message`, so they are never handled as commands.
+        resp = await self.menus.wait(message.channel.id, message.author.id, timeout, check_input)
 
         if cleanup:
             await self.delete_message(m)
@@ -265,27 +346,13 @@ class mBot(discord.Client):
         :param np: If this is `True` the option `{'np': 'Next Page'}` is added to the
             options dict. This is useful for handling paged options.
         '''
-        string = f'{header}\n\n```'
-        options = OrderedDict(sorted(options.items(), key=lambda t: t[1]))
-
-        if pp:
-            options['pp'] = '# Previous Page [<]'
-
-        if np:
-            options['np'] = '# Next Page [>]'
-
-        option_map = [(x, option) for x, option in enumerate(options)]
-
-        for x, option in option_map:
-            string += f'[{x}] {options[option]}\n'
-
-        string += f'```\n{footer or ""}'
+        string, option_map = format_options(header, options, footer, pp, np)
         choice = await self.wait_for_input(
             message, string, check=lambda msg: msg.content.isdigit(), cleanup=cleanup, timeout=timeout
         )
 
-        if choice is not None and choice.content in [str(i[0]) for i in option_map]:
-            return dict(option_map)[int(choice.content)]
+        if choice is not None and int(choice.content) in option_map:
+            return option_map[int(choice.content)]
 
     def perms_check(self, user, channel=None, required_perms=None, su=False):
         if user.id is None:
@@ -314,6 +381,18 @@ class mBot(discord.Client):
         self.rpc_server.start()
 
     async def close(self):
+        await self.tasks.shutdown()
+        await self.stats.close()
+        await self.cooldowns.close()
+        await self.guild_sync.flush()
+        await self.http_client.close()
+        self.rest.close()
+        self.executors.shutdown()
+        self.render.shutdown()
+        await self.metrics.close()
+        self.watchdog.stop()
+        self.tracer.close()
+        self.mongo.close()
         await super(mBot, self).close()
         gevent.signal(signal.SIGTERM, self.rpc_server.server.stop)
 
@@ -321,51 +400,78 @@ class mBot(discord.Client):
         '''Blocking call which runs the client using `self.key`.'''
         return super(mBot, self).run(self.key, *args, **kwargs)
 
-    async def send_file(self, destination, fp, *, filename=None, content=None, tts=False, force=False):
-        '''Sends a message to the destination given with the file given.'''
+    async def _run_event(self, event, *args, **kwargs):
+        '''Run the handler of an event; overridden to measure how long the handler takes.'''
+        start = time.perf_counter()
+
+        try:
+            await super(mBot, self)._run_event(event, *args, **kwargs)
+        finally:
+            self.metrics.observe_event(event, time.perf_counter() - start)
+
+    async def send_file(self, destination, fp, *, filename=None, content=None, tts=False, force=False,
+                        priority=None):
+        '''
+        Sends a message to the destination given with the file given.
+        Files are sent through `self.outbound`, see `send_message`.
+        '''
 
         await self.update_stats({'files_sent': 1}, scopes=['global'])
 
         if not force:
             # Check if we are in an ignored channel.
             if isinstance(destination, discord.Server):
-                cfg = await self.mongo.config.find_one({'server_id': destination.id})
+                cfg = await self.guild_configs.get(destination.id)
 
                 if destination.default_channel.id in cfg['ignored_channels']:
                     return
 
             elif isinstance(destination, (discord.Channel, discord.PrivateChannel)):
-                cfg = await self.mongo.config.find_one({'server_id': destination.server.id})
+                cfg = await self.guild_configs.get(destination.server.id)
 
                 if destination.id in cfg['ignored_channels']:
                     return
 
+        async def upload(fp, filename):
+            async def send(content):
+                return await super(mBot, self).send_file(destination, fp, filename=filename, content=content, tts=tts)
+
+            # Wrapped here, so that the upload is attributed to the caller rather than to the outbound queue.
+            send = self.rest.wrap('POST /channels/{channel_id}/messages', send)
+
+            with self.tracer.span('send_file', destination_id=destination.id):
+                return await self.outbound.send(destination.id, send, content, priority=priority)
+
         # Simple patch to the `send_file` method which adds support for the http protocol
         # and automatically downloads files before uploading them.
         # This is just a convenience function and should generally only be used
         # for one-off, small downloads.
         try:
             if fp.startswith('http://') or fp.startswith('https://'):
-                with aiohttp.ClientSession() as client:
-                    async with client.get(fp) as r:
-                        buffer = io.BytesIO(bytes(await r.read()))
+                buffer = io.BytesIO(await self.http_client.read(fp))
+                ret = await upload(buffer, filename or fp.split('/')[-1])
 
-                        ret = await super(mBot, self).send_file(
-                            destination, buffer, filename=filename or fp.split('/')[-1], content=content, tts=tts
-                        )
-
-                        buffer.close()
+                buffer.close()
 
-                        return ret
+                return ret
             else:
-                ret = await super(mBot, self).send_file(destination, fp, filename=filename, content=content, tts=tts)
+                ret = await upload(fp, filename)
                 return ret
         except AttributeError:
-            ret = await super(mBot, self).send_file(destination, fp, filename=filename, content=content, tts=tts)
+            ret = await upload(fp, filename)
             return ret
 
-    async def send_message(self, destination, content=None, *, tts=False, embed=None, force=False):
-        '''Sends a message to the destination given with the content given.'''
+    async def send_message(self, destination, content=None, *, tts=False, embed=None, force=False,
+                           priority=None, coalesce=False):
+        '''
+        Sends a message to the destination given with the content given.
+        Messages are sent through `self.outbound`, which queues them per destination.
+
+        :param priority: One of the `PRIORITY_*` constants from `mbot.outbound`. By default, messages
+            sent while running a command are treated as replies and are sent before other messages.
+        :param coalesce: If `True`, the message may be merged with other consecutive messages to the
+            same destination. Only use this if the returned message object is not going to be edited or deleted.
+        '''
 
         # Update global statistics
         await self.update_stats({'messages_sent': 1}, scopes=['global'])
@@ -376,13 +482,13 @@ class mBot(discord.Client):
         if not force:
             # Check if we are in an ignored channel.
             if isinstance(destination, discord.Server):
-                cfg = await self.mongo.config.find_one({'server_id': destination.id})
+                cfg = await self.guild_configs.get(destination.id)
 
                 if destination.default_channel.id in cfg['ignored_channels']:
                     return
 
             elif isinstance(destination, (discord.Channel, discord.PrivateChannel)):
-                cfg = await self.mongo.config.find_one({'server_id': destination.server.id})
+                cfg = await self.guild_configs.get(destination.server.id)
 
                 if destination.id in cfg['ignored_channels']:
                     return
@@ -392,79 +498,198 @@ class mBot(discord.Client):
         if content is not None:
             content = f'\u200B{content}'
 
-        ret = await super(mBot, self).send_message(destination, content, tts=tts, embed=embed)
+        # Wrapped here, so that the message is attributed to the caller rather than to the outbound queue.
+        send = self.rest.wrap(
+            'POST /channels/{channel_id}/messages', partial(super(mBot, self).send_message, destination)
+        )
+
+        with self.tracer.span('send_message', destination_id=destination.id):
+            ret = await self.outbound.send(
+                destination.id, send, content, priority=priority, coalesce=coalesce, tts=tts, embed=embed
+            )
+
         return ret
 
+    # The REST methods of `discord.Client` which the bot uses are counted by `self.rest`, see `RestBudget`.
+    # `purge_from` is counted through the deletes it makes.
+
+    async def edit_message(self, *args, **kwargs):
+        return await self.rest.call(
+            'PATCH /channels/{channel_id}/messages/{message_id}', super(mBot, self).edit_message, *args, **kwargs
+        )
+
+    async def delete_message(self, *args, **kwargs):
+        return await self.rest.call(
+            'DELETE /channels/{channel_id}/messages/{message_id}', super(mBot, self).delete_message, *args, **kwargs
+        )
+
+    async def delete_messages(self, *args, **kwargs):
+        return await self.rest.call(
+            'POST /channels/{channel_id}/messages/bulk-delete', super(mBot, self).delete_messages, *args, **kwargs
+        )
+
+    async def send_typing(self, *args, **kwargs):
+        return await self.rest.call(
+            'POST /channels/{channel_id}/typing', super(mBot, self).send_typing, *args, **kwargs
+        )
+
+    async def add_reaction(self, *args, **kwargs):
+        return await self.rest.call(
+            'PUT /channels/{channel_id}/messages/{message_id}/reactions', super(mBot, self).add_reaction,
+            *args, **kwargs
+        )
+
+    async def remove_reaction(self, *args, **kwargs):
+        return await self.rest.call(
+            'DELETE /channels/{channel_id}/messages/{message_id}/reactions', super(mBot, self).remove_reaction,
+            *args, **kwargs
+        )
+
+    async def get_user_info(self, *args, **kwargs):
+        return await self.rest.call('GET /users/{user_id}', super(mBot, self).get_user_info, *args, **kwargs)
+
+    async def kick(self, *args, **kwargs):
+        return await self.rest.call('DELETE /guilds/{guild_id}/members', super(mBot, self).kick, *args, **kwargs)
+
+    async def ban(self, *args, **kwargs):
+        return await self.rest.call('PUT /guilds/{guild_id}/bans', super(mBot, self).ban, *args, **kwargs)
+
+    async def unban(self, *args, **kwargs):
+        return await self.rest.call('DELETE /guilds/{guild_id}/bans', super(mBot, self).unban, *args, **kwargs)
+
+    async def leave_server(self, *args, **kwargs):
+        return await self.rest.call('DELETE /users/@me/guilds', super(mBot, self).leave_server, *args, **kwargs)
+
+    async def application_info(self, *args, **kwargs):
+        return await self.rest.call(
+            'GET /oauth2/applications/@me', super(mBot, self).application_info, *args, **kwargs
+        )
+
+    def _default_config(self, server_id):
+        plugins = []
+
+        for plugin in self.plugin_manager.plugins:
+            plugins.append(
+                {
+                    'name': plugin.__class__.__name__,
+                    'commands': [command.info['name'] for command in plugin.commands]
+                }
+            )
+
+        return {
+            'server_id': server_id,
+            'prefix': self.config.mbot.cmd_prefix,  # Default command prefix.
+            'plugins': plugins,  # List of enabled plugins and their commands.
+
+            # Ignored channels are channels in which the bot cannot talk.
+            # All commands are ignored in these channels, and messages or files cannot
+            # be sent to them. The only exceptions are when an admin runs either the `ignore`
+            # or `unignore` command. All events still triger normally in these channels.
+            'ignored_channels': [],
+            'nsfw_channels': []  # Some commands may be nsfw and can only be run in nsfw channels.
+        }
+
+    async def _create_configs(self, server_ids):
+        '''
+        Create a default configuration for every server in `server_ids` which does not have one yet.
+        Returns the number of configs which were created.
+        '''
+        server_ids = set(server_ids)
+
+        existing = set()
+        async for doc in self.mongo.config.find({'server_id': {'$in': list(server_ids)}}, {'server_id': 1, '_id': 0}):
+            existing.add(doc['server_id'])
+
+        missing = server_ids - existing
+
+        if missing:
+            try:
+                await self.mongo.config.insert_many([self._default_config(x) for x in missing], ordered=False)
+            except BulkWriteError:
+                # Most likely a config was created concurrently, e.g. by `on_server_join`.
+                log.exception('error while creating server configs')
+
+            for server_id in missing:
+                self.guild_configs.invalidate(server_id)
+
+        return len(missing)
+
     async def _create_config(self, server_id):
         '''Create a default configuration for a new server.'''
-        cfg = await self.mongo.config.find_one({'server_id': server_id})
+        await self._create_configs([server_id])
 
-        if cfg is None:
-            plugins = []
-
-            for plugin in self.plugin_manager.plugins:
-                plugins.append(
-                    {
-                        'name': plugin.__class__.__name__,
-                        'commands': [command.info['name'] for command in plugin.commands]
-                    }
-                )
+    async def _update_bot_guilds(self, guilds=None, chunk_size=500):
+        if guilds is None:
+            return
 
-            cfg = {
-                'server_id': server_id,
-                'prefix': self.config.mbot.cmd_prefix,  # Default command prefix.
-                'plugins': plugins,  # List of enabled plugins and their commands.
-
-                # Ignored channels are channels in which the bot cannot talk.
-                # All commands are ignored in these channels, and messages or files cannot
-                # be sent to them. The only exceptions are when an admin runs either the `ignore`
-                # or `unignore` command. All events still triger normally in these channels.
-                'ignored_channels': [],
-                'nsfw_channels': []  # Some commands may be nsfw and can only be run in nsfw channels.
-            }
-
-            await self.mongo.config.insert_one(cfg)
-
-    async def _update_bot_guilds(self, guilds=None):
-        if guilds is not None:
-            for guild in guilds:
-                await self.mongo.bot_guilds.update_one(
-                    {'server_id': guild.id},
-                    {'$set': {
-                        'name': guild.name,
-                        'owner': guild.owner.id,
-                        'icon': guild.icon,
-                        'channels': [
-                            {
-                                'id': channel.id,
-                                'name': channel.name,
-                                'type': str(channel.type)
-                            } for channel in guild.channels
-                        ]
-                    }},
-                    upsert=True
-                )
+        requests = [
+            UpdateOne(
+                {'server_id': guild.id},
+                {'$set': {
+                    'name': guild.name,
+                    'owner': guild.owner.id,
+                    'icon': guild.icon,
+                    'channels': [
+                        {
+                            'id': channel.id,
+                            'name': channel.name,
+                            'type': str(channel.type)
+                        } for channel in guild.channels
+                    ]
+                }},
+                upsert=True
+            ) for guild in guilds
+        ]
+
+        for x in range(0, len(requests), chunk_size):
+            await self.mongo.bot_guilds.bulk_write(requests[x:x + chunk_size], ordered=False)
 
     async def _delete_bot_guild(self, server_id):
         await self.mongo.bot_guilds.delete_one(
             {'server_id': server_id}
         )
 
+    async def _dispatch_plugins(self, event, server_id, *args, exclude=None):
+        '''
+        Schedule the `event` handler of every plugin which subscribes to it, passing `args`.
+        If `server_id` is given, only plugins which are enabled in that server are considered.
+        `exclude` is the name of a plugin which should be skipped.
+        '''
+        plugins = self.plugin_manager.subscribers(event, *args)
+
+        if not plugins:
+            return
+
+        if server_id is not None:
+            enabled = await self.plugin_manager.plugins_for_server(server_id)
+            plugins = [plugin for plugin in plugins if plugin.__class__.__name__ in enabled]
+
+        for plugin in plugins:
+            if plugin.__class__.__name__ != exclude:
+                self.tasks.spawn(getattr(plugin, event)(*args), plugin.__class__.__name__, event)
+
     async def on_ready(self):
         '''Called when the client is done preparing the data received from Discord.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
 
         # Check if server settings exist and create them if not.
-        for server in self.servers:
-            await self._create_config(server.id)
+        servers = list(self.servers)
+        start = time.time()
+
+        created = await self._create_configs([server.id for server in servers])
+        configs_done = time.time()
 
-        await self._update_bot_guilds(self.servers)
+        await self._update_bot_guilds(servers)
+
+        log.info(
+            f'bootstrapped {len(servers)} guild(s) in {time.time() - start:.2f}s; created {created} config(s) '
+            f'in {configs_done - start:.2f}s, updated guild data in {time.time() - configs_done:.2f}s'
+        )
 
         # Update global statistics
         await self.update_stats({'num_guilds': len(self.servers)}, scopes=['global'], op='$set')
 
-        for plugin in self.plugin_manager.plugins:
-            self.loop.create_task(plugin.on_ready())
+        await self._dispatch_plugins('on_ready', None)
 
         self.run_rpc_server()
 
@@ -472,34 +697,24 @@ class mBot(discord.Client):
         '''Called when the client has resumed a session.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
 
-        for plugin in self.plugin_manager.plugins:
-            self.loop.create_task(plugin.on_resumed())
+        await self._dispatch_plugins('on_resumed', None)
 
     # async def on_error(self, event, *args, **kwargs):
     #    '''Suppress the default action of printing the traceback.'''
     #    for plugin in self.plugin_manager.plugins:
     #        self.loop.create_task(plugin.on_error(event, *args, **kwargs))
 
-    def clean_commands_cache(self):
-        timestamp = time.time()
-        cache_copy = self.recent_commands.copy()
-
-        for entry in cache_copy:
-            # We only want to keep most recent commands, ie. commands at most 5 seconds old.
-            filtered_records = [x for x in cache_copy[entry] if x + 5 > timestamp]
-
-            if filtered_records:
-                if filtered_records == cache_copy[entry]:
-                    continue
-
-                self.recent_commands[entry] = filtered_records
-            else:
-                del self.recent_commands[entry]
-
     async def on_message(self, message):
         '''Called when a message is created and sent to a server.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
 
+        current_scope.set('mbot.on_message')
+        self.db_monitor.message_started()
+
+        with self.tracer.trace('on_message', message_id=message.id, channel_id=message.channel.id):
+            await self._handle_message(message)
+
+    async def _handle_message(self, message):
         await self.update_stats({'messages_received': 1}, scopes=['global', message.server])
 
         if message.channel.is_private:
@@ -511,10 +726,13 @@ class mBot(discord.Client):
         if message.id in self.ignored_messages:
             return self.ignored_messages.remove(message.id)
 
+        if self.menus.feed(message):
+            return
+
         if any(await self.is_user_blacklisted(message.author.id, message.server.id)):
             return
 
-        cfg = await self.mongo.config.find_one({'server_id': message.server.id})
+        cfg = await self.guild_configs.get(message.server.id)
 
         # When the bot is mentioned with no arguments, reply with a default help command.
         # Otherwise we try to process the command normally as if it was ran with a prefix.
@@ -538,131 +756,99 @@ class mBot(discord.Client):
 
         if message.content.startswith(cfg['prefix']):
             message.content = message.content[len(cfg['prefix']):]
-            matched_cmd = await self.run_command(message, cfg)
-            self.clean_commands_cache()
 
-        plugins = await self.plugin_manager.plugins_for_server(message.server.id)
+            with self.tracer.span('run_command'):
+                matched_cmd = await self.run_command(message, cfg)
 
-        for plugin in plugins.values():
-            # If a command was called for a plugin, we ignore that plugin's `on_message` event.
-            # If it needs to be called, the `call_on_message` argument of the `command` decorator
-            # should be set to `True`.
-            if matched_cmd is None or matched_cmd.info['plugin'] != plugin.__class__.__name__:
-                self.loop.create_task(plugin.on_message(message))
+        # If a command was called for a plugin, we ignore that plugin's `on_message` event.
+        # If it needs to be called, the `call_on_message` argument of the `command` decorator
+        # should be set to `True`.
+        await self._dispatch_plugins(
+            'on_message', message.server.id, message, exclude=matched_cmd.info['plugin'] if matched_cmd else None
+        )
 
     async def on_socket_raw_receive(self, msg):
         '''Called whenever a message is received from the websocket.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
 
-        for plugin in self.plugin_manager.plugins:
-            self.loop.create_task(plugin.on_socket_raw_receive(msg))
+        self.metrics.socket_received(msg)
+
+        await self._dispatch_plugins('on_socket_raw_receive', None, msg)
 
     async def on_socket_raw_send(self, payload):
         '''Called whenever a send operation is done on the websocket.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
 
-        for plugin in self.plugin_manager.plugins:
-            self.loop.create_task(plugin.on_socket_raw_send(payload))
+        self.metrics.socket_sent(payload)
+
+        await self._dispatch_plugins('on_socket_raw_send', None, payload)
 
     async def on_message_delete(self, message):
         '''Called when a message is deleted.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(message.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_message_delete(message))
+        await self._dispatch_plugins('on_message_delete', message.server.id, message)
 
     async def on_message_edit(self, before, after):
         '''Called when a message receives an update event.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(before.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_message_edit(before, after))
+        await self._dispatch_plugins('on_message_edit', before.server.id, before, after)
 
     async def on_reaction_add(self, reaction, user):
         '''Called when a message has a reaction added to it.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(reaction.message.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_reaction_add(reaction, user))
+        await self._dispatch_plugins('on_reaction_add', reaction.message.server.id, reaction, user)
 
     async def on_reaction_remove(self, reaction, user):
         '''Called when a message has a reaction removed from it.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(reaction.message.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_reaction_remove(reaction, user))
+        await self._dispatch_plugins('on_reaction_remove', reaction.message.server.id, reaction, user)
 
     async def on_reaction_clear(self, message, reactions):
         '''Called when a message has all its reactions removed from it.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(message.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_rection_clear(message, reactions))
+        await self._dispatch_plugins('on_reaction_clear', message.server.id, message, reactions)
 
     async def on_channel_delete(self, channel):
         '''Called whenever a channel is removed from a server.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        await self._update_bot_guilds(guilds=[channel.server])
-
-        plugins = await self.plugin_manager.plugins_for_server(channel.server.id)
+        self.guild_sync.channel_deleted(channel)
 
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_channel_delete(channel))
+        await self._dispatch_plugins('on_channel_delete', channel.server.id, channel)
 
     async def on_channel_create(self, channel):
         '''Called whenever a channel is added to a server.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
 
         try:
-            await self._update_bot_guilds(guilds=[channel.server])
-            plugins = await self.plugin_manager.plugins_for_server(channel.server.id)
+            self.guild_sync.channel_created(channel)
+            await self._dispatch_plugins('on_channel_create', channel.server.id, channel)
         except AttributeError:
             return
 
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_channel_create(channel))
-
     async def on_channel_update(self, before, after):
         '''Called whenever a channel is updated.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
 
         try:
-            await self._update_bot_guilds(guilds=[after.server])
-            plugins = await self.plugin_manager.plugins_for_server(before.server.id)
+            self.guild_sync.channel_updated(before, after)
+            await self._dispatch_plugins('on_channel_update', before.server.id, before, after)
         except AttributeError:
             return
 
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_channel_update(before, after))
-
     async def on_member_join(self, member):
         '''Called when a member joins a server.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(member.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_member_join(member))
+        await self._dispatch_plugins('on_member_join', member.server.id, member)
 
     async def on_member_remove(self, member):
         '''Called when a member leaves a server.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(member.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_member_remove(member))
+        await self._dispatch_plugins('on_member_remove', member.server.id, member)
 
     async def on_member_update(self, before, after):
         '''Called when a member updates their profile.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(before.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_member_update(before, after))
+        await self._dispatch_plugins('on_member_update', before.server.id, before, after)
 
     async def on_server_join(self, server):
         '''Called when a server is either created by the client or when the client joins a server.'''
@@ -672,10 +858,7 @@ class mBot(discord.Client):
         await self._update_bot_guilds(guilds=[server])
         await self.update_stats({'num_guilds': 1}, scopes=['global'])
 
-        plugins = await self.plugin_manager.plugins_for_server(server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_join(server))
+        await self._dispatch_plugins('on_server_join', server.id, server)
 
     async def on_server_remove(self, server):
         '''Called when a server is removed from the client.'''
@@ -684,113 +867,71 @@ class mBot(discord.Client):
         await self._delete_bot_guild(server.id)
         await self.update_stats({'num_guilds': -1}, scopes=['global'])
 
-        plugins = await self.plugin_manager.plugins_for_server(server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_remove(server))
+        await self._dispatch_plugins('on_server_remove', server.id, server)
 
     async def on_server_update(self, before, after):
         '''Called when a server updates.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        await self._update_bot_guilds(guilds=[after])
+        await self.guild_sync.server_updated(before, after)
 
-        plugins = await self.plugin_manager.plugins_for_server(before.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_update(before, after))
+        await self._dispatch_plugins('on_server_update', before.id, before, after)
 
     async def on_server_role_create(self, role):
         '''Called when a server creates a new role.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(role.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_role_create(role))
+        await self._dispatch_plugins('on_server_role_create', role.server.id, role)
 
     async def on_server_role_delete(self, role):
         '''Called when a server deletes a role.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(role.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_role_delete(role))
+        await self._dispatch_plugins('on_server_role_delete', role.server.id, role)
 
     async def on_server_role_update(self, before, after):
         '''Called when a role is changed server-wide.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(before.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_role_update(before, after))
+        await self._dispatch_plugins('on_server_role_update', before.server.id, before, after)
 
     async def on_server_emojis_update(self, before, after):
         '''Called when a server adds or removes Emoji.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(before.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_emojis_update(before, after))
+        await self._dispatch_plugins('on_server_emojis_update', before.server.id, before, after)
 
     async def on_server_available(self, server):
         '''Called when a server becomes available.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_available(server))
+        await self._dispatch_plugins('on_server_available', server.id, server)
 
     async def on_server_unavailable(self, server):
         '''Called when a server becomes unavailable.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_server_unavailable(server))
+        await self._dispatch_plugins('on_server_unavailable', server.id, server)
 
     async def on_voice_state_update(self, before, after):
         '''Called when a member changes their voice state.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(before.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_voice_state_update(before, after))
+        await self._dispatch_plugins('on_voice_state_update', before.server.id, before, after)
 
     async def on_member_ban(self, member):
         '''Called when a member gets banned from a server.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(member.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_member_ban(member))
+        await self._dispatch_plugins('on_member_ban', member.server.id, member)
 
     async def on_member_unban(self, server, user):
         '''Called when a user gets unbanned from a server.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_member_unban(server, user))
+        await self._dispatch_plugins('on_member_unban', server.id, server, user)
 
     async def on_typing(self, channel, user, when):
         '''Called when someone begins typing a message.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(channel.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_typing(channel, user, when))
+        await self._dispatch_plugins('on_typing', channel.server.id, channel, user, when)
 
     async def on_group_join(self, channel, user):
         '''Called when someone joins a group.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(channel.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_group_join(channel, user))
+        await self._dispatch_plugins('on_group_join', channel.server.id, channel, user)
 
     async def on_group_remove(self, channel, user):
         '''Called when someone leaves a group.'''
         log.debug(f'{sys._getframe().f_code.co_name} event triggered')
-        plugins = await self.plugin_manager.plugins_for_server(channel.server.id)
-
-        for plugin in plugins.values():
-            self.loop.create_task(plugin.on_group_remove(channel, user))
+        await self._dispatch_plugins('on_group_remove', channel.server.id, channel, user)
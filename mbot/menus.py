@@ -0,0 +1,329 @@
+import time
+import logging
+from collections import OrderedDict
+
+import asyncio
+from discord import Forbidden, HTTPException
+
+log = logging.getLogger(__name__)
+
+# Reactions used to page through menus.
+PREVIOUS_PAGE = '\u25c0'
+NEXT_PAGE = '\u25b6'
+
+
+def format_options(header, options, footer=None, pp=False, np=False):
+    '''
+    Format the text of an option menu, see `mBot.option_selector`.
+    Return a tuple of `(text, {option_number: option, ...})`.
+    '''
+    string = f'{header}\n\n```'
+    options = OrderedDict(sorted(options.items(), key=lambda t: t[1]))
+
+    if pp:
+        options['pp'] = '# Previous Page [<]'
+
+    if np:
+        options['np'] = '# Next Page [>]'
+
+    option_map = dict(enumerate(options))
+
+    for x, option in option_map.items():
+        string += f'[{x}] {options[option]}\n'
+
+    string += f'```\n{footer or ""}'
+    return string, option_map
+
+
+class _Session(object):
+    __slots__ = ('key', 'check', 'future', 'expires_at', 'expires_tick')
+
+    def __init__(self, key, check, future, expires_at):
+        self.key = key
+        self.check = check
+        self.future = future
+        self.expires_at = expires_at
+        self.expires_tick = None
+
+
+class MenuSessions(object):
+    '''
+    Pending menu sessions, i.e. users who the bot is waiting on to reply to a prompt.
+    Sessions are indexed by `(channel_id, author_id)`, so every incoming message only has to
+    be checked against the sessions of its author in its channel. Sessions which time out are
+    expired using a timing wheel rather than a timer per session.
+    '''
+    def __init__(self, mbot, tick=1, slots=64):
+        self.mbot = mbot
+        self.tick = tick
+
+        # _sessions:
+        #   {(channel_id, author_id): [_Session, ...], ...}
+        self._sessions = {}
+
+        # _wheel:
+        #   [{_Session, ...}, ...]
+        self._wheel = [set() for _ in range(slots)]
+        self._current_tick = int(time.monotonic() // tick)
+        self._ticker = None
+
+        self.resolved = 0
+        self.expired = 0
+
+    def __len__(self):
+        return sum(len(sessions) for sessions in self._sessions.values())
+
+    def _schedule(self, session):
+        tick = int(session.expires_at // self.tick) + 1
+
+        # Sessions which expire after the wheel's span are rescheduled when their slot comes up.
+        tick = min(tick, self._current_tick + len(self._wheel) - 1)
+
+        session.expires_tick = tick
+        self._wheel[tick % len(self._wheel)].add(session)
+
+    def _remove(self, session):
+        sessions = self._sessions.get(session.key)
+
+        if sessions is not None and session in sessions:
+            sessions.remove(session)
+
+            if not sessions:
+                del self._sessions[session.key]
+
+        if session.expires_tick is not None:
+            self._wheel[session.expires_tick % len(self._wheel)].discard(session)
+
+    def _expire(self, now):
+        tick = int(now // self.tick)
+        ticks = min(tick - self._current_tick, len(self._wheel))
+
+        # Sessions which have not expired yet are rescheduled once the wheel has advanced, see `RateLimiter._expire`.
+        self._current_tick = tick
+        pending = []
+
+        for t in range(tick - ticks + 1, tick + 1):
+            slot = self._wheel[t % len(self._wheel)]
+            self._wheel[t % len(self._wheel)] = set()
+
+            for session in slot:
+                if session.expires_at <= now:
+                    session.expires_tick = None
+                    self._remove(session)
+
+                    if not session.future.done():
+                        self.expired += 1
+                        session.future.set_result(None)
+                else:
+                    pending.append(session)
+
+        for session in pending:
+            self._schedule(session)
+
+    async def _tick_loop(self):
+        while self._sessions:
+            await asyncio.sleep(self.tick)
+            self._expire(time.monotonic())
+
+    async def wait(self, channel_id, author_id, timeout, check=None):
+        '''
+        Wait for the next message by `author_id` in `channel_id` for which `check` returns
+        `True`. Return the message, or `None` if none was received within `timeout` seconds.
+        '''
+        if not self._sessions:
+            # The wheel has been idle; skip straight to the current tick.
+            self._current_tick = int(time.monotonic() // self.tick)
+
+        key = (channel_id, author_id)
+        session = _Session(key, check, self.mbot.loop.create_future(), time.monotonic() + timeout)
+
+        self._sessions.setdefault(key, []).append(session)
+        self._schedule(session)
+
+        if self._ticker is None or self._ticker.done():
+            self._ticker = self.mbot.tasks.spawn(self._tick_loop(), 'mbot', 'expire_menus', key='ticker')
+
+        try:
+            return await session.future
+        finally:
+            self._remove(session)
+
+    def feed(self, message):
+        '''
+        Hand a message to the oldest session it answers. Return `True` if the message
+        was consumed by a session, in which case it should not be processed any further.
+        '''
+        sessions = self._sessions.get((message.channel.id, message.author.id))
+
+        if not sessions:
+            return False
+
+        for session in list(sessions):
+            if session.future.done():
+                continue
+
+            try:
+                accepted = session.check is None or session.check(message)
+            except Exception:
+                log.exception('error in menu session check')
+                accepted = False
+
+            if accepted:
+                self._remove(session)
+                session.future.set_result(message)
+                self.resolved += 1
+
+                return True
+
+        return False
+
+    def stats(self):
+        return {'sessions': len(self), 'resolved': self.resolved, 'expired': self.expired}
+
+
+class Menu(object):
+    '''
+    Paginated option menu which is shown as a single message. Turning a page edits that
+    message in place instead of sending a new one, pages can also be turned with reactions,
+    and the menu along with all the replies it consumed is removed with a single bulk delete
+    when it is closed. Menus should always be closed once they are no longer needed:
+
+        menu = Menu(self.mbot, message)
+
+        try:
+            option = await menu.select(header, options, np=True)
+        finally:
+            await menu.close()
+    '''
+    def __init__(self, mbot, message, timeout=20, reactions=True):
+        self.mbot = mbot
+        self.message = message
+        self.timeout = timeout
+        self.reactions = reactions
+
+        self._menu = None
+        self._reacted = False
+        self._replies = []
+
+    async def _show(self, content):
+        if self._menu is None:
+            self._menu = await self.mbot.send_message(self.message.channel, content)
+            return
+
+        # Edits keep the zero-width space prefix which `mBot.send_message` adds to every message.
+        content = f'\u200B{content}'
+
+        if self._menu.content != content:
+            self._menu = await self.mbot.edit_message(self._menu, content)
+
+    async def _add_reactions(self):
+        if self._reacted or not self.reactions:
+            return
+
+        self._reacted = True
+
+        try:
+            for emoji in (PREVIOUS_PAGE, NEXT_PAGE):
+                await self.mbot.add_reaction(self._menu, emoji)
+        except (Forbidden, HTTPException):
+            self.reactions = False
+
+    async def _wait(self, check):
+        '''Wait for a reply or a page reaction. Return the reply, `'pp'`/`'np'`, or `None` on timeout.'''
+        reply = self.mbot.tasks.spawn(
+            self.mbot.menus.wait(self.message.channel.id, self.message.author.id, self.timeout, check),
+            'mbot', 'menu_reply'
+        )
+        tasks = [reply]
+
+        if self._reacted and self.reactions:
+            tasks.append(self.mbot.tasks.spawn(self.mbot.wait_for_reaction(
+                [PREVIOUS_PAGE, NEXT_PAGE], user=self.message.author, timeout=self.timeout, message=self._menu
+            ), 'mbot', 'menu_reaction'))
+
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        if reply in done:
+            resp = reply.result()
+
+            if resp is not None:
+                self._replies.append(resp)
+
+            return resp
+
+        pressed = tasks[1].result()
+
+        if pressed is None:
+            return None
+
+        try:
+            # So that the same reaction can be used to turn the page again.
+            await self.mbot.remove_reaction(self._menu, pressed.reaction.emoji, pressed.user)
+        except (Forbidden, HTTPException):
+            pass
+
+        return 'pp' if pressed.reaction.emoji == PREVIOUS_PAGE else 'np'
+
+    async def select(self, header, options, footer=None, pp=False, np=False):
+        '''
+        Show a page of options and return the option which was selected, or `None` if the
+        menu timed out or was cancelled. The arguments are the same as for `mBot.option_selector`.
+        '''
+        string, option_map = format_options(header, options, footer, pp, np)
+        string += (
+            f'\n\n*this times out after {self.timeout} second(s); '
+            'you can also type **exit** or **cancel** to ignore this*'
+        )
+
+        await self._show(string)
+
+        if self._menu is None:
+            return None
+
+        if pp or np:
+            await self._add_reactions()
+
+        while True:
+            choice = await self._wait(lambda msg: msg.content.isdigit() or msg.content in ['cancel', 'exit'])
+
+            if choice is None:
+                return None
+
+            if choice in ('pp', 'np'):
+                # Reactions are shown on every page, so they might not lead anywhere.
+                if (choice == 'pp' and pp) or (choice == 'np' and np):
+                    return choice
+
+                continue
+
+            if choice.content in ['cancel', 'exit']:
+                return None
+
+            if int(choice.content) in option_map:
+                return option_map[int(choice.content)]
+
+    async def close(self):
+        '''Delete the menu and the replies to it. The menu can be shown again afterwards.'''
+        messages = [m for m in [self._menu] + self._replies if m is not None]
+        menu, self._menu, self._replies, self._reacted = self._menu, None, [], False
+
+        if not messages:
+            return
+
+        try:
+            if len(messages) == 1:
+                await self.mbot.delete_message(messages[0])
+            else:
+                await self.mbot.delete_messages(messages)
+        except (Forbidden, HTTPException):
+            # Without the manage messages permission, we can still delete our own message.
+            if menu is not None:
+                try:
+                    await self.mbot.delete_message(menu)
+                except (Forbidden, HTTPException):
+                    pass
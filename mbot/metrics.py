@@ -0,0 +1,259 @@
+import time
+import logging
+
+import asyncio
+
+from .histogram import Histogram
+
+log = logging.getLogger(__name__)
+
+# Gateway opcodes of a heartbeat and its acknowledgement.
+OP_HEARTBEAT = 1
+OP_HEARTBEAT_ACK = 11
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Exposition(object):
+    '''
+    Builder of a metrics page in the Prometheus text exposition format. Samples are grouped
+    by metric, so the samples of a metric can be added in any order.
+    '''
+    def __init__(self):
+        # _metrics:
+        #   {name: [header_line, ..., sample_line, ...], ...}
+        self._metrics = {}
+
+    def _sample(self, name, kind, help, line):
+        if name not in self._metrics:
+            self._metrics[name] = [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+
+        self._metrics[name].append(line)
+
+    def gauge(self, name, value, help, **labels):
+        self._sample(name, 'gauge', help, f'{name}{_labels(labels)} {value}')
+
+    def counter(self, name, value, help, **labels):
+        self._sample(name, 'counter', help, f'{name}{_labels(labels)} {value}')
+
+    def histogram(self, name, histogram, help, **labels):
+        cumulative = 0
+
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            self._sample(name, 'histogram', help, f'{name}_bucket{_labels({**labels, "le": bound})} {cumulative}')
+
+        self._sample(name, 'histogram', help, f'{name}_bucket{_labels({**labels, "le": "+Inf"})} {histogram.count}')
+        self._sample(name, 'histogram', help, f'{name}_sum{_labels(labels)} {histogram.sum}')
+        self._sample(name, 'histogram', help, f'{name}_count{_labels(labels)} {histogram.count}')
+
+    def render(self):
+        return '\n'.join(line for lines in self._metrics.values() for line in lines) + '\n'
+
+
+class Metrics(object):
+    '''
+    Runtime metrics of the shard, served in the Prometheus text format at `/metrics` on
+    `port + shard_id + 1`, like the RPC server. Latencies are measured as they happen;
+    everything else (queue depths, cache counters, ...) is read from the other subsystems
+    when the page is scraped.
+    '''
+    def __init__(self, mbot, host='127.0.0.1', port=9242):
+        self.mbot = mbot
+        self.host = host
+        self.port = port + mbot.shard_id + 1
+
+        self._server = None
+
+        # commands:
+        #   {command_name: Histogram, ...}
+        self.commands = {}
+
+        # events:
+        #   {event_name: Histogram, ...}
+        self.events = {}
+
+        self.heartbeat = Histogram()
+        self.heartbeat_latency = 0
+        self._heartbeat_sent = None
+
+    def observe_command(self, name, seconds):
+        if name not in self.commands:
+            self.commands[name] = Histogram()
+
+        self.commands[name].observe(seconds)
+
+    def observe_event(self, event, seconds):
+        if event not in self.events:
+            self.events[event] = Histogram()
+
+        self.events[event].observe(seconds)
+
+    def socket_sent(self, payload):
+        '''Called with every payload sent on the gateway; heartbeats start a latency measurement.'''
+        if isinstance(payload, str) and payload.startswith(f'{{"op": {OP_HEARTBEAT},'):
+            self._heartbeat_sent = time.perf_counter()
+
+    def socket_received(self, msg):
+        '''Called with every message received from the gateway; acknowledgements end a latency measurement.'''
+        if self._heartbeat_sent is None or not isinstance(msg, str) or len(msg) > 64:
+            return
+
+        if f'"op":{OP_HEARTBEAT_ACK}' in msg.replace(' ', ''):
+            self.heartbeat_latency = time.perf_counter() - self._heartbeat_sent
+            self.heartbeat.observe(self.heartbeat_latency)
+            self._heartbeat_sent = None
+
+    async def start(self):
+        try:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            log.error(f'could not serve metrics on {self.host}:{self.port}: {e}')
+            return
+
+        log.info(f'serving metrics on {self.host}:{self.port}')
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+
+            # Skip the headers; the request has no body.
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+
+            parts = request.decode('latin-1').split()
+
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+
+            writer.write(
+                f'HTTP/1.0 {status}\r\n'
+                'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'.encode() + body
+            )
+
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            log.exception('error while serving metrics')
+        finally:
+            writer.close()
+
+    def render(self):
+        '''Return the metrics page.'''
+        page = Exposition()
+
+        for name, histogram in sorted(self.commands.items()):
+            page.histogram('mbot_command_seconds', histogram, 'Time taken to run a command.', command=name)
+
+        for event, histogram in sorted(self.events.items()):
+            page.histogram('mbot_event_seconds', histogram, 'Time taken by an event handler.', event=event)
+
+        page.histogram('mbot_heartbeat_seconds', self.heartbeat, 'Gateway heartbeat round trip time.')
+        page.gauge('mbot_heartbeat_latency_seconds', self.heartbeat_latency, 'Last gateway heartbeat round trip time.')
+
+        watchdog = self.mbot.watchdog
+        page.histogram('mbot_loop_lag_seconds', watchdog.lag, 'Delay of the event loop in running a callback.')
+        page.gauge('mbot_loop_lag_last_seconds', watchdog.last_lag, 'Last measured delay of the event loop.')
+
+        for plugin, counters in sorted(watchdog.plugins.items()):
+            page.counter(
+                'mbot_loop_stalls_total', counters['stalls'], 'Times the event loop was blocked.', plugin=plugin
+            )
+            page.counter(
+                'mbot_loop_stalled_seconds_total', counters['seconds'], 'Time the event loop was blocked for.',
+                plugin=plugin
+            )
+        page.gauge('mbot_tasks', len(asyncio.all_tasks(self.mbot.loop)), 'Tasks which are not done.')
+
+        for group, stats in sorted(self.mbot.tasks.stats().items()):
+            page.gauge('mbot_task_group_live', stats['live'], 'Live tasks of a task group.', group=group)
+            page.counter('mbot_task_group_failed_total', stats['failed'], 'Tasks which raised.', group=group)
+            page.counter(
+                'mbot_task_group_rejected_total', stats['rejected'], 'Tasks not started due to the cap of the group.',
+                group=group
+            )
+
+        for plugin, usage in sorted(self.mbot.accounting.stats().items()):
+            page.counter(
+                'mbot_plugin_cpu_seconds_total', usage['cpu'], 'CPU time of the tasks of a plugin.', plugin=plugin
+            )
+            page.counter(
+                'mbot_plugin_http_calls_total', usage['http_calls'], 'HTTP calls made by a plugin.', plugin=plugin
+            )
+
+        for (route, caller), (calls, rate_limited, failed, seconds) in sorted(self.mbot.rest.totals.items()):
+            page.counter('mbot_rest_calls_total', calls, 'Discord REST calls.', route=route, caller=caller)
+            page.counter(
+                'mbot_rest_rate_limited_total', rate_limited, 'Discord REST calls which got a 429.',
+                route=route, caller=caller
+            )
+
+        for route, stats in self.mbot.rest.stats(top=None)['routes'].items():
+            page.gauge(
+                'mbot_rest_calls_per_minute', stats['per_minute'],
+                'Discord REST calls per minute over the rolling window.', route=route
+            )
+
+        self._render_queues(page)
+        self._render_caches(page)
+
+        for op in self.mbot.db_monitor.stats(top=None)['operations']:
+            page.counter(
+                'mbot_db_operations_total', op['count'], 'Database operations.',
+                collection=op['collection'], operation=op['operation']
+            )
+
+            page.counter(
+                'mbot_db_operation_seconds_total', op['sum'], 'Time taken by database operations.',
+                collection=op['collection'], operation=op['operation']
+            )
+
+        return page.render()
+
+    def _render_queues(self, page):
+        executors = {**self.mbot.executors.stats(), 'render': self.mbot.render.stats()}
+
+        for executor, stats in executors.items():
+            page.gauge('mbot_executor_queued', stats['queued'], 'Jobs waiting for a worker.', executor=executor)
+            page.gauge('mbot_executor_running', stats['running'], 'Jobs being run.', executor=executor)
+            page.counter('mbot_executor_rejected_total', stats['rejected'], 'Jobs rejected.', executor=executor)
+
+        outbound = self.mbot.outbound.stats()
+        page.gauge('mbot_outbound_queued', outbound['queued'], 'Messages waiting to be sent.')
+        page.counter('mbot_outbound_sent_total', outbound['sent'], 'Messages sent.')
+        page.counter('mbot_outbound_rate_limited_total', outbound['rate_limited'], 'Sends which were rate limited.')
+
+    def _render_caches(self, page):
+        caches = {'guild_configs': self.mbot.guild_configs.stats()}
+
+        for endpoint, counters in self.mbot.responses.stats()['endpoints'].items():
+            caches[f'responses:{endpoint}'] = counters
+
+        for cache, stats in caches.items():
+            lookups = stats['hits'] + stats['misses']
+
+            page.counter('mbot_cache_hits_total', stats['hits'], 'Cache hits.', cache=cache)
+            page.counter('mbot_cache_misses_total', stats['misses'], 'Cache misses.', cache=cache)
+            page.gauge(
+                'mbot_cache_hit_ratio', stats['hits'] / lookups if lookups else 0,
+                'Hits per lookup since startup.', cache=cache
+            )
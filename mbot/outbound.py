@@ -0,0 +1,168 @@
+import time
+import heapq
+import logging
+import itertools
+from contextvars import ContextVar, Context
+
+import asyncio
+from discord import HTTPException
+
+from .ratelimit import RateLimiter
+
+log = logging.getLogger(__name__)
+
+# Priority classes; lower values are sent first.
+PRIORITY_REPLY = 0  # Replies to commands.
+PRIORITY_NORMAL = 1  # Everything else, eg. messages sent from `on_message` handlers.
+PRIORITY_NOTIFICATION = 2  # Background notifications such as subscriptions and reminders.
+
+# Default priority of messages sent from the current task. The `command` decorator sets this to
+# `PRIORITY_REPLY`, so all messages sent while running a command are treated as replies.
+send_priority = ContextVar('send_priority', default=PRIORITY_NORMAL)
+
+# Messages longer than this cannot be sent by discord.
+MAX_MESSAGE_LENGTH = 2000
+
+
+class _Job(object):
+    __slots__ = ('priority', 'seq', 'send', 'content', 'kwargs', 'coalesce', 'future', 'queued_at')
+
+    def __init__(self, priority, seq, send, content, kwargs, coalesce, future):
+        self.priority = priority
+        self.seq = seq
+        self.send = send
+        self.content = content
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.future = future
+        self.queued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundQueue(object):
+    '''
+    Queue for everything the bot sends to a channel. Each destination has its own queue, which
+    is drained by a single worker in priority order, while keeping to a per-channel token bucket
+    so that we stay under discord's rate limits instead of running into 429s. Consecutive small
+    messages to the same destination can optionally be merged into a single message.
+    '''
+    def __init__(self, mbot, messages=5, seconds=5):
+        self.mbot = mbot
+        self._limiter = RateLimiter({'channel': (messages, seconds)})
+        self._seq = itertools.count()
+
+        # _queues:
+        #   {destination_id: [_Job, ...], ...}
+        self._queues = {}
+        self._workers = {}
+
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.total_wait = 0
+        self.max_wait = 0
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        return {
+            'queued': self.depth,
+            'destinations': len(self._queues),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited,
+            'avg_wait': self.total_wait / self.sent if self.sent else 0,
+            'max_wait': self.max_wait
+        }
+
+    async def send(self, destination_id, send, content=None, *, priority=None, coalesce=False, **kwargs):
+        '''
+        Queue `send(content, **kwargs)` for `destination_id` and wait for it to be sent.
+        If `coalesce` is `True`, the content may be merged with other queued messages which
+        also allow this; all of them then return the same message object.
+        '''
+        future = self.mbot.loop.create_future()
+        priority = send_priority.get() if priority is None else priority
+        coalesce = coalesce and content is not None and not kwargs.get('embed') and not kwargs.get('tts')
+
+        job = _Job(priority, next(self._seq), send, content, kwargs, coalesce, future)
+        heapq.heappush(self._queues.setdefault(destination_id, []), job)
+
+        if destination_id not in self._workers:
+            # The worker sends the messages of every task, so it must not inherit the context
+            # (scope, trace span, ...) of whichever task happened to start it.
+            self._workers[destination_id] = Context().run(self.mbot.loop.create_task, self._worker(destination_id))
+
+        return await future
+
+    def _next_batch(self, queue):
+        job = heapq.heappop(queue)
+        jobs, content = [job], job.content
+
+        while job.coalesce and queue:
+            nxt = queue[0]
+
+            if not nxt.coalesce or nxt.priority != job.priority:
+                break
+
+            if len(content) + len(nxt.content) + 1 > MAX_MESSAGE_LENGTH:
+                break
+
+            content = f'{content}\n{nxt.content}'
+            jobs.append(heapq.heappop(queue))
+
+        return jobs, content
+
+    async def _worker(self, destination_id):
+        queue = self._queues[destination_id]
+        jobs = []
+
+        try:
+            while queue:
+                retry_after = self._limiter.retry_after(None, destination_id)
+
+                if retry_after > 0:
+                    await asyncio.sleep(retry_after)
+                    continue
+
+                jobs, content = self._next_batch(queue)
+                jobs = [job for job in jobs if not job.future.cancelled()]
+
+                if not jobs:
+                    continue
+
+                self._limiter.hit(None, destination_id)
+
+                now = time.monotonic()
+                for job in jobs:
+                    self.total_wait += now - job.queued_at
+                    self.max_wait = max(self.max_wait, now - job.queued_at)
+
+                self.sent += 1
+                self.coalesced += len(jobs) - 1
+
+                try:
+                    result = await jobs[0].send(content, **jobs[0].kwargs)
+                except Exception as e:
+                    if isinstance(e, HTTPException) and e.response.status == 429:
+                        self.rate_limited += 1
+
+                    for job in jobs:
+                        if not job.future.done():
+                            job.future.set_exception(e)
+                else:
+                    for job in jobs:
+                        if not job.future.done():
+                            job.future.set_result(result)
+        finally:
+            # Only left with jobs if the worker was cancelled, e.g. on shutdown.
+            for job in jobs + queue:
+                if not job.future.done():
+                    job.future.cancel()
+
+            del self._workers[destination_id]
+            del self._queues[destination_id]
@@ -3,10 +3,27 @@ import inspect
 from .plugin_registry import PluginRegistry
 
 
+def event_filter(check):
+    '''
+    Decorator for plugin event handlers. The handler is only scheduled for events where
+    `check`, which is called with the same arguments as the handler, returns `True`.
+    Checks run in the main loop for every event, so they must be cheap and must not block.
+    '''
+    def decorator(func):
+        func._event_filter = check
+        return func
+    return decorator
+
+
 class BasePlugin(object, metaclass=PluginRegistry):
     '''
     Base plugin class from which all plugins should inherit.
     '''
+    # Indexes of the `plugin_data` collections used by the plugin, see `IndexRegistry`.
+    # indexes:
+    #   {collection_name: [(keys, options), ...], ...}
+    indexes = {}
+
     def __init__(self, mbot):
         self.mbot = mbot
         self.commands = []
@@ -19,6 +36,14 @@ class BasePlugin(object, metaclass=PluginRegistry):
 
         self.info = 'placeholder text CHANGEME'
 
+    def spawn(self, coro, purpose, key=None, cap=None):
+        '''
+        Run the coroutine `coro` in the background, as a task of the group `<plugin>.<purpose>`.
+        Use this instead of `loop.create_task`, so that the task is tracked and is cancelled
+        when the plugin is reloaded; see `TaskSupervisor.spawn` for `key` and `cap`.
+        '''
+        return self.mbot.tasks.spawn(coro, self.__class__.__name__, purpose, key=key, cap=cap)
+
     async def on_command(self, message, cmd_obj):
         '''
         Handle a command. If the `call_on_message` argument of the command was `True`, then
@@ -1,7 +1,6 @@
 import sys
 import logging
 import importlib.util
-from string import whitespace
 from collections import defaultdict
 
 from discord import User
@@ -9,6 +8,8 @@ from pymongo import UpdateMany
 from pymongo.errors import PyMongoError
 
 from .plugins import plugins
+from .plugin import BasePlugin
+from .dispatcher import CommandIndex
 from .plugin_registry import PluginRegistry
 
 log = logging.getLogger(__name__)
@@ -24,6 +25,15 @@ class PluginManager(object):
         # using the `commands_for_server` method.
         self.commands = {}
 
+        # Index used to quickly find the commands which could match a message.
+        # This is rebuilt every time the commands are (re)loaded.
+        self.command_index = CommandIndex()
+
+        # Plugins which override each event handler, see `load_subscribers`.
+        # _subscribers:
+        #   {event: [(plugin, event_filter), ...], ...}
+        self._subscribers = {}
+
     def get_plugin(self, name):
         for plugin in self.plugins:
             if plugin.__class__.__name__ == name:
@@ -54,6 +64,31 @@ class PluginManager(object):
 
             log.debug(f'loaded {p.__class__.__name__} plugin')
 
+        self.load_subscribers()
+
+    def load_subscribers(self):
+        '''
+        Work out which plugins actually handle each event. Plugins which do not override
+        the default (no-op) handler of `BasePlugin` are never scheduled for that event.
+        '''
+        events = [name for name in vars(BasePlugin) if name.startswith('on_') and name != 'on_command']
+        self._subscribers = {}
+
+        for event in events:
+            self._subscribers[event] = [
+                (plugin, getattr(getattr(plugin, event), '_event_filter', None)) for plugin in self.plugins
+                if getattr(type(plugin), event) is not getattr(BasePlugin, event)
+            ]
+
+        log.debug(f'loaded event subscribers {[e for e in events if self._subscribers[e]]}')
+
+    def subscribers(self, event, *args):
+        '''Return all plugins which handle `event`, and whose event filter (if any) accepts `args`.'''
+        return [
+            plugin for plugin, check in self._subscribers.get(event, [])
+            if check is None or check(*args)
+        ]
+
     def load_commands(self):
         '''Load commands for all loaded plugins.'''
         log.debug('loading commands')
@@ -64,6 +99,8 @@ class PluginManager(object):
 
             log.debug(f'loaded commands for {plugin.__class__.__name__} plugin')
 
+        self.command_index.build(command[2] for command in self.commands.values())
+
     async def reload_plugins(self):
         '''
         Reload all plugins and commands dynamically on a live system.
@@ -78,7 +115,10 @@ class PluginManager(object):
         old_plugins = [plugin.__class__.__name__ for plugin in self.plugins]
         old_commands = list(self.commands.keys())
 
-        # First, let's get rid of any existing plugins and commands
+        # First, let's get rid of any existing plugins and commands, along with their tasks.
+        for plugin in old_plugins:
+            self.mbot.tasks.cancel(plugin)
+
         self.plugins = []
         self.commands = {}
 
@@ -122,6 +162,9 @@ class PluginManager(object):
             elif cmd not in new_commands:
                 ret['deleted_commands'].append(cmd)
 
+        # Reloaded plugins may declare new indexes.
+        self.mbot.tasks.spawn(self.mbot.indexes.ensure(), 'mbot', 'ensure_indexes')
+
         log.debug('done reloading plugins')
         return ret
 
@@ -129,9 +172,7 @@ class PluginManager(object):
         log.debug(f'fetching plugins for server {server_id}')
 
         ret = {}
-        doc = await self.mbot.mongo.config.find_one(
-            {'server_id': server_id}
-        )
+        doc = await self.mbot.guild_configs.get(server_id)
 
         if doc is not None:
             server_plugins = [plugin['name'] for plugin in doc['plugins']]
@@ -146,9 +187,7 @@ class PluginManager(object):
         log.debug(f'fetching commands for server {server_id}')
 
         ret = {}
-        doc = await self.mbot.mongo.config.find_one(
-            {'server_id': server_id}
-        )
+        doc = await self.mbot.guild_configs.get(server_id)
 
         if doc is not None:
             server_plugins = {plugin['name']: plugin['commands'] for plugin in doc['plugins']}
@@ -175,16 +214,20 @@ class PluginManager(object):
                     {'$pull': {'plugins': {'name': plugin}}}
                 )
 
+                self.mbot.guild_configs.invalidate(server_id)
                 return ret.modified_count > 0
             except PyMongoError:
                 return False
 
     async def global_disable_plugins(self, plugins_list):
-        return await self.mbot.mongo.config.update_many(
+        ret = await self.mbot.mongo.config.update_many(
             {},
             {'$pull': {'plugins': {'name': {'$in': plugins_list}}}}
         )
 
+        self.mbot.guild_configs.invalidate()
+        return ret
+
     async def enable_plugin(self, server_id, plugin):
         log.debug(f'enabling {plugin} plugin for server {server_id}')
 
@@ -199,6 +242,7 @@ class PluginManager(object):
                     {'$push': {'plugins': {'name': plugin, 'commands': []}}}
                 )
 
+                self.mbot.guild_configs.invalidate(server_id)
                 return ret.modified_count > 0
             except PyMongoError:
                 return False
@@ -214,7 +258,10 @@ class PluginManager(object):
                     {'plugins.name': {'$ne': plugin}}, {'$push': {'plugins': {'name': plugin, 'commands': []}}}
                 ))
 
-            return await self.mbot.mongo.config.bulk_write(bulk)
+            ret = await self.mbot.mongo.config.bulk_write(bulk)
+
+            self.mbot.guild_configs.invalidate()
+            return ret
 
     def _plugin_for_cmd(self, command, ignore_aliases=True):
         '''
@@ -225,29 +272,11 @@ class PluginManager(object):
         if self.commands.get(command):
             return self.commands[command][2].info['plugin']
 
-        if not ignore_aliases:
-            for cmd in self.commands.values():
-                if command in cmd[2].info['aliases']:
-                    return cmd[2].info['plugin']
+        if not ignore_aliases and command in self.command_index.aliases:
+            return self.command_index.aliases[command].info['plugin']
 
     plugin_for_cmd = _plugin_for_cmd
 
-    @staticmethod
-    def _match_cmd(string, cmd):
-        '''
-        A string matches a command if it is exactly equal to the command
-        in both content and length, or if it is equal in content up to `string[:len(cmd)]`
-        and `string[len(cmd)]` is equal to a whitespace character.
-        '''
-        if string.startswith(cmd):
-            if len(string) == len(cmd):
-                return True
-
-            elif string[len(cmd)] in whitespace:
-                return True
-
-        return False
-
     def command_from_string(self, string, ignore_aliases=True):
         '''
         Utility function to retrieve a command based on a string. This string
@@ -257,18 +286,7 @@ class PluginManager(object):
         If `ignore_aliases` is False, command aliases are taken into account, if any
         of them match, then the parent command is returned.
         '''
-        matches = [x for x in self.commands if self._match_cmd(string, x)]
-
-        if matches:
-            # We return the longest matching command
-            return self.commands.get(max(matches, key=len))[2]
-
-        if not ignore_aliases:
-            aliases_map = {alias: cmd for cmd in self.commands for alias in self.commands[cmd][2].info['aliases']}
-            alias_matches = [x for x in aliases_map if self._match_cmd(string, x)]
-
-            if alias_matches:
-                return self.commands.get(aliases_map[max(alias_matches, key=len)])[2]
+        return self.command_index.lookup(string, ignore_aliases)
 
     async def enable_command(self, server_id, command, user_id=None):
         log.debug(f'enabling {command} command for server {server_id}')
@@ -293,6 +311,7 @@ class PluginManager(object):
                 {'$addToSet': {'plugins.$.commands': command}}
             )
 
+            self.mbot.guild_configs.invalidate(server_id)
             return ret.modified_count > 0
         except PyMongoError:
             return False
@@ -314,7 +333,10 @@ class PluginManager(object):
                 {'$addToSet': {'plugins.$.commands': {'$each': cmd_list[pl]}}}
             ))
 
-        return await self.mbot.mongo.config.bulk_write(bulk)
+        ret = await self.mbot.mongo.config.bulk_write(bulk)
+
+        self.mbot.guild_configs.invalidate()
+        return ret
 
     async def disable_command(self, server_id, command, user_id=None):
         log.debug(f'disabling {command} command for server {server_id}')
@@ -339,6 +361,7 @@ class PluginManager(object):
                 {'$pull': {'plugins.$.commands': command}}
             )
 
+            self.mbot.guild_configs.invalidate(server_id)
             return ret.modified_count > 0
         except PyMongoError:
             return False
@@ -359,7 +382,10 @@ class PluginManager(object):
                 {'plugins': {'$elemMatch': {'name': p}}}, {'$pull': {'plugins.$.commands': {'$in': cmd_list[p]}}}
             ))
 
-        return await self.mbot.mongo.config.bulk_write(bulk)
+        ret = await self.mbot.mongo.config.bulk_write(bulk)
+
+        self.mbot.guild_configs.invalidate()
+        return ret
 
     async def refresh_configs(self):
         plugin_data = []
@@ -372,7 +398,10 @@ class PluginManager(object):
                 }
             )
 
-        return await self.mbot.mongo.config.update_many(
+        ret = await self.mbot.mongo.config.update_many(
             {},
             {'$set': {'plugins': plugin_data}}
         )
+
+        self.mbot.guild_configs.invalidate()
+        return ret
@@ -4,13 +4,15 @@ import logging
 import asyncio
 from datetime import datetime, timezone
 
-import aiohttp
-from pymongo import UpdateOne
+from pymongo import UpdateOne, ASCENDING
 from discord import Embed, NotFound, HTTPException
 from bs4 import BeautifulSoup
 
 from ..plugin import BasePlugin
 from ..command import command
+from ..cache import cached_response
+from ..menus import Menu
+from ..outbound import PRIORITY_NOTIFICATION
 
 
 log = logging.getLogger(__name__)
@@ -25,25 +27,32 @@ MAX_PAGE_LIMIT = 6
 
 
 class Anime(BasePlugin):
+    indexes = {
+        'anime_subs': [
+            ([('next_ep.airing_at', ASCENDING), ('notified', ASCENDING)], {}),
+            ([('subs', ASCENDING)], {}),
+            ([('anilist_id', ASCENDING)], {}),
+            ([('mal_id', ASCENDING)], {})
+        ],
+        'anime_accounts': [([('user_id', ASCENDING)], {})]
+    }
+
     def __init__(self, mbot):
         super().__init__(mbot)
 
         self.subs_db = self.mbot.mongo.plugin_data.anime_subs
         self.acc_db = self.mbot.mongo.plugin_data.anime_accounts
 
-        self.mbot.loop.create_task(self.subscriber_loop())
-        self.mbot.loop.create_task(self.account_sync_loop())
+        self.spawn(self.subscriber_loop(), 'subscriber_loop')
+        self.spawn(self.account_sync_loop(), 'account_sync_loop')
 
     async def _do_anilist_query(self, url, query, variables):
-        with aiohttp.ClientSession() as client:
-            async with client.post(
-                    url,
-                    data=json.dumps({'query': query, 'variables': variables}),
-                    headers={'Content-Type': 'application/json'}
-            ) as r:
-                j = await r.json()
-
-        return j
+        return await self.mbot.http_client.json(
+            url,
+            method='POST',
+            data=json.dumps({'query': query, 'variables': variables}),
+            headers={'Content-Type': 'application/json'}
+        )
 
     async def anilist_query(self, query, variables, all_pages=True):
         results = [await self._do_anilist_query(ANILIST_API, query, variables)]
@@ -130,7 +139,9 @@ class Anime(BasePlugin):
             message.channel, 'I could not find any anime airings.'
         )
 
-    async def _get_media_embed(self, variables):
+    @cached_response('anilist', casefold=True)
+    async def _lookup_media(self, variables):
+        '''Return the first media matching `variables`, or `None`. AniList searches ignore case.'''
         query = '''
             query ($search: String, $id: Int, $idMal: Int, $type: MediaType) {
               Page(perPage: 1) {
@@ -165,7 +176,13 @@ class Anime(BasePlugin):
         if not results[0]['data'] or not results[0]['data']['Page']['media']:
             return None
 
-        media = results[0]['data']['Page']['media'][0]
+        return results[0]['data']['Page']['media'][0]
+
+    async def _get_media_embed(self, variables):
+        media = await self._lookup_media(variables)
+
+        if media is None:
+            return None
 
         e = Embed(
             title=f'{media["title"]["english"] or media["title"]["romaji"]} ({media["title"]["native"]})',
@@ -356,7 +373,7 @@ class Anime(BasePlugin):
                             e.set_thumbnail(url=document['image'])
 
                         e.timestamp = datetime.now(timezone.utc)
-                        self.mbot.loop.create_task(self.mbot.send_message(u, embed=e))
+                        self.spawn(self.mbot.send_message(u, embed=e, priority=PRIORITY_NOTIFICATION), 'notify')
                     except (NotFound, HTTPException):
                         pass
 
@@ -365,7 +382,10 @@ class Anime(BasePlugin):
                         {'$set': {'notified': True}}
                     )
 
-                    self.mbot.loop.create_task(self._update_episode(document['anilist_id']))
+                    # One update per show is enough, however many users are subscribed to it.
+                    self.spawn(
+                        self._update_episode(document['anilist_id']), 'update_episode', key=document['anilist_id']
+                    )
 
             await asyncio.sleep(60)
 
@@ -384,9 +404,7 @@ class Anime(BasePlugin):
         while not self.mbot.is_closed:
             async for doc in self.acc_db.find():
                 for account in doc['linked_accounts']:
-                    self.mbot.loop.create_task(
-                        self._sync(account, doc['user_id'])
-                    )
+                    self.spawn(self._sync(account, doc['user_id']), 'sync', key=account)
 
             await asyncio.sleep(24 * 60 * 60)
 
@@ -548,35 +566,38 @@ class Anime(BasePlugin):
 
     @command()
     async def mysubs(self, message):
-        page = 0
-
-        while True:
-            subs = await self._fetch_user_subs(message.author.id, page)
-            next_page = await self._fetch_user_subs(message.author.id, page + 1)
+        page, menu = 0, Menu(self.mbot, message, timeout=30)
 
-            # noinspection PyUnresolvedReferences
-            m = '\n'.join(
-                [f'{sub["title"]["english"] or sub ["title"]["romaji"]} ({sub["title"]["native"]})' for sub in subs]
-            )
+        try:
+            while True:
+                subs = await self._fetch_user_subs(message.author.id, page)
+                next_page = await self._fetch_user_subs(message.author.id, page + 1)
 
-            if not next_page and page == 0:
-                return await self.mbot.send_message(
-                    message.channel, f'```{m}```'
+                # noinspection PyUnresolvedReferences
+                m = '\n'.join(
+                    [f'{sub["title"]["english"] or sub ["title"]["romaji"]} ({sub["title"]["native"]})' for sub in subs]
                 )
 
-            option = await self.mbot.option_selector(
-                message, f'```{m}```', {}, timeout=30, pp=page != 0, np=bool(next_page)
-            )
+                if not next_page and page == 0:
+                    return await self.mbot.send_message(
+                        message.channel, f'```{m}```'
+                    )
 
-            if not option:
-                return await self.mbot.send_message(
-                    message.channel, '**Closing menu.**'
-                )
+                option = await menu.select(f'```{m}```', {}, pp=page != 0, np=bool(next_page))
+
+                if not option:
+                    await menu.close()
 
-            if option == 'np':
-                page += 1
-            elif option == 'pp':
-                page -= 1
+                    return await self.mbot.send_message(
+                        message.channel, '**Closing menu.**'
+                    )
+
+                if option == 'np':
+                    page += 1
+                elif option == 'pp':
+                    page -= 1
+        finally:
+            await menu.close()
 
     async def get_user_anime_anilist(self, username):
         query = '''
@@ -610,9 +631,9 @@ class Anime(BasePlugin):
         return anime_list
 
     async def get_user_anime_mal(self, username):
-        with aiohttp.ClientSession(headers={'User-Agent': USER_AGENT}) as client:
-            async with client.get(f'https://myanimelist.net/animelist/{username}?status=1') as r:
-                html = await r.text()
+        html = await self.mbot.http_client.text(
+            f'https://myanimelist.net/animelist/{username}?status=1', headers={'User-Agent': USER_AGENT}
+        )
 
         soup = BeautifulSoup(html, 'html.parser')
 
@@ -7,13 +7,16 @@ from datetime import datetime, timezone
 
 import discord
 from PIL import Image
+from pymongo import ASCENDING
 from bson.objectid import ObjectId
 from bson.errors import InvalidId, InvalidDocument
 
 from .badge_data import BADGE_DATA, BADGE_MAP
-from ..plugin import BasePlugin
+from ..plugin import BasePlugin, event_filter
 from ..command import command
-from ..utils import human_time, long_running_task
+from ..utils import human_time
+from ..render import renderer
+from ..menus import Menu
 
 
 PLAYTIME_RESET = 24 * 60 * 60
@@ -27,7 +30,41 @@ trade_options = {
 }
 
 
+@renderer('badges')
+def render_badges(params, inputs):
+    display_data = params['display_data']
+
+    slot_positions = {
+        '1': (39, 39),
+        '2': (389, 39),
+        '3': (739, 39)
+    }
+
+    if len(display_data) == 3:
+        fname = 'display3.png'
+    else:
+        fname = f'display{len(display_data)}-{"".join(sorted(display_data.keys()))}.png'
+
+    bckg = Image.open(os.path.join('data', 'badges', fname))
+
+    for slot in display_data:
+        badge_name = f'badge{display_data[slot][0]}-{display_data[slot][1]}{display_data[slot][2]}.png'
+        badge_buf = Image.open(os.path.join('data', 'badges', badge_name))
+
+        bckg.paste(badge_buf, slot_positions[slot], badge_buf)
+
+    buffer = io.BytesIO()
+    bckg.save(buffer, format='png', mode='wb')
+
+    return buffer.getvalue()
+
+
 class Badges(BasePlugin):
+    indexes = {
+        'badges': [([('user_id', ASCENDING)], {})],
+        'trades': [([('user_id', ASCENDING), ('trade_type', ASCENDING), ('badge_id', ASCENDING)], {})]
+    }
+
     def __init__(self, mbot):
         super().__init__(mbot)
 
@@ -153,6 +190,7 @@ class Badges(BasePlugin):
 
         return doc
 
+    @event_filter(lambda before, after: not after.bot and before.game != after.game)
     async def on_member_update(self, before, after):
         if after.bot:
             return
@@ -206,11 +244,11 @@ class Badges(BasePlugin):
                         {'$inc': {'total_playtime': playtime}}
                     )
 
-                self.mbot.loop.create_task(self.drop_rewards(
+                self.spawn(self.drop_rewards(
                     doc['user_id'],
                     BADGE_MAP[now_playing['game']],
                     reward
-                ))
+                ), 'drop_rewards')
 
     @command(regex='^badges mystats$', name='badges mystats')
     async def badges_stats(self, message):
@@ -463,32 +501,15 @@ class Badges(BasePlugin):
             'It seems that something went wrong on my end...'
         )
 
-    @long_running_task(send_typing=True)
-    def generate_badges_image(self, display_data):
-        slot_positions = {
-            '1': (39, 39),
-            '2': (389, 39),
-            '3': (739, 39)
-        }
-
-        if len(display_data) == 3:
-            fname = 'display3.png'
-        else:
-            fname = f'display{len(display_data)}-{"".join(sorted(display_data.keys()))}.png'
-
-        bckg = Image.open(os.path.join('data', 'badges', fname))
-
-        for slot in display_data:
-            badge_name = f'badge{display_data[slot][0]}-{display_data[slot][1]}{display_data[slot][2]}.png'
-            badge_buf = Image.open(os.path.join('data', 'badges', badge_name))
-
-            bckg.paste(badge_buf, slot_positions[slot], badge_buf)
+    async def generate_badges_image(self, display_data, _message=None):
+        if _message is not None:
+            await self.mbot.send_typing(_message.channel)
 
-        buffer = io.BytesIO()
-        bckg.save(buffer, format='png', mode='wb')
-        buffer.seek(0)
+        image = await self.mbot.render.render(
+            'badges', {'display_data': display_data}, server_id=_message.server.id if _message is not None else None
+        )
 
-        return buffer
+        return io.BytesIO(image)
 
     @command(cooldown=60)
     async def badges(self, message):
@@ -554,31 +575,37 @@ class Badges(BasePlugin):
             return
 
         inventory = sorted(inventory, key=lambda t: t[1])
+        menu = Menu(self.mbot, message, timeout=180)
 
-        while True:
-            items = inventory[page * 8: (page * 8) + 8]
-            next_page = inventory[(page + 1) * 8: ((page + 1) * 8) + 8]
+        try:
+            while True:
+                items = inventory[page * 8: (page * 8) + 8]
+                next_page = inventory[(page + 1) * 8: ((page + 1) * 8) + 8]
 
-            options = dict(items)
+                options = dict(items)
 
-            option = await self.mbot.option_selector(
-                message, header, options, np=bool(next_page), pp=page != 0, timeout=180
-            )
+                option = await menu.select(header, options, np=bool(next_page), pp=page != 0)
 
-            if not option:
-                if not silent:
-                    await self.mbot.send_message(
-                        message.channel, '**Closing menu.**'
-                    )
+                if not option:
+                    await menu.close()
 
-                break
+                    if not silent:
+                        await self.mbot.send_message(
+                            message.channel, '**Closing menu.**'
+                        )
 
-            if option == 'np':
-                page += 1
-            elif option == 'pp':
-                page -= 1
-            else:
-                yield option
+                    break
+
+                if option == 'np':
+                    page += 1
+                elif option == 'pp':
+                    page -= 1
+                else:
+                    # The caller may stop browsing after any option, so the menu is closed first.
+                    await menu.close()
+                    yield option
+        finally:
+            await menu.close()
 
     async def fetch_trades(self, page, user_id=None):
         trades, query = [], {}
@@ -592,48 +619,56 @@ class Badges(BasePlugin):
         return trades
 
     async def _browse_trades(self, message, header='', user_id=None, silent=False):
-        page = 0
+        page, menu = 0, Menu(self.mbot, message, timeout=180)
 
-        while True:
-            trades = await self.fetch_trades(page, user_id=user_id)
-            next_page = await self.fetch_trades(page + 1, user_id=user_id)
+        try:
+            while True:
+                trades = await self.fetch_trades(page, user_id=user_id)
+                next_page = await self.fetch_trades(page + 1, user_id=user_id)
 
-            if not trades:
-                if not silent:
-                    await self.mbot.send_message(
-                        message.channel, '**I couldn\'t find any trades.**'
-                    )
+                if not trades:
+                    await menu.close()
 
-                break
+                    if not silent:
+                        await self.mbot.send_message(
+                            message.channel, '**I couldn\'t find any trades.**'
+                        )
+
+                    break
+
+                options = {}
+                for x in enumerate(trades):
+                    options[str(x[0])] = '{:<7} {:<22} {{{}}}'.format(
+                        f'{x[1]["amount"]}x',
+                        f'{trade_options[x[1]["trade_type"]]}',
+                        BADGE_DATA[x[1]["badge_id"]]['badge_name']
+                    )
 
-            options = {}
-            for x in enumerate(trades):
-                options[str(x[0])] = '{:<7} {:<22} {{{}}}'.format(
-                    f'{x[1]["amount"]}x',
-                    f'{trade_options[x[1]["trade_type"]]}',
-                    BADGE_DATA[x[1]["badge_id"]]['badge_name']
+                option = await menu.select(
+                    f'**Badge & Fragment Trades**\n{header}',
+                    options, pp=page != 0, np=bool(next_page)
                 )
 
-            option = await self.mbot.option_selector(
-                message,
-                f'**Badge & Fragment Trades**\n{header}',
-                options, timeout=180, pp=page != 0, np=bool(next_page)
-            )
+                if not option:
+                    await menu.close()
 
-            if not option:
-                if not silent:
-                    await self.mbot.send_message(
-                        message.channel, '**Closing menu.**'
-                    )
+                    if not silent:
+                        await self.mbot.send_message(
+                            message.channel, '**Closing menu.**'
+                        )
 
-                break
+                    break
 
-            if option == 'np':
-                page += 1
-            elif option == 'pp':
-                page -= 1
-            else:
-                yield trades[int(option)]
+                if option == 'np':
+                    page += 1
+                elif option == 'pp':
+                    page -= 1
+                else:
+                    # The caller may stop browsing after any trade, so the menu is closed first.
+                    await menu.close()
+                    yield trades[int(option)]
+        finally:
+            await menu.close()
 
     @command(regex='^trade sell$', name='trade sell', mutex='badges')
     async def trade_sell(self, message):
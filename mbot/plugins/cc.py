@@ -6,6 +6,7 @@ from copy import copy
 # noinspection PyUnresolvedReferences
 from string import whitespace
 
+from pymongo import ASCENDING
 from discord import Forbidden, Embed
 from lark import Lark, Transformer
 from lark.exceptions import UnexpectedToken
@@ -14,6 +15,7 @@ from lark.parsers.lalr_analysis import LALR_Analyzer, Shift
 from ..plugin import BasePlugin
 from ..command import command
 from ..utils import long_running_task
+from ..menus import Menu
 
 
 RESERVED_CHARS = {
@@ -223,6 +225,10 @@ class MyTransformer(Transformer):
 
 
 class CustomCommands(BasePlugin):
+    indexes = {
+        'custom_commands': [([('server_id', ASCENDING), ('cmd_name', ASCENDING)], {})]
+    }
+
     def __init__(self, mbot):
         super().__init__(mbot)
 
@@ -436,7 +442,7 @@ class CustomCommands(BasePlugin):
 
         cmd_string = doc['cmd_string']
         parsed, _ = await self.parse_cc(cmd_string, message, shlex.split(args) if args else [])
-        self.mbot.loop.create_task(self.execute_cc(message, parsed))
+        self.spawn(self.execute_cc(message, parsed), 'execute_cc')
 
     @command(regex='^cc (.*?)(?: (.*?))?$', name='cc')
     async def run_cc(self, message, cmd, args=None):
@@ -599,80 +605,87 @@ class CustomCommands(BasePlugin):
                 else:
                     _q[key] = val
 
-        page = 0
+        page, menu = 0, Menu(self.mbot, message, timeout=180)
 
-        while True:
-            commands = await self.fetch_commands(page, _q)
-            next_page = await self.fetch_commands(page + 1, _q)
+        try:
+            while True:
+                commands = await self.fetch_commands(page, _q)
+                next_page = await self.fetch_commands(page + 1, _q)
 
-            if not commands:
-                return await self.mbot.send_message(
-                    message.channel, '**I couldn\'t find any commands.**'
-                )
+                if not commands:
+                    await menu.close()
 
-            options = {}
+                    return await self.mbot.send_message(
+                        message.channel, '**I couldn\'t find any commands.**'
+                    )
 
-            for x in commands:
-                options[x['cmd_name'] + x['server_id']] = '{:<32} [{}]'.format(
-                    x['cmd_name'],
-                    (x['access'][0]) +
-                    ('h' if x['help'] else '-') +
-                    ('u' if x['usage'] else '-') +
-                    ('c' if x['calls_external'] else '-') +
-                    ('r' if x['restricted'] else '-') +
-                    ('p' if x['privileged'] else '-')
+                options = {}
 
-                )
+                for x in commands:
+                    options[x['cmd_name'] + x['server_id']] = '{:<32} [{}]'.format(
+                        x['cmd_name'],
+                        (x['access'][0]) +
+                        ('h' if x['help'] else '-') +
+                        ('u' if x['usage'] else '-') +
+                        ('c' if x['calls_external'] else '-') +
+                        ('r' if x['restricted'] else '-') +
+                        ('p' if x['privileged'] else '-')
 
-            option = await self.mbot.option_selector(
-                message,
-                f'**Custom Commands for '
-                f'`{message.server.name if _q.get("server_id") == message.server.id else _q.get("server_id")}`**\n'
-                f'Enter an option number to see more details.',
-                footer='**Command Metadata Explained**\n'
-                       '```[012345]\n\n'
-                       '  > [0] "g" if the command can be used globally, "l" if the command can only be used locally, '
-                       '"m" if the command can only be used by it\'s author, "-" otherwise.\n'
-                       '  > [1] "h" if the command has a help string, "-" otherwise.\n'
-                       '  > [2] "u" if the command has a usage string, "-" otherwise.\n'
-                       '  > [3] "c" if the command calls external bot commands ({cmd: ...}), "-" otherwise.\n'
-                       '  > [4] "r" if the command restricts it\'s usage to certain permissions or roles, '
-                       '"-" otherwise.\n'
-                       '  > [5] "p" if the command uses privileged commands ({check_perms}, {!check_perms},'
-                       '{global_commands}, {!global_commands}).```',
-                options=options, timeout=180, pp=page != 0, np=bool(next_page)
-            )
+                    )
 
-            if not option:
-                return await self.mbot.send_message(
-                    message.channel, '**Closing menu.**'
+                option = await menu.select(
+                    f'**Custom Commands for '
+                    f'`{message.server.name if _q.get("server_id") == message.server.id else _q.get("server_id")}`**\n'
+                    f'Enter an option number to see more details.',
+                    footer='**Command Metadata Explained**\n'
+                           '```[012345]\n\n'
+                           '  > [0] "g" if the command can be used globally, '
+                           '"l" if the command can only be used locally, '
+                           '"m" if the command can only be used by it\'s author, "-" otherwise.\n'
+                           '  > [1] "h" if the command has a help string, "-" otherwise.\n'
+                           '  > [2] "u" if the command has a usage string, "-" otherwise.\n'
+                           '  > [3] "c" if the command calls external bot commands ({cmd: ...}), "-" otherwise.\n'
+                           '  > [4] "r" if the command restricts it\'s usage to certain permissions or roles, '
+                           '"-" otherwise.\n'
+                           '  > [5] "p" if the command uses privileged commands ({check_perms}, {!check_perms},'
+                           '{global_commands}, {!global_commands}).```',
+                    options=options, pp=page != 0, np=bool(next_page)
                 )
 
-            if option == 'np':
-                page += 1
-            elif option == 'pp':
-                page -= 1
-            else:
-                cmd_map = {x['cmd_name'] + x['server_id']: x for x in commands}
-                cmd = cmd_map[option]
+                if not option:
+                    await menu.close()
 
-                script = '<hidden>' if cmd['access'] == 'local' and message.server.id != cmd['server_id'] \
-                         or cmd['access'] == 'me' and message.author.id != cmd['owner_id'] \
-                         else cmd['cmd_string']
+                    return await self.mbot.send_message(
+                        message.channel, '**Closing menu.**'
+                    )
 
-                await self.mbot.send_message(
-                    message.author,
-                    f'**Custom Command - `{cmd["cmd_name"]}`**\n\n'
-                    f'  • Owner ID: {cmd["owner_id"]}\n'
-                    f'  • Server ID: {cmd["server_id"]}\n'
-                    f'  • Help: {cmd["help"]}\n'
-                    f'  • Usage: {cmd["usage"]}\n'
-                    f'  • Restricted: {"yes" if cmd["restricted"] else "no"}\n'
-                    f'  • Privileged: {"yes" if cmd["privileged"] else "no"}\n'
-                    f'  • Calls external commands: {"yes" if cmd["calls_external"] else "no"}\n\n'
-                    f'**Command Script / Response**\n'
-                    f'```{script}```'
-                )
+                if option == 'np':
+                    page += 1
+                elif option == 'pp':
+                    page -= 1
+                else:
+                    cmd_map = {x['cmd_name'] + x['server_id']: x for x in commands}
+                    cmd = cmd_map[option]
+
+                    script = '<hidden>' if cmd['access'] == 'local' and message.server.id != cmd['server_id'] \
+                             or cmd['access'] == 'me' and message.author.id != cmd['owner_id'] \
+                             else cmd['cmd_string']
+
+                    await self.mbot.send_message(
+                        message.author,
+                        f'**Custom Command - `{cmd["cmd_name"]}`**\n\n'
+                        f'  • Owner ID: {cmd["owner_id"]}\n'
+                        f'  • Server ID: {cmd["server_id"]}\n'
+                        f'  • Help: {cmd["help"]}\n'
+                        f'  • Usage: {cmd["usage"]}\n'
+                        f'  • Restricted: {"yes" if cmd["restricted"] else "no"}\n'
+                        f'  • Privileged: {"yes" if cmd["privileged"] else "no"}\n'
+                        f'  • Calls external commands: {"yes" if cmd["calls_external"] else "no"}\n\n'
+                        f'**Command Script / Response**\n'
+                        f'```{script}```'
+                    )
+        finally:
+            await menu.close()
 
     @command(regex='^cc-remove (.*?)(?: (\d*?))?$', name='cc-remove')
     async def cc_remove(self, message, cmd, server_id=None):
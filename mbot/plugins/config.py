@@ -17,12 +17,13 @@ class Config(BasePlugin):
                 {'$set': {'prefix': prefix}}
             )
 
+            self.mbot.guild_configs.invalidate(server_id)
             return ret.modified_count > 0
         except PyMongoError:
             return False
 
     async def _get_prefix(self, server_id):
-        return await self.mbot.mongo.config.find_one({'server_id': server_id})['prefix']
+        return (await self.mbot.guild_configs.get(server_id))['prefix']
 
     async def _set_nsfw(self, server_id, channel_id):
         try:
@@ -31,6 +32,7 @@ class Config(BasePlugin):
                 {'$addToSet': {'nsfw_channels': channel_id}}
             )
 
+            self.mbot.guild_configs.invalidate(server_id)
             return ret.modified_count > 0
         except PyMongoError:
             return False
@@ -42,6 +44,7 @@ class Config(BasePlugin):
                 {'$pull': {'nsfw_channels': channel_id}}
             )
 
+            self.mbot.guild_configs.invalidate(server_id)
             return ret.modified_count > 0
         except PyMongoError:
             return False
@@ -94,6 +97,7 @@ class Config(BasePlugin):
                 {'$addToSet': {'ignored_channels': channel_id}}
             )
 
+            self.mbot.guild_configs.invalidate(server_id)
             return ret.modified_count > 0
         except PyMongoError:
             return False
@@ -105,6 +109,7 @@ class Config(BasePlugin):
                 {'$pull': {'ignored_channels': channel_id}}
             )
 
+            self.mbot.guild_configs.invalidate(server_id)
             return ret.modified_count > 0
         except PyMongoError:
             return False
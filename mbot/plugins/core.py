@@ -40,6 +40,13 @@ ALLOWED_DB_OPS = (
 
 
 class Core(BasePlugin):
+    async def _send_block(self, channel, text, header=''):
+        '''Send `text` as a code block, after `header`; text which does not fit in a message is cut off.'''
+        if len(text) > 1900:
+            text = text[:1900] + '\n...'
+
+        await self.mbot.send_message(channel, f'{header}\n```{text}```' if header else f'```{text}```')
+
     @command()
     async def info(self, message):
         app_info = await self.mbot.application_info()
@@ -76,7 +83,7 @@ class Core(BasePlugin):
 
     @command(regex='^help(?: (.*?))?$', usage='help <command>', description='displays the help page')
     async def help(self, message, cmd=None):
-        server_cfg = await self.mbot.mongo.config.find_one({'server_id': message.server.id})
+        server_cfg = await self.mbot.guild_configs.get(message.server.id)
         commands = await self.mbot.plugin_manager.commands_for_server(message.server.id)
 
         if not cmd:
@@ -239,6 +246,10 @@ class Core(BasePlugin):
         else:
             ret = None
 
+        # Raw writes to server configs bypass the usual invalidation.
+        if db == 'bot_data' and col == 'config':
+            self.mbot.guild_configs.invalidate()
+
         if ret is not None:
             if isinstance(ret, UpdateResult):
                 return await self.mbot.send_message(
@@ -258,6 +269,100 @@ class Core(BasePlugin):
 
         return await self.mbot.send_message(message.channel, 'An unknown error occurred.')
 
+    # Not named `indexes`, which would shadow the index declarations of the plugin (`BasePlugin.indexes`).
+    @command(su=True, regex='^indexes$', name='indexes', description='report missing and unused database indexes')
+    async def index_report(self, message):
+        report = await self.mbot.indexes.report()
+        lines = []
+
+        for key, error in self.mbot.indexes.failed.items():
+            lines.append(f'{".".join(key)}: failed ({error})')
+
+        for collection, issues in report.items():
+            for name in issues['missing']:
+                lines.append(f'{collection}: missing {name}')
+
+            for name in issues['undeclared']:
+                lines.append(f'{collection}: undeclared {name}')
+
+            for index in issues['unused']:
+                lines.append(f'{collection}: unused {index["name"]} (since {index["since"]})')
+
+        if not lines:
+            return await self.mbot.send_message(message.channel, '**All declared indexes exist and are in use.**')
+
+        await self._send_block(message.channel, '\n'.join(lines))
+
+    @command(su=True, regex='^explain (\w+?)\.(\w+?) (.+)$', name='explain', usage='explain <db>.<collection> <query>',
+             description='show the query plan of a find query')
+    async def explain(self, message, db, col, query):
+        query = query.replace('$SERVER$', message.server.id).replace('$CHANNEL$', message.channel.id)
+
+        if db not in ('bot_data', 'plugin_data'):
+            return await self.mbot.send_message(message.channel, 'Unknown database.')
+
+        try:
+            decoded_query = loads(query)
+        except:
+            return await self.mbot.send_message(message.channel, 'Incorrect query.')
+
+        if not isinstance(decoded_query, dict):
+            return await self.mbot.send_message(message.channel, 'The query must be an object.')
+
+        plan = await self.mbot.indexes.explain(db, col, decoded_query)
+
+        await self._send_block(
+            message.channel,
+            f'Plan: {" <- ".join(plan["stages"])}\n'
+            f'Index: {plan["index"]}\n'
+            f'Returned: {plan["returned"]}\n'
+            f'Keys examined: {plan["keys_examined"]}\n'
+            f'Documents examined: {plan["docs_examined"]}\n'
+            f'Time: {plan["time_ms"]}ms',
+            header=':warning: **Full collection scan!**' if plan['collection_scan'] else ''
+        )
+
+    @command(su=True, regex='^dbstats$', description='show the slowest database operations and their callers')
+    async def dbstats(self, message):
+        stats = self.mbot.db_monitor.stats()
+        per_message = stats['ops_per_message']
+
+        lines = ['Operation                                  Count   Total    p50    p95    p99']
+
+        for op in stats['operations']:
+            lines.append(
+                f'{op["collection"] + " " + op["operation"]:<40} {op["count"]:>7} {op["sum"]:>6.1f}s '
+                f'{op["p50"] * 1000:>4.0f}ms {op["p95"] * 1000:>4.0f}ms {op["p99"] * 1000:>4.0f}ms'
+            )
+
+        lines += ['', 'Caller                                     Count   Total    avg']
+
+        for scope in stats['scopes']:
+            lines.append(
+                f'{scope["scope"]:<40} {scope["count"]:>7} {scope["sum"]:>6.1f}s {scope["avg"] * 1000:>4.0f}ms'
+            )
+
+        lines += [
+            '',
+            f'Ops per message (last {per_message["messages"]}): avg {per_message["avg"]:.1f}, '
+            f'p50 {per_message["p50"]}, p90 {per_message["p90"]}, p99 {per_message["p99"]}, max {per_message["max"]}'
+        ]
+
+        await self._send_block(message.channel, '\n'.join(lines))
+
+    @command(su=True, regex='^resources$', description='show the resources used by each plugin')
+    async def resources(self, message):
+        lines = ['Plugin               CPU     Wall   Runs  Tasks  Mongo   HTTP   REST    429  Jobs']
+
+        for plugin, usage in self.mbot.accounting.stats().items():
+            lines.append(
+                f'{plugin:<16} {usage["cpu"]:>6.1f}s {usage["wall"]:>7.0f}s {usage["runs"]:>6} {usage["tasks"]:>6} '
+                f'{usage["mongo_ops"]:>6} {usage["http_calls"]:>6} {usage["rest_calls"]:>6} '
+                f'{usage["rest_rate_limited"]:>6} {usage["executor_jobs"]:>5}'
+            )
+
+        await self._send_block(message.channel, '\n'.join(lines))
+
     @command(regex='^leave(?: (.*?))?$', su=True)
     async def leave(self, message, server_id=None):
         try:
@@ -278,6 +383,8 @@ class Core(BasePlugin):
                 upsert=True
             )
 
+            self.mbot.blacklists.add_global(user_id)
+
             if ret.upserted_id is not None:
                 try:
                     user = await self.mbot.get_user_info(user_id)
@@ -293,6 +400,8 @@ class Core(BasePlugin):
                 {'user_id': user_id}
             )
 
+            self.mbot.blacklists.remove_global(user_id)
+
             if ret.deleted_count == 1:
                 try:
                     user = await self.mbot.get_user_info(user_id)
@@ -2,42 +2,49 @@ import io
 import random
 import mimetypes
 
-import aiohttp
 from wand.image import Image
 
 from ..plugin import BasePlugin
 from ..command import command
-from ..utils import long_running_task
+from ..render import renderer
 
 
-class Fun(BasePlugin):
-    @long_running_task()
-    def _magik(self, image_blob, scale=None):
-        image_bytes = io.BytesIO()
-
-        with Image(blob=image_blob) as i:
-            i.format = 'jpg'
-            i.alpha_channel = True
-            i.transform(resize='800x800>')
-
-            i.liquid_rescale(
-                width=int(i.width * 0.5),
-                height=int(i.height * 0.5),
-                delta_x=int(0.5 * scale) if scale else 1,
-                rigidity=0
-            )
+@renderer('magik')
+def render_magik(params, inputs):
+    scale = params.get('scale')
+    image_bytes = io.BytesIO()
 
-            i.liquid_rescale(
-                width=int(i.width * 1.5),
-                height=int(i.height * 1.5),
-                delta_x=scale or 2,
-                rigidity=0
-            )
+    with Image(blob=inputs[0]) as i:
+        i.format = 'jpg'
+        i.alpha_channel = True
+        i.transform(resize='800x800>')
+
+        i.liquid_rescale(
+            width=int(i.width * 0.5),
+            height=int(i.height * 0.5),
+            delta_x=int(0.5 * scale) if scale else 1,
+            rigidity=0
+        )
+
+        i.liquid_rescale(
+            width=int(i.width * 1.5),
+            height=int(i.height * 1.5),
+            delta_x=scale or 2,
+            rigidity=0
+        )
+
+        i.save(file=image_bytes)
 
-            i.save(file=image_bytes)
-            image_bytes.seek(0)
+    return image_bytes.getvalue()
 
-        return image_bytes
+
+class Fun(BasePlugin):
+    async def _magik(self, image_blob, scale=None, _message=None):
+        image = await self.mbot.render.render(
+            'magik', {'scale': scale}, (image_blob,), server_id=_message.server.id if _message is not None else None
+        )
+
+        return io.BytesIO(image)
 
     @command(regex='^magik(?: (.*?))?$', name='magik')
     async def magik(self, message, url=None):
@@ -45,28 +52,26 @@ class Fun(BasePlugin):
             url = message.author.avatar_url or message.author.default_avatar_url
 
         try:
-            with aiohttp.ClientSession() as client:
-                async with client.head(url) as h:
-                    size = int(h.headers.get('Content-Length', 0))
-                    mimetype = h.headers.get('Content-Type')
-
-                if not mimetype:
-                    mimetype = mimetypes.guess_type(url=url)[0]
-
-                if size > 10 * 1024 * 1024 or not mimetype.startswith('image'):
-                    return await self.mbot.send_message(
-                        message.channel,
-                        '**This file is either not an image or is too large!**'
-                    )
-
-                async with client.get(url) as r:
-                    image_buffer = await r.read()
+            headers = await self.mbot.http_client.head(url)
+            size = int(headers.get('Content-Length', 0))
+            mimetype = headers.get('Content-Type')
+
+            if not mimetype:
+                mimetype = mimetypes.guess_type(url=url)[0]
+
+            if size > 10 * 1024 * 1024 or not mimetype.startswith('image'):
+                return await self.mbot.send_message(
+                    message.channel,
+                    '**This file is either not an image or is too large!**'
+                )
+
+            image_buffer = await self.mbot.http_client.read(url, max_size=10 * 1024 * 1024)
         except:
             return await self.mbot.send_message(
                 message.channel, '*Something went wrong...*'
             )
 
-        im = await self._magik(image_buffer)
+        im = await self._magik(image_buffer, _message=message)
         await self.mbot.send_file(message.channel, im, filename='magik.jpg')
 
     @command(regex='^dice(?: (\d{0,2})d(\d{1,2}))?$')
@@ -1,21 +1,26 @@
-import aiohttp
 from bs4 import BeautifulSoup
 
 from ..plugin import BasePlugin
 from ..command import command
+from ..cache import cached_response
 
 
 class Games(BasePlugin):
+    @cached_response('steamprofile')
+    async def get_steam_sig(self, steamid):
+        html = await self.mbot.http_client.text('https://steamprofile.com', method='POST', data={'steamid': steamid})
+        soup = BeautifulSoup(html, 'html.parser')
+
+        for meta in soup.find_all('meta'):
+            if meta.get('property') == 'og:image:url':
+                return meta.get('content')
+
     @command(regex='^steam (.*?)$', description='grab a steam sig', usage='steam [id]', cooldown=5)
     async def steam(self, message, steamid):
-        with aiohttp.ClientSession() as client:
-            async with client.post('https://steamprofile.com', data={'steamid': steamid}) as r:
-                soup = BeautifulSoup(await r.text(), 'html.parser')
+        sig = await self.get_steam_sig(steamid)
 
-                for meta in soup.find_all('meta'):
-                    if meta.get('property') == 'og:image:url':
-                        sig = meta.get('content')
-                        break
+        if sig is None:
+            return await self.mbot.send_message(message.channel, '*I couldn\'t find that steam profile...*')
 
         await self.mbot.send_file(
             destination=message.channel,
@@ -1,5 +1,6 @@
 import time
 
+from pymongo import ASCENDING
 from discord import Forbidden, NotFound, HTTPException
 
 from ..plugin import BasePlugin
@@ -7,6 +8,10 @@ from ..command import command
 
 
 class Moderator(BasePlugin):
+    indexes = {
+        'moderator': [([('server_id', ASCENDING)], {})]
+    }
+
     def __init__(self, mbot):
         super().__init__(mbot)
 
@@ -49,14 +54,7 @@ class Moderator(BasePlugin):
             return []
 
     async def is_user_blacklisted(self, user_id, server_id):
-        q = await self.db.find_one(
-            {'server_id': server_id, 'users_blacklist': {'$elemMatch': {'user_id': user_id}}}
-        )
-
-        if q is not None:
-            return True
-
-        return False
+        return (await self.mbot.blacklists.is_blacklisted(user_id, server_id))[1]
 
     async def blacklist_user(self, server_id, user_id, reason):
         doc = await self.db.find_one({'server_id': server_id})
@@ -66,6 +64,9 @@ class Moderator(BasePlugin):
                 server_id, users=[{'user_id': user_id, 'reason': reason, 'timestamp': time.time()}]
             )
 
+            if ret:
+                self.mbot.blacklists.add_local(server_id, user_id)
+
             return bool(ret)
         else:
             ret = await self.db.update_one(
@@ -73,6 +74,9 @@ class Moderator(BasePlugin):
                 {'$push': {'users_blacklist': {'user_id': user_id, 'reason': reason, 'timestamp': time.time()}}}
             )
 
+            if ret.modified_count == 1:
+                self.mbot.blacklists.add_local(server_id, user_id)
+
             return ret.modified_count == 1
 
     async def whitelist_user(self, server_id, user_id):
@@ -87,6 +91,7 @@ class Moderator(BasePlugin):
                 {'$pull': {'users_blacklist': {'user_id': user_id}}}
             )
 
+            self.mbot.blacklists.remove_local(server_id, user_id)
             return ret.modified_count == 1
 
     async def blacklist_string(self, server_id, string):
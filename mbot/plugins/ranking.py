@@ -2,15 +2,16 @@ import os
 import io
 import time
 import random
+import asyncio
 import mimetypes
 
-import aiohttp
 import discord
+from pymongo import ASCENDING
 from PIL import Image, ImageDraw, ImageFont
 
 from ..plugin import BasePlugin
 from ..command import command
-from ..utils import long_running_task
+from ..render import renderer
 
 
 # The XP cooldown represents the amount of time in seconds
@@ -22,7 +23,59 @@ from ..utils import long_running_task
 XP_COOLDOWN = 30
 
 
+@renderer('profile')
+def render_profile(params, inputs):
+    name, bio = params['name'], params['bio']
+    background, avatar = inputs
+
+    # Check if any text contains unicode characters...
+    # If so, we'll hvae to switch fonts as Source Sans Pro doesn't support them.
+    try:
+        name.encode('ascii')
+        name.encode('ascii')
+        font = ImageFont.truetype(os.path.join('data', 'SourceSansPro-Bold.ttf'), 18)
+        font_small = ImageFont.truetype(os.path.join('data', 'SourceSansPro-Regular.ttf'), 12)
+    except UnicodeError:
+        font = ImageFont.truetype(os.path.join('data', 'DejaVuSans-Bold.ttf'), 18)
+        font_small = ImageFont.truetype(os.path.join('data', 'DejaVuSans.ttf'), 12)
+
+    bckg = Image.open(io.BytesIO(background))
+
+    if bckg.mode != 'RGB':
+        bckg = bckg.convert(mode='RGB')
+
+    bckg = bckg.resize((310, 120), Image.ANTIALIAS)
+    draw = ImageDraw.Draw(bckg)
+
+    ppic = Image.open(io.BytesIO(avatar))
+    ppic = ppic.resize((80, 80), Image.ANTIALIAS)
+
+    profile_template = Image.open(os.path.join('data', 'profile_template.png'))
+
+    bckg.paste(profile_template, (0, 0), profile_template)
+    bckg.paste(ppic, (20, 20))
+
+    draw.text((110, 20), name, (33, 33, 33), font=font)
+    draw.text((110, 42), bio, (33, 33, 33), font=font_small)
+    draw.text((110, 60), 'LEVEL', (33, 33, 33), font=font)
+    draw.text((110, 80), str(params['level']), (33, 33, 33), font=font_small)
+    draw.text((200, 60), 'XP', (33, 33, 33), font=font)
+    draw.text((200, 80), str(params['xp']), (33, 33, 33), font=font_small)
+
+    profile_card = io.BytesIO()
+    bckg.save(profile_card, format='png', mode='wb')
+
+    return profile_card.getvalue()
+
+
 class Ranking(BasePlugin):
+    indexes = {
+        'ranking': [
+            ([('user_id', ASCENDING)], {}),
+            ([('ranking.server_id', ASCENDING)], {})
+        ]
+    }
+
     def __init__(self, mbot):
         super().__init__(mbot)
 
@@ -177,47 +230,19 @@ class Ranking(BasePlugin):
 
         await self.mbot.send_message(message.channel, embed=embed)
 
-    @long_running_task(send_typing=True)
-    def gen_profile(self, xp, name, bio, bckg_buffer, profile_buffer):
-        # Check if any text contains unicode characters...
-        # If so, we'll hvae to switch fonts as Source Sans Pro doesn't support them.
-        try:
-            name.encode('ascii')
-            name.encode('ascii')
-            font = ImageFont.truetype(os.path.join('data', 'SourceSansPro-Bold.ttf'), 18)
-            font_small = ImageFont.truetype(os.path.join('data', 'SourceSansPro-Regular.ttf'), 12)
-        except UnicodeError:
-            font = ImageFont.truetype(os.path.join('data', 'DejaVuSans-Bold.ttf'), 18)
-            font_small = ImageFont.truetype(os.path.join('data', 'DejaVuSans.ttf'), 12)
+    async def gen_profile(self, xp, name, bio, background, avatar, _message=None):
+        '''Render a profile card from the raw background and avatar images and return it as a buffer.'''
+        if _message is not None:
+            await self.mbot.send_typing(_message.channel)
 
-        bckg = Image.open(bckg_buffer)
-
-        if bckg.mode != 'RGB':
-            bckg = bckg.convert(mode='RGB')
-
-        bckg = bckg.resize((310, 120), Image.ANTIALIAS)
-        draw = ImageDraw.Draw(bckg)
-
-        ppic = Image.open(profile_buffer)
-        ppic = ppic.resize((80, 80), Image.ANTIALIAS)
-
-        profile_template = Image.open(os.path.join('data', 'profile_template.png'))
-
-        bckg.paste(profile_template, (0, 0), profile_template)
-        bckg.paste(ppic, (20, 20))
-
-        draw.text((110, 20), name, (33, 33, 33), font=font)
-        draw.text((110, 42), bio, (33, 33, 33), font=font_small)
-        draw.text((110, 60), 'LEVEL', (33, 33, 33), font=font)
-        draw.text((110, 80), str(self._get_level(xp)), (33, 33, 33), font=font_small)
-        draw.text((200, 60), 'XP', (33, 33, 33), font=font)
-        draw.text((200, 80), str(xp), (33, 33, 33), font=font_small)
-
-        profile_card = io.BytesIO()
-        bckg.save(profile_card, format='png', mode='wb')
-        profile_card.seek(0)
+        card = await self.mbot.render.render(
+            'profile',
+            {'xp': xp, 'level': self._get_level(xp), 'name': name, 'bio': bio},
+            (background, avatar),
+            server_id=_message.server.id if _message is not None else None
+        )
 
-        return profile_card
+        return io.BytesIO(card)
 
     @command(description='view your ranking profile', usage='profile', call_on_message=True, cooldown=20)
     async def profile(self, message):
@@ -227,23 +252,16 @@ class Ranking(BasePlugin):
         bio = user_data['bio']
         background = user_data['background']
 
-        # Try to download background...
+        # Try to download the background and profile pic...
         try:
-            with aiohttp.ClientSession() as client:
-                async with client.get(background) as r:
-                    bckg_buffer = io.BytesIO(bytes(await r.read()))
-        except:
-            return
-
-        # Try to download profile pic...
-        try:
-            with aiohttp.ClientSession() as client:
-                async with client.get(self.get_avatar_url(message.author)) as r:
-                    profile_buffer = io.BytesIO(bytes(await r.read()))
+            bckg, avatar = await asyncio.gather(
+                self.mbot.http_client.read(background),
+                self.mbot.http_client.read(self.get_avatar_url(message.author))
+            )
         except:
             return
 
-        profile = await self.gen_profile(xp, message.author.name, bio, bckg_buffer, profile_buffer, _message=message)
+        profile = await self.gen_profile(xp, message.author.name, bio, bckg, avatar, _message=message)
         await self.mbot.send_file(message.channel, profile, filename='profile.png')
 
     @command(regex='^bio (.*?)$', description='set bio for profile', usage='bio <bio>',
@@ -255,10 +273,9 @@ class Ranking(BasePlugin):
              usage='background <url>', call_on_message=True, cooldown=60)
     async def background(self, message, url):
         try:
-            with aiohttp.ClientSession() as client:
-                async with client.head(url) as r:
-                    size = int(r.headers.get('Content-Length', 0))
-                    mimetype = r.headers.get('Content-Type')
+            headers = await self.mbot.http_client.head(url)
+            size = int(headers.get('Content-Length', 0))
+            mimetype = headers.get('Content-Type')
 
             if not mimetype:
                 mimetype = mimetypes.guess_type(url=url)[0]
@@ -284,27 +301,19 @@ class Ranking(BasePlugin):
     async def top(self, message):
         top = []
 
-        # Thanks to https://stackoverflow.com/questions/28889240/mongodb-sort-documents-by-array-elements
+        # One document per user, whose `ranking` is only the entry for this server.
         pipeline = [
             {'$match': {'ranking.server_id': message.server.id}},
-            {'$addFields': {
-                'order': {
-                    '$filter': {
-                        'input': '$ranking',
-                        'as': 'r',
-                        'cond': {'$eq': ['$$r.server_id', message.server.id]}
-                    }
-                }
-            }},
-            {'$sort': {'order': -1}}
+            {'$unwind': '$ranking'},
+            {'$match': {'ranking.server_id': message.server.id}},
+            {'$sort': {'ranking.score': -1}}
         ]
 
         async for doc in self.ranking_db.aggregate(pipeline):
             user = message.server.get_member(doc['user_id'])
 
             if user:
-                scores = {server['server_id']: server['score'] for server in doc['ranking']}
-                top.append((user, scores[message.server.id]))
+                top.append((user, doc['ranking']['score']))
 
             if len(top) == 10:
                 break
@@ -3,13 +3,22 @@ import asyncio
 from datetime import datetime, timezone
 
 import discord
+from pymongo import ASCENDING
 from bson.objectid import ObjectId
 
 from ..plugin import BasePlugin
 from ..command import command
+from ..outbound import PRIORITY_NOTIFICATION
 
 
 class Reminders(BasePlugin):
+    indexes = {
+        'reminders': [
+            ([('expires', ASCENDING)], {}),
+            ([('user_id', ASCENDING), ('expires', ASCENDING)], {})
+        ]
+    }
+
     def __init__(self, mbot):
         super().__init__(mbot)
 
@@ -22,7 +31,7 @@ class Reminders(BasePlugin):
             'm': 60,
         }
 
-        self.mbot.loop.create_task(self.check_pending_reminders())
+        self.spawn(self.check_pending_reminders(), 'check_pending_reminders')
 
     async def check_pending_reminders(self):
         await self.mbot.wait_until_ready()
@@ -31,7 +40,9 @@ class Reminders(BasePlugin):
             tstamp = time.time()
 
             async for document in self.reminder_db.find({'expires': {'$lte': tstamp}}):
-                await self.mbot.send_message(discord.User(id=document['user_id']), document['message'])
+                await self.mbot.send_message(
+                    discord.User(id=document['user_id']), document['message'], priority=PRIORITY_NOTIFICATION
+                )
                 await self.reminder_db.delete_one({'_id': ObjectId(document['_id'])})
 
             await asyncio.sleep(60)
@@ -1,6 +1,5 @@
 import io
 
-import aiohttp
 import discord
 from urllib.parse import urlencode
 
@@ -8,14 +7,15 @@ from bs4 import BeautifulSoup
 
 from ..plugin import BasePlugin
 from ..command import command
+from ..cache import cached_response
 
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:10.0) Gecko/20100101 Firefox/10.0'
 
 
 class Search(BasePlugin):
-    @staticmethod
-    async def search_ddg(**kwargs):
+    @cached_response('duckduckgo', casefold=True)
+    async def search_ddg(self, **kwargs):
         '''
         Search duckduckgo.com (https://duckduckgo.com/api)
 
@@ -45,21 +45,15 @@ class Search(BasePlugin):
             params=urlencode(kwargs)
         )
 
-        with aiohttp.ClientSession() as client:
-            async with client.get(api) as r:
-                j = await r.json()
+        return await self.mbot.http_client.json(api)
 
-        return j
-
-    @staticmethod
-    async def search_google(query):
+    @cached_response('google', casefold=True)
+    async def search_google(self, query):
         search = 'https://www.google.com/search?{q}'.format(
             q=urlencode({'q': query})
         )
 
-        with aiohttp.ClientSession(headers={'User-Agent': USER_AGENT}) as client:
-            async with client.get(search) as r:
-                html = await r.text()
+        html = await self.mbot.http_client.text(search, headers={'User-Agent': USER_AGENT})
 
         soup, results = BeautifulSoup(html, 'html.parser'), []
 
@@ -78,15 +72,13 @@ class Search(BasePlugin):
 
         return results
 
-    @staticmethod
-    async def search_youtube(query):
+    @cached_response('youtube', casefold=True)
+    async def search_youtube(self, query):
         search = 'https://www.youtube.com/results?{q}'.format(
             q=urlencode({'search_query': query})
         )
 
-        with aiohttp.ClientSession(headers={'User-Agent': USER_AGENT}) as client:
-            async with client.get(search) as r:
-                html = await r.text()
+        html = await self.mbot.http_client.text(search, headers={'User-Agent': USER_AGENT})
 
         soup, results = BeautifulSoup(html, 'html.parser'), []
 
@@ -96,8 +88,7 @@ class Search(BasePlugin):
 
         return results
 
-    @staticmethod
-    async def search_google_maps(center, api_key, zoom=15, size='640x640', scale=2, download=False):
+    async def search_google_maps(self, center, api_key, zoom=15, size='640x640', scale=2, download=False):
         args = {
             'center': center,
             'zoom': zoom,
@@ -111,11 +102,7 @@ class Search(BasePlugin):
         )
 
         if download:
-            with aiohttp.ClientSession() as client:
-                async with client.get(search) as r:
-                    buffer = io.BytesIO(bytes(await r.read()))
-
-            return buffer
+            return io.BytesIO(await self.mbot.http_client.read(search))
 
         return search
 
@@ -8,36 +8,52 @@ from discord import Forbidden
 
 from ..plugin import BasePlugin
 from ..command import command
-from ..utils import long_running_task
+from ..render import renderer
+
+
+@renderer('spoiler_card')
+def render_spoiler_card(params, inputs):
+    text = params['text']
+
+    img = Image.new('RGB', (500, 90), (60, 63, 68))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.truetype(os.path.join('data', 'SourceSansPro-Regular.ttf'), 18)
+    w, h = draw.textsize(text, font=font)
+    draw.text(((502 - w) / 2, (92 - h) / 2), text, (192, 186, 158), font=font)
+    border = Image.new('RGB', (502, 92), (192, 186, 158))
+    border.paste(img, (1, 1))
+    buffer = io.BytesIO()
+    border.save(buffer, format='jpeg', mode='wb')
+    img.close()
+    return buffer.getvalue()
+
+
+@renderer('spoiler_gif')
+def render_spoiler_gif(params, inputs):
+    im = []
+    for image in inputs:
+        im.append(imageio.imread(image, format='jpeg'))
+
+    buffer = io.BytesIO()
+    imageio.mimwrite(buffer, im, duration=1, format='gif')
+    return buffer.getvalue()
 
 
 class Spoilers(BasePlugin):
-    @long_running_task()
-    def create_image(self, text):
-        img = Image.new('RGB', (500, 90), (60, 63, 68))
-        draw = ImageDraw.Draw(img)
-        font = ImageFont.truetype(os.path.join('data', 'SourceSansPro-Regular.ttf'), 18)
-        w, h = draw.textsize(text, font=font)
-        draw.text(((502 - w) / 2, (92 - h) / 2), text, (192, 186, 158), font=font)
-        border = Image.new('RGB', (502, 92), (192, 186, 158))
-        border.paste(img, (1, 1))
-        buffer = io.BytesIO()
-        border.save(buffer, format='jpeg', mode='wb')
-        buffer.seek(0)
-        img.close()
-        return buffer
-
-    @long_running_task()
-    def create_gif(self, images):
-        im = []
-        for image in images:
-            im.append(imageio.imread(image, format='jpeg'))
-            image.seek(0)
-
-        buffer = io.BytesIO()
-        imageio.mimwrite(buffer, im, duration=1, format='gif')
-        buffer.seek(0)
-        return buffer
+    async def create_image(self, text, _message=None):
+        image = await self.mbot.render.render(
+            'spoiler_card', {'text': text}, server_id=_message.server.id if _message is not None else None
+        )
+
+        return io.BytesIO(image)
+
+    async def create_gif(self, images, _message=None):
+        gif = await self.mbot.render.render(
+            'spoiler_gif', inputs=[image.getvalue() for image in images],
+            server_id=_message.server.id if _message is not None else None
+        )
+
+        return io.BytesIO(gif)
 
     @command(regex='^spoiler (.*?)$', cooldown=5, usage='spoiler <msg>', description='send some secret messages')
     async def spoiler(self, message, spoiler):
@@ -49,9 +65,9 @@ class Spoilers(BasePlugin):
             await self.mbot.delete_message(msg)
             return
 
-        a = await self.create_image('Hover to view spoilers.')
-        b = await self.create_image(spoiler)
-        gif = await self.create_gif((a, b, b, b))
+        a = await self.create_image('Hover to view spoilers.', _message=message)
+        b = await self.create_image(spoiler, _message=message)
+        gif = await self.create_gif((a, b, b, b), _message=message)
 
         await self.mbot.send_message(message.channel, f'*{message.author.mention} says...*')
         await self.mbot.send_file(message.channel, gif, filename='spoiler.gif')
@@ -6,6 +6,7 @@ import asyncio
 from collections import defaultdict
 from concurrent.futures import CancelledError
 
+from pymongo import ASCENDING
 from pymongo.errors import PyMongoError
 from discord import Channel
 from youtube_dl import YoutubeDL
@@ -28,6 +29,10 @@ class Player(object):
 
 
 class Music(BasePlugin):
+    indexes = {
+        'voice_player': [([('server_id', ASCENDING)], {})]
+    }
+
     def __init__(self, mbot):
         super().__init__(mbot)
 
@@ -423,7 +428,7 @@ class Music(BasePlugin):
         if playlist['playlist']:
             self.stop_player(message.server.id)
             self.kill_queue(message.server.id)
-            self.players[message.server.id].q_loop = self.mbot.loop.create_task(self.queue_loop(message))
+            self.players[message.server.id].q_loop = self.spawn(self.queue_loop(message), 'queue_loop')
             self.players[message.server.id].done_playing.set()
 
     @command(description='shuffle the playlist', usage='shuffle')
@@ -0,0 +1,144 @@
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    '''
+    Token bucket which holds at most `capacity` tokens and refills at `rate` tokens per second.
+    `expires_tick` is the timing wheel tick at which the bucket is scheduled to be dropped.
+    '''
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated', 'expires_tick')
+
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+        self.expires_tick = None
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens >= 1
+
+    def retry_after(self, now):
+        self._refill(now)
+        return max((1 - self.tokens) / self.rate, 0)
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens = max(self.tokens - 1, 0)
+
+    def full_at(self):
+        '''Time at which the bucket will be full again, at which point it can be forgotten.'''
+        return self.updated + (self.capacity - self.tokens) / self.rate
+
+
+class RateLimiter(object):
+    '''
+    Command rate limiter with a token bucket per user, per channel and per server.
+    Buckets which have refilled completely carry no information, so they are dropped using
+    a timing wheel; each bucket sits in the slot of the tick at which it will be full, which
+    keeps the cost of expiring buckets independent of the number of active users.
+
+    :param limits: dict mapping a scope (`user`, `channel` or `server`) to a tuple of
+        `(commands, seconds)`, i.e. at most `commands` commands every `seconds` seconds.
+        Scopes which are missing or `None` are not limited.
+    '''
+    scopes = ('user', 'channel', 'server')
+
+    def __init__(self, limits, tick=1, slots=64):
+        self.limits = {scope: limits[scope] for scope in self.scopes if limits.get(scope)}
+        self.tick = tick
+
+        # _buckets:
+        #   {(scope, id): TokenBucket, ...}
+        self._buckets = {}
+
+        # _wheel:
+        #   [{(scope, id), ...}, ...]
+        self._wheel = [set() for _ in range(slots)]
+        self._current_tick = int(time.monotonic() // tick)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _keys(self, user_id, channel_id, server_id):
+        ids = {'user': user_id, 'channel': channel_id, 'server': server_id}
+        return [(scope, ids[scope]) for scope in self.limits if ids[scope] is not None]
+
+    def _schedule(self, key, bucket):
+        tick = int(bucket.full_at() // self.tick) + 1
+
+        # Buckets which take longer to refill than the wheel spans are rescheduled when their slot comes up.
+        tick = min(tick, self._current_tick + len(self._wheel) - 1)
+
+        if tick != bucket.expires_tick:
+            bucket.expires_tick = tick
+            self._wheel[tick % len(self._wheel)].add(key)
+
+    def _expire(self, now):
+        tick = int(now // self.tick)
+        ticks = min(tick - self._current_tick, len(self._wheel))
+
+        # Buckets which are not full yet are rescheduled once the wheel has advanced, so that they are
+        # clamped against the new tick and do not land in a slot which is still to be emptied below.
+        self._current_tick = tick
+        pending = []
+
+        for t in range(tick - ticks + 1, tick + 1):
+            slot = self._wheel[t % len(self._wheel)]
+            self._wheel[t % len(self._wheel)] = set()
+
+            for key in slot:
+                bucket = self._buckets.get(key)
+
+                # Stale entries are left behind when a bucket gets rescheduled.
+                if bucket is None or bucket.expires_tick > t:
+                    continue
+
+                if bucket.full_at() <= now:
+                    del self._buckets[key]
+                else:
+                    pending.append((key, bucket))
+
+        for key, bucket in pending:
+            self._schedule(key, bucket)
+
+    def limited(self, user_id, channel_id=None, server_id=None):
+        '''Return the first scope which has no commands left, or `None` if a command may run.'''
+        now = time.monotonic()
+        self._expire(now)
+
+        for key in self._keys(user_id, channel_id, server_id):
+            bucket = self._buckets.get(key)
+
+            if bucket is not None and not bucket.available(now):
+                return key[0]
+
+    def retry_after(self, user_id, channel_id=None, server_id=None):
+        '''Return the number of seconds until a command may run (`0` if it may run now).'''
+        now = time.monotonic()
+        self._expire(now)
+
+        buckets = [self._buckets.get(key) for key in self._keys(user_id, channel_id, server_id)]
+        return max([bucket.retry_after(now) for bucket in buckets if bucket is not None] or [0])
+
+    def hit(self, user_id, channel_id=None, server_id=None):
+        '''Take a token from every bucket a command counts towards.'''
+        now = time.monotonic()
+
+        for key in self._keys(user_id, channel_id, server_id):
+            bucket = self._buckets.get(key)
+
+            if bucket is None:
+                commands, seconds = self.limits[key[0]]
+                bucket = self._buckets[key] = TokenBucket(commands, commands / seconds, now)
+
+            bucket.consume(now)
+            self._schedule(key, bucket)
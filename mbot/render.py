@@ -0,0 +1,136 @@
+import logging
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .accounting import EXECUTOR_JOBS
+from .executors import ExecutorBusy, WorkloadExecutor
+
+log = logging.getLogger(__name__)
+
+# Render functions, which run in the worker processes of the render service.
+# _renderers:
+#   {name: (module, function), ...}
+_renderers = {}
+
+# `CPU` methods of `long_running_task`, which also run in the worker processes.
+# _cpu_tasks:
+#   {(module, qualname): function, ...}
+_cpu_tasks = {}
+
+
+class RenderBusy(ExecutorBusy):
+    '''Raised when a server already has as many render jobs as it is allowed to.'''
+
+
+def renderer(name):
+    '''
+    Decorator which registers a module level function as the render function `name`.
+    Render functions take a dict of parameters and a list of input files (as bytes), and
+    return the encoded image as bytes. They run in another process, so the parameters
+    must be picklable and the function cannot use any state of the bot.
+    '''
+    def decorator(func):
+        _renderers[name] = (func.__module__, func)
+        return func
+    return decorator
+
+
+def _render(module, name, params, inputs):
+    if name not in _renderers:
+        # Workers which were not forked from the bot have to import the module first.
+        importlib.import_module(module)
+
+    return _renderers[name][1](params, inputs)
+
+
+def register_cpu_task(func):
+    '''
+    Register a function to be run by `run_cpu_task`. Functions are sent to the workers
+    by name, since plugin methods and classes cannot be pickled.
+    '''
+    _cpu_tasks[(func.__module__, func.__qualname__)] = func
+
+
+def run_cpu_task(key, args, kwargs):
+    '''Entry point of `CPU` jobs of `long_running_task`. Runs a function registered with `register_cpu_task`.'''
+    module, qualname = key
+
+    if key not in _cpu_tasks:
+        # Workers which were not forked from the bot have to import the module first.
+        importlib.import_module(module)
+
+    func = _cpu_tasks[key]
+
+    # Methods get a bare instance of their class in place of the plugin, so they may
+    # only use `self` for helpers which do not need any state (eg. static methods).
+    owner = func.__globals__.get(qualname.split('.')[0]) if '.' in qualname else None
+
+    if isinstance(owner, type):
+        return func(owner.__new__(owner), *args, **kwargs)
+
+    return func(*args, **kwargs)
+
+
+class RenderService(object):
+    '''
+    Pool of worker processes which render images for commands, so that image generation
+    neither holds the GIL nor blocks the event loop of the shard. The `CPU` methods of
+    `long_running_task` run on the same workers, see `run`.
+
+    Jobs wait in the service (not in the pool) until a worker is free, so a job whose
+    caller times out or is cancelled while queued is dropped without ever being rendered.
+    A job which is already running is left to finish and its result is discarded. Each
+    server can have at most `per_server` jobs queued or running at a time.
+    '''
+    def __init__(self, mbot, workers=2, max_queue=16, timeout=30, per_server=2):
+        self.mbot = mbot
+        self.per_server = per_server
+
+        self._executor = WorkloadExecutor(
+            'render', ProcessPoolExecutor(workers), workers, max_queue=max_queue, timeout=timeout
+        )
+
+        # _active:
+        #   {server_id: number_of_jobs, ...}
+        self._active = {}
+
+    async def render(self, name, params=None, inputs=(), *, server_id=None, timeout=None):
+        '''
+        Render an image with the render function `name` and return the encoded image.
+
+        :raises RenderBusy: If the server has too many render jobs, or the render queue is full.
+        :raises asyncio.TimeoutError: If the image is not rendered within `timeout` seconds.
+        '''
+        return await self.run(
+            _render, _renderers[name][0], name, params or {}, list(inputs), server_id=server_id, timeout=timeout
+        )
+
+    async def run(self, func, *args, server_id=None, timeout=None):
+        '''
+        Run the module level function `func(*args)` on a worker and return the result. The job
+        counts against the render jobs of `server_id`, and raises the same errors as `render`.
+        '''
+        if server_id is not None and self._active.get(server_id, 0) >= self.per_server:
+            raise RenderBusy(f'server {server_id} has too many render jobs')
+
+        self.mbot.accounting.charge(EXECUTOR_JOBS)
+
+        if server_id is not None:
+            self._active[server_id] = self._active.get(server_id, 0) + 1
+
+        try:
+            return await self._executor.run(self.mbot.loop, func, *args, timeout=timeout)
+        except ExecutorBusy as e:
+            raise RenderBusy(str(e)) from e
+        finally:
+            if server_id is not None:
+                self._active[server_id] -= 1
+
+                if not self._active[server_id]:
+                    del self._active[server_id]
+
+    def stats(self):
+        return {**self._executor.stats(), 'servers': len(self._active)}
+
+    def shutdown(self):
+        self._executor.executor.shutdown(wait=False)
@@ -0,0 +1,166 @@
+import time
+import logging
+from collections import deque
+from contextvars import ContextVar
+
+from discord import HTTPException
+
+from .scope import current_scope
+
+log = logging.getLogger(__name__)
+
+# The `(route, scope)` of the REST call made by the current task, while it is in progress.
+_current_call = ContextVar('current_call', default=None)
+
+# Marks a scope which is not given, and should be read from `current_scope`.
+_CURRENT = object()
+
+
+class _RateLimitFilter(logging.Filter):
+    '''
+    Counts the 429s which discord.py retries by itself; it only logs them, so this is the only way
+    to see them. Attached to the `discord.http` logger, it never filters out any records.
+    '''
+    def __init__(self, budget):
+        super().__init__()
+        self.budget = budget
+
+    def filter(self, record):
+        call = _current_call.get()
+
+        if call is not None and 'rate limited' in str(record.msg):
+            self.budget.record(call[0], call[1], rate_limited=1)
+
+        return True
+
+
+class RestBudget(object):
+    '''
+    Counts the Discord REST calls made by the bot per route and per caller (the scope of the
+    command or plugin which made the call), in total and over a rolling window of `window`
+    seconds, along with the 429s they ran into.
+
+    Calls made through the outbound queue are sent from the queue's worker, so `mBot.send_message`
+    wraps them with `wrap`, which captures the scope when the message is queued.
+    '''
+    def __init__(self, window=300, slot=10):
+        self.window = window
+        self.slot = slot
+
+        # totals:
+        #   {(route, scope): [calls, rate_limited, failed, seconds], ...}
+        self.totals = {}
+
+        # _slots:
+        #   deque([(slot_id, {(route, scope): [calls, rate_limited], ...}), ...])
+        self._slots = deque()
+
+        self._filter = _RateLimitFilter(self)
+        logging.getLogger('discord.http').addFilter(self._filter)
+
+    def close(self):
+        logging.getLogger('discord.http').removeFilter(self._filter)
+
+    def _current_slot(self):
+        slot_id = int(time.monotonic() // self.slot)
+
+        if not self._slots or self._slots[-1][0] != slot_id:
+            self._slots.append((slot_id, {}))
+
+        while self._slots[0][0] <= slot_id - self.window // self.slot:
+            self._slots.popleft()
+
+        return self._slots[-1][1]
+
+    def record(self, route, scope, calls=0, rate_limited=0, failed=False, seconds=0):
+        key = (route, scope or 'background')
+
+        totals = self.totals.setdefault(key, [0, 0, 0, 0])
+        totals[0] += calls
+        totals[1] += rate_limited
+        totals[2] += failed
+        totals[3] += seconds
+
+        counters = self._current_slot().setdefault(key, [0, 0])
+        counters[0] += calls
+        counters[1] += rate_limited
+
+    async def call(self, route, func, *args, scope=_CURRENT, **kwargs):
+        '''
+        Await `func(*args, **kwargs)`, which makes a REST call to `route`, and count it.
+        The call is attributed to `scope`, or to the current scope if it is not given.
+        '''
+        if scope is _CURRENT:
+            scope = current_scope.get()
+
+        token = _current_call.set((route, scope))
+        start = time.monotonic()
+        rate_limited, failed = 0, False
+
+        try:
+            return await func(*args, **kwargs)
+        except HTTPException as e:
+            failed = True
+
+            # Only raised once discord.py has given up on retrying.
+            if e.response.status == 429:
+                rate_limited = 1
+
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _current_call.reset(token)
+            self.record(route, scope, 1, rate_limited, failed, time.monotonic() - start)
+
+    def wrap(self, route, func, scope=_CURRENT):
+        '''
+        Return a coroutine function which calls `func` through `call`. Unless it is given,
+        the scope is captured now rather than when the returned function is called.
+        '''
+        if scope is _CURRENT:
+            scope = current_scope.get()
+
+        async def call(*args, **kwargs):
+            return await self.call(route, func, *args, scope=scope, **kwargs)
+
+        return call
+
+    def stats(self, top=10):
+        '''
+        :returns: The `top` routes and callers by the number of calls over the rolling window,
+            with the calls per minute, and their totals since startup.
+        '''
+        self._current_slot()
+
+        window = {}
+
+        for _, counters in self._slots:
+            for key, (calls, rate_limited) in counters.items():
+                total = window.setdefault(key, [0, 0])
+                total[0] += calls
+                total[1] += rate_limited
+
+        def summarize(index):
+            summary = {}
+
+            for key, (calls, rate_limited, failed, seconds) in self.totals.items():
+                entry = summary.setdefault(key[index], {
+                    'calls': 0, 'rate_limited': 0, 'window_calls': 0, 'window_rate_limited': 0,
+                    'failed': 0, 'seconds': 0
+                })
+
+                entry['calls'] += calls
+                entry['rate_limited'] += rate_limited
+                entry['failed'] += failed
+                entry['seconds'] += seconds
+                entry['window_calls'] += window.get(key, (0, 0))[0]
+                entry['window_rate_limited'] += window.get(key, (0, 0))[1]
+
+            for entry in summary.values():
+                entry['per_minute'] = entry['window_calls'] * 60 / self.window
+
+            return dict(sorted(summary.items(), key=lambda item: item[1]['window_calls'], reverse=True)[:top])
+
+        return {'window': self.window, 'routes': summarize(0), 'callers': summarize(1)}
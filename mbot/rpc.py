@@ -1,3 +1,5 @@
+import asyncio
+
 import zerorpc
 from threading import Thread
 
@@ -25,6 +27,16 @@ class RPC(object):
     def __init__(self, mbot):
         self.mbot = mbot
 
+    def _on_loop(self, func, *args, timeout=10):
+        '''
+        Call `func(*args)` on the loop and return its result. RPC calls are served from a separate
+        thread, so state which the loop mutates must only be read through this.
+        '''
+        async def call():
+            return func(*args)
+
+        return asyncio.run_coroutine_threadsafe(call(), self.mbot.loop).result(timeout=timeout)
+
     def installed_plugins(self):
         return [plugin.__class__.__name__ for plugin in self.mbot.plugin_manager.plugins]
 
@@ -53,6 +65,49 @@ class RPC(object):
     def is_user_su(self, user_id):
         return self.mbot.perms_check(User(id=user_id), su=True)
 
+    def invalidate_config(self, server_id=None):
+        # RPC calls are served from a separate thread; the cache must only be touched from the loop.
+        self.mbot.loop.call_soon_threadsafe(self.mbot.guild_configs.invalidate, server_id)
+
+    def cache_stats(self):
+        return self._on_loop(
+            lambda: {'guild_configs': self.mbot.guild_configs.stats(), 'responses': self.mbot.responses.stats()}
+        )
+
+    def executor_stats(self):
+        return self._on_loop(lambda: {**self.mbot.executors.stats(), 'render': self.mbot.render.stats()})
+
+    def menu_stats(self):
+        return self._on_loop(self.mbot.menus.stats)
+
+    def db_stats(self, top=10):
+        return self._on_loop(self.mbot.db_monitor.stats, top)
+
+    def rest_stats(self, top=10):
+        return self._on_loop(self.mbot.rest.stats, top)
+
+    def task_stats(self):
+        return self._on_loop(self.mbot.tasks.stats)
+
+    def plugin_resources(self):
+        return self._on_loop(self.mbot.accounting.stats)
+
+    def watchdog_stats(self, stacks=False):
+        return self._on_loop(self.mbot.watchdog.stats, stacks)
+
+    def recent_traces(self, count=10):
+        return self._on_loop(lambda: {**self.mbot.tracer.stats(), 'traces': self.mbot.tracer.recent(count)})
+
+    def index_report(self):
+        # The report needs the database, so it is made on the loop; this only blocks the RPC thread.
+        async def report():
+            collections = await self.mbot.indexes.report()
+            failed = {'.'.join(key): error for key, error in self.mbot.indexes.failed.items()}
+
+            return {'collections': collections, 'failed': failed}
+
+        return asyncio.run_coroutine_threadsafe(report(), self.mbot.loop).result(timeout=60)
+
     def reload_plugins(self):
         async def task():
             await self.mbot.plugin_manager.reload_plugins()
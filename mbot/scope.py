@@ -0,0 +1,13 @@
+from contextvars import ContextVar
+
+# The command, plugin event handler or task running in the current task, named `<owner>.<what>` where the owner
+# is the plugin (or `mbot` for the bot itself), e.g. `Ranking.command:rank`, `Ranking.on_message` or `mbot.on_message`.
+# Database operations and REST calls are attributed to it; anything outside of any scope is `background`.
+# Tasks spawned with `TaskSupervisor.spawn` run in the scope of their group; other tasks inherit the scope of the
+# task which created them.
+current_scope = ContextVar('current_scope', default=None)
+
+
+def scope_owner(scope):
+    '''Return the plugin (or `mbot`) which owns `scope`, or `background` if there is no scope.'''
+    return scope.partition('.')[0] if scope else 'background'
@@ -0,0 +1,114 @@
+import logging
+from collections import defaultdict, Counter
+
+import asyncio
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError, BulkWriteError
+
+log = logging.getLogger(__name__)
+
+
+class StatsAggregator(object):
+    '''
+    Write-behind aggregator for the `bot_data.stats` counters.
+    Increments are accumulated in memory per scope and written to the database as a single
+    `bulk_write`, either periodically, once enough counters are pending or when the bot closes.
+    '''
+    def __init__(self, mbot, flush_interval=10, max_pending=500):
+        self.mbot = mbot
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        # _counters:
+        #   {scope: Counter({field: delta, ...}), ...}
+        self._counters = defaultdict(Counter)
+
+        # _commands:
+        #   {scope: Counter({command_name: delta, ...}), ...}
+        self._commands = defaultdict(Counter)
+
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = self.mbot.tasks.spawn(self.flush_loop(), 'mbot', 'flush_stats')
+
+    @property
+    def pending(self):
+        return sum(len(x) for x in self._counters.values()) + sum(len(x) for x in self._commands.values())
+
+    def inc(self, fields, scopes):
+        '''Add the `{field: delta}` dict `fields` to the counters of every scope id in `scopes`.'''
+        for scope in scopes:
+            self._counters[scope].update(fields)
+
+        self._check_size()
+
+    def command_executed(self, command_name, scopes):
+        for scope in scopes:
+            self._commands[scope][command_name] += 1
+
+        self._check_size()
+
+    def _check_size(self):
+        if self.pending >= self.max_pending and not self._flush_lock.locked():
+            # Keyed, so that at most one early flush is waiting for the lock.
+            self.mbot.tasks.spawn(self.flush(), 'mbot', 'flush_stats_early', key='flush')
+
+    def _requests(self, counters, commands):
+        requests = []
+
+        for scope, fields in counters.items():
+            requests.append(UpdateOne({'scope': scope}, {'$inc': dict(fields)}, upsert=True))
+
+        for scope, cmds in commands.items():
+            # Stats documents must exist before we can push to them.
+            if scope not in counters:
+                requests.append(UpdateOne({'scope': scope}, {'$setOnInsert': {'scope': scope}}, upsert=True))
+
+            for cmd, n in cmds.items():
+                requests.append(UpdateOne(
+                    {'scope': scope, 'commands_executed.command': {'$ne': cmd}},
+                    {'$push': {'commands_executed': {'command': cmd, 'n': 0}}}
+                ))
+
+                requests.append(UpdateOne(
+                    {'scope': scope, 'commands_executed.command': cmd},
+                    {'$inc': {'commands_executed.$.n': n}}
+                ))
+
+        return requests
+
+    async def flush(self):
+        '''Write all pending counters to the database.'''
+        async with self._flush_lock:
+            counters, self._counters = self._counters, defaultdict(Counter)
+            commands, self._commands = self._commands, defaultdict(Counter)
+
+            requests = self._requests(counters, commands)
+
+            if not requests:
+                return
+
+            try:
+                # Shielded, so that counters which are being written are not lost when the bot closes.
+                await asyncio.shield(self.mbot.mongo.stats.bulk_write(requests, ordered=True))
+                log.debug(f'flushed {len(requests)} stats update(s)')
+            except BulkWriteError:
+                # Some of the updates may have been applied already, retrying could count them twice.
+                log.exception('error while flushing stats; some counters were dropped')
+            except PyMongoError:
+                log.exception('error while flushing stats; keeping counters for the next flush')
+
+                # Merge the counters back, so that nothing is lost.
+                for scope, fields in counters.items():
+                    self._counters[scope].update(fields)
+
+                for scope, cmds in commands.items():
+                    self._commands[scope].update(cmds)
+
+    async def flush_loop(self):
+        while not self.mbot.is_closed:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        self._flush_task.cancel()
+        await self.flush()
@@ -0,0 +1,3 @@
+from .base import Storage
+from .memory import MemoryStorage
+from .sqlite import SQLiteStorage
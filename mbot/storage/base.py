@@ -0,0 +1,47 @@
+from pymongo import ASCENDING
+
+
+class Storage(object):
+    '''
+    Interface of the database used by the bot. A backend provides the `bot_data` and `plugin_data`
+    databases; collections are accessed as attributes (or items) of a database and support the
+    subset of motor's collection API which the bot uses:
+
+        find_one, find (with sort/skip/limit), insert_one, insert_many, replace_one,
+        update_one, update_many, delete_one, delete_many, bulk_write, aggregate,
+        create_index, index_information
+
+    Updates support `$set`, `$setOnInsert`, `$unset`, `$inc`, `$push`, `$addToSet` and `$pull`
+    (including the positional `$` operator), and return the same result types as pymongo.
+    Plugins should not use the backends directly, instead all plugins should access the
+    database through the `mongo` attribute of the `mbot` class.
+    '''
+    # Indexes of the `bot_data` collections, see `IndexRegistry`.
+    # indexes:
+    #   {collection_name: [(keys, options), ...], ...}
+    indexes = {
+        'config': [([('server_id', ASCENDING)], {'unique': True})],
+        'cmd_history': [
+            ([('user_id', ASCENDING), ('command', ASCENDING)], {}),
+            ([('expires_at', ASCENDING)], {'expireAfterSeconds': 0})
+        ],
+        'stats': [([('scope', ASCENDING)], {})],
+        'bot_guilds': [([('server_id', ASCENDING)], {})],
+        'global_blacklist': [([('user_id', ASCENDING)], {})]
+    }
+
+    # The `DatabaseMonitor` which operations are reported to, if any.
+    monitor = None
+
+    def __init__(self, bot_data, plugin_data):
+        self.bot_data = bot_data
+
+        self.config = self.bot_data.config
+        self.cmd_history = self.bot_data.cmd_history
+        self.stats = self.bot_data.stats
+        self.bot_guilds = self.bot_data.bot_guilds
+
+        self.plugin_data = plugin_data
+
+    def close(self):
+        '''Release the connections (or files) held by the backend.'''
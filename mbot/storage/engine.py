@@ -0,0 +1,603 @@
+import time
+import logging
+from copy import deepcopy
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from pymongo import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from pymongo.errors import PyMongoError, OperationFailure, DuplicateKeyError, BulkWriteError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+from .base import Storage
+from .query import (
+    match, resolve, project, apply_update, upsert_document, set_path, sort_spec, sort_documents,
+    index_key, index_keys, naive_utc
+)
+
+log = logging.getLogger(__name__)
+
+# Seconds between removals of documents which have expired according to a TTL index, like mongo's TTL monitor.
+TTL_INTERVAL = 60
+
+
+# The mongo command each engine method corresponds to, so that all backends are reported alike by `DatabaseMonitor`.
+_COMMANDS = {
+    'insert_one': 'insert',
+    'insert_many': 'insert',
+    'create_index': 'createIndexes',
+    'index_information': 'listIndexes'
+}
+
+
+def _equality_targets(cond):
+    '''Return the values which a query condition matches by equality, or `None` if it is not an equality match.'''
+    if isinstance(cond, list):
+        return None
+
+    if isinstance(cond, dict) and any(key.startswith('$') for key in cond):
+        if '$eq' in cond:
+            return _equality_targets(cond['$eq'])
+
+        if '$in' in cond and not any(isinstance(target, (list, dict)) for target in cond['$in']):
+            return list(cond['$in'])
+
+        return None
+
+    return [cond]
+
+
+def _bulk_result():
+    return {
+        'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0,
+        'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []
+    }
+
+
+class CollectionEngine(object):
+    '''
+    Implementation of the collection operations on top of a document store, which is shared by
+    the backends that do not run on mongo. A store keeps the documents of a collection keyed on
+    their `_id`, along with the keys of every document in each secondary index. Queries with an
+    equality condition on `_id` or on the first field of an index only fetch the documents with
+    matching keys; all other queries scan the whole collection.
+
+    Every operation runs in a transaction of the store. Engines are not thread safe.
+    '''
+    def __init__(self, name, store):
+        self.name = name
+        self.store = store
+
+        # indexes:
+        #   {index_name: (keys, options), ...}
+        self.indexes = store.index_specs()
+
+        self._swept = 0
+
+    def _plan(self, query):
+        '''Return the documents which may match `query`, the plan used to find them and the number of keys looked up.'''
+        if '_id' in query:
+            targets = _equality_targets(query['_id'])
+
+            if targets is not None:
+                docs = [self.store.get(index_key(target)) for target in targets]
+                return [doc for doc in docs if doc is not None], {'stage': 'IDHACK'}, len(targets)
+
+        for name, (keys, _) in self.indexes.items():
+            if keys[0][0] in query:
+                targets = _equality_targets(query[keys[0][0]])
+
+                if targets is not None:
+                    lookup = {index_key(target) for target in targets}
+                    plan = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': name}}
+
+                    return self.store.lookup(name, lookup), plan, len(lookup)
+
+        return self.store.scan(), {'stage': 'COLLSCAN'}, 0
+
+    def _find(self, query):
+        return [doc for doc in self._plan(query)[0] if match(doc, query)]
+
+    def _copy(self, doc):
+        return doc if self.store.copies else deepcopy(doc)
+
+    def _expire(self):
+        now = time.monotonic()
+
+        if now - self._swept < TTL_INTERVAL:
+            return
+
+        self._swept = now
+
+        for keys, options in self.indexes.values():
+            if 'expireAfterSeconds' not in options:
+                continue
+
+            cutoff = datetime.utcnow() - timedelta(seconds=options['expireAfterSeconds'])
+
+            for doc in self.store.scan():
+                dates = [naive_utc(value) for value in resolve(doc, keys[0][0]) if isinstance(value, datetime)]
+
+                if dates and min(dates) < cutoff:
+                    self.store.delete(index_key(doc['_id']))
+
+    def _duplicate(self, index):
+        return DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {index}', 11000)
+
+    def _write(self, doc):
+        id_key = index_key(doc['_id'])
+        entries = {}
+
+        for name, (keys, options) in self.indexes.items():
+            lookup, compound = index_keys(doc, keys)
+
+            if options.get('unique'):
+                for other in self.store.lookup(name, lookup):
+                    if index_key(other['_id']) != id_key and compound & index_keys(other, keys)[1]:
+                        raise self._duplicate(name)
+
+            entries[name] = lookup
+
+        self.store.put(id_key, doc, entries)
+
+    def _insert(self, doc):
+        if self.store.get(index_key(doc['_id'])) is not None:
+            raise self._duplicate('_id_')
+
+        self._write(deepcopy(doc))
+
+    def _update(self, query, update, upsert=False, multi=False, replace=False):
+        if replace and any(key.startswith('$') for key in update):
+            raise ValueError('replacement can not include $ operators')
+
+        docs = self._find(query)
+
+        if not multi:
+            docs = docs[:1]
+
+        modified = 0
+
+        for doc in docs:
+            if replace:
+                new = {'_id': doc['_id'], **deepcopy(update)}
+            else:
+                new = apply_update(doc, update, query)
+
+            if new != doc:
+                self._write(new)
+                modified += 1
+
+        if not docs and upsert:
+            if replace:
+                new = deepcopy(update)
+            else:
+                new = apply_update(upsert_document(query), update, query, inserting=True)
+
+            new = {'_id': new.pop('_id', None) or ObjectId(), **new}
+            self._insert(new)
+
+            return {'n': 1, 'nModified': 0, 'upserted': new['_id'], 'updatedExisting': False}
+
+        return {'n': len(docs), 'nModified': modified, 'updatedExisting': bool(docs)}
+
+    def _delete(self, query, multi=False):
+        docs = self._find(query)
+
+        if not multi:
+            docs = docs[:1]
+
+        for doc in docs:
+            self.store.delete(index_key(doc['_id']))
+
+        return {'n': len(docs)}
+
+    def find(self, query, projection=None, sort=None, skip=0, limit=0):
+        with self.store.transaction():
+            self._expire()
+            docs = self._find(query)
+
+        if sort:
+            sort_documents(docs, sort)
+
+        docs = docs[skip:skip + limit if limit else None]
+        return [project(doc, projection) if projection else self._copy(doc) for doc in docs]
+
+    def insert_one(self, doc):
+        with self.store.transaction():
+            self._expire()
+            self._insert(doc)
+
+    def insert_many(self, docs, ordered=True):
+        result = _bulk_result()
+
+        with self.store.transaction():
+            self._expire()
+
+            for i, doc in enumerate(docs):
+                try:
+                    self._insert(doc)
+                    result['nInserted'] += 1
+                except DuplicateKeyError as e:
+                    result['writeErrors'].append({'index': i, 'code': e.code, 'errmsg': str(e), 'op': doc})
+
+                    if ordered:
+                        break
+
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+
+    def update(self, query, update, upsert=False, multi=False, replace=False):
+        with self.store.transaction():
+            self._expire()
+            return self._update(query, update, upsert, multi, replace)
+
+    def delete(self, query, multi=False):
+        with self.store.transaction():
+            self._expire()
+            return self._delete(query, multi)
+
+    def bulk_write(self, requests, ordered=True):
+        result = _bulk_result()
+
+        with self.store.transaction():
+            self._expire()
+
+            for i, request in enumerate(requests):
+                # The arguments of the request classes of pymongo are only available as private attributes.
+                try:
+                    if isinstance(request, InsertOne):
+                        request._doc.setdefault('_id', ObjectId())
+                        self._insert(request._doc)
+                        result['nInserted'] += 1
+                    elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                        raw = self._update(
+                            request._filter, request._doc, request._upsert,
+                            multi=isinstance(request, UpdateMany), replace=isinstance(request, ReplaceOne)
+                        )
+
+                        if 'upserted' in raw:
+                            result['nUpserted'] += 1
+                            result['upserted'].append({'index': i, '_id': raw['upserted']})
+                        else:
+                            result['nMatched'] += raw['n']
+                            result['nModified'] += raw['nModified']
+                    elif isinstance(request, (DeleteOne, DeleteMany)):
+                        result['nRemoved'] += self._delete(request._filter, multi=isinstance(request, DeleteMany))['n']
+                    else:
+                        raise TypeError(f'{request!r} is not a valid request')
+                except PyMongoError as e:
+                    result['writeErrors'].append({
+                        'index': i, 'code': getattr(e, 'code', None) or 2, 'errmsg': str(e), 'op': request
+                    })
+
+                    if ordered:
+                        break
+
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+
+        return result
+
+    def aggregate(self, pipeline):
+        '''
+        Run an aggregation pipeline. Only the `$match`, `$unwind`, `$sort`, `$skip`, `$limit`,
+        `$project` and `$count` stages are supported.
+        '''
+        with self.store.transaction():
+            self._expire()
+
+            if pipeline and '$match' in pipeline[0]:
+                # The first stage can use an index.
+                docs, pipeline = self._find(pipeline[0]['$match']), pipeline[1:]
+            else:
+                docs = self.store.scan()
+
+        docs = [self._copy(doc) for doc in docs]
+
+        for stage in pipeline:
+            (name, arg), = stage.items()
+
+            if name == '$match':
+                docs = [doc for doc in docs if match(doc, arg)]
+            elif name == '$unwind':
+                docs = self._unwind(docs, arg)
+            elif name == '$sort':
+                sort_documents(docs, sort_spec(arg))
+            elif name == '$skip':
+                docs = docs[arg:]
+            elif name == '$limit':
+                docs = docs[:arg]
+            elif name == '$project':
+                docs = [project(doc, arg) for doc in docs]
+            elif name == '$count':
+                docs = [{arg: len(docs)}]
+            else:
+                raise OperationFailure(f'unsupported pipeline stage: {name}')
+
+        return docs
+
+    @staticmethod
+    def _unwind(docs, arg):
+        path = (arg if isinstance(arg, str) else arg['path'])[1:]
+        preserve = isinstance(arg, dict) and arg.get('preserveNullAndEmptyArrays', False)
+
+        unwound = []
+
+        for doc in docs:
+            values = resolve(doc, path)
+
+            if not values or not isinstance(values[0], list):
+                if preserve or (values and values[0] is not None):
+                    unwound.append(doc)
+            elif not values[0]:
+                if preserve:
+                    unwound.append(doc)
+            else:
+                for element in values[0]:
+                    new = deepcopy(doc) if '.' in path else dict(doc)
+                    set_path(new, path, element)
+                    unwound.append(new)
+
+        return unwound
+
+    def explain(self, query, sort=None):
+        start = time.perf_counter()
+
+        with self.store.transaction():
+            candidates, plan, keys = self._plan(query)
+            returned = sum(1 for doc in candidates if match(doc, query))
+
+        if sort:
+            plan = {'stage': 'SORT', 'inputStage': plan}
+
+        return {
+            'queryPlanner': {'namespace': self.name, 'winningPlan': plan},
+            'executionStats': {
+                'nReturned': returned,
+                'totalKeysExamined': keys,
+                'totalDocsExamined': len(candidates),
+                'executionTimeMillis': int((time.perf_counter() - start) * 1000)
+            }
+        }
+
+    def create_index(self, keys, name=None, **options):
+        keys = sort_spec(keys)
+        name = name or '_'.join(f'{field}_{direction}' for field, direction in keys)
+        options = {k: v for k, v in options.items() if k in ('unique', 'expireAfterSeconds')}
+
+        if name in self.indexes:
+            if self.indexes[name] != (keys, options):
+                raise OperationFailure(f'Index with name: {name} already exists with different options', 85)
+
+            return name
+
+        with self.store.transaction():
+            entries, seen = {}, set()
+
+            for doc in self.store.scan():
+                lookup, compound = index_keys(doc, keys)
+
+                if options.get('unique'):
+                    if compound & seen:
+                        raise self._duplicate(name)
+
+                    seen.update(compound)
+
+                entries[index_key(doc['_id'])] = lookup
+
+            self.store.add_index(name, keys, options, entries)
+
+        self.indexes[name] = (keys, options)
+        return name
+
+    def index_information(self):
+        info = {'_id_': {'key': [('_id', 1)]}}
+
+        for name, (keys, options) in self.indexes.items():
+            info[name] = {'key': list(keys), **options}
+
+        return info
+
+
+class _Cursor(object):
+    def __init__(self, collection):
+        self.collection = collection
+        self._results = None
+
+    async def _fetch(self):
+        raise NotImplementedError
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            self._results = iter(await self._fetch())
+
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length):
+        docs = []
+
+        async for doc in self:
+            docs.append(doc)
+
+            if length is not None and len(docs) >= length:
+                break
+
+        return docs
+
+
+class Cursor(_Cursor):
+    '''Cursor of `Collection.find`; the query only runs once the cursor is first iterated.'''
+    def __init__(self, collection, query, projection=None):
+        super().__init__(collection)
+
+        self.query = query
+        self.projection = projection
+
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    async def _fetch(self):
+        return await self.collection._run('find', self.query, self.projection, self._sort, self._skip, self._limit)
+
+    async def explain(self):
+        return await self.collection._run('explain', self.query, self._sort)
+
+
+class CommandCursor(_Cursor):
+    '''Cursor of `Collection.aggregate`.'''
+    def __init__(self, collection, pipeline):
+        super().__init__(collection)
+        self.pipeline = pipeline
+
+    async def _fetch(self):
+        return await self.collection._run('aggregate', self.pipeline)
+
+
+class Collection(object):
+    '''The subset of motor's `AsyncIOMotorCollection` which the bot uses, see `Storage`.'''
+    def __init__(self, storage, database, name):
+        self.storage = storage
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+
+    async def _run(self, method, *args, **kwargs):
+        def call():
+            return getattr(self.storage.engine(self.full_name), method)(*args, **kwargs)
+
+        if self.storage.monitor is None:
+            return await self.storage.run(call)
+
+        start = time.perf_counter()
+        failed = True
+
+        try:
+            result = await self.storage.run(call)
+            failed = False
+            return result
+        finally:
+            self.storage.monitor.observe(
+                self.full_name, _COMMANDS.get(method, method), time.perf_counter() - start, failed
+            )
+
+    def find(self, filter=None, projection=None):
+        return Cursor(self, filter or {}, projection)
+
+    async def find_one(self, filter=None, projection=None):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+
+        docs = await self._run('find', filter or {}, projection, None, 0, 1)
+        return docs[0] if docs else None
+
+    async def insert_one(self, document):
+        # Like pymongo, the `_id` is added to the document which was passed in.
+        document.setdefault('_id', ObjectId())
+
+        await self._run('insert_one', document)
+        return InsertOneResult(document['_id'], True)
+
+    async def insert_many(self, documents, ordered=True):
+        documents = list(documents)
+
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+
+        await self._run('insert_many', documents, ordered)
+        return InsertManyResult([document['_id'] for document in documents], True)
+
+    async def replace_one(self, filter, replacement, upsert=False):
+        return UpdateResult(await self._run('update', filter, replacement, upsert, False, True), True)
+
+    async def update_one(self, filter, update, upsert=False):
+        return UpdateResult(await self._run('update', filter, update, upsert, False), True)
+
+    async def update_many(self, filter, update, upsert=False):
+        return UpdateResult(await self._run('update', filter, update, upsert, True), True)
+
+    async def delete_one(self, filter):
+        return DeleteResult(await self._run('delete', filter, False), True)
+
+    async def delete_many(self, filter):
+        return DeleteResult(await self._run('delete', filter, True), True)
+
+    async def bulk_write(self, requests, ordered=True):
+        return BulkWriteResult(await self._run('bulk_write', list(requests), ordered), True)
+
+    def aggregate(self, pipeline, **kwargs):
+        return CommandCursor(self, pipeline)
+
+    async def create_index(self, keys, **kwargs):
+        return await self._run('create_index', keys, **kwargs)
+
+    async def index_information(self):
+        return await self._run('index_information')
+
+
+class Database(object):
+    '''Collections are accessed as attributes or items of the database, like in motor.'''
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return self[name]
+
+    def __getitem__(self, name):
+        return Collection(self.storage, self, name)
+
+    async def list_collection_names(self):
+        return await self.storage.run(self.storage.collection_names, self.name)
+
+
+class DocumentStorage(Storage):
+    '''
+    Base of the storage backends which run the collection operations in-process, with a
+    `CollectionEngine` per collection. Backends provide the document stores and decide where
+    the operations run.
+    '''
+    def __init__(self):
+        # _engines:
+        #   {'database.collection': CollectionEngine, ...}
+        self._engines = {}
+
+        super().__init__(Database(self, 'bot_data'), Database(self, 'plugin_data'))
+
+    def open_store(self, full_name):
+        raise NotImplementedError
+
+    def collection_names(self, database):
+        raise NotImplementedError
+
+    async def run(self, func, *args):
+        '''Run `func(*args)`, which performs an operation on one or more engines, and return the result.'''
+        raise NotImplementedError
+
+    def engine(self, full_name):
+        engine = self._engines.get(full_name)
+
+        if engine is None:
+            engine = self._engines[full_name] = CollectionEngine(full_name, self.open_store(full_name))
+
+        return engine
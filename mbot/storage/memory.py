@@ -0,0 +1,111 @@
+import itertools
+from contextlib import contextmanager
+
+from .engine import DocumentStorage
+
+
+class MemoryStore(object):
+    '''
+    Documents of a single collection, kept in dicts. Operations which fail half way are not
+    rolled back, which does not matter for benchmarks and tests.
+    '''
+    # Documents are returned as stored, the engine copies them before handing them out.
+    copies = False
+
+    def __init__(self):
+        # _docs:
+        #   {id_key: document, ...}
+        self._docs = {}
+
+        # _order:
+        #   {id_key: insertion_sequence, ...}
+        self._order = {}
+        self._seq = itertools.count()
+
+        # _specs:
+        #   {index_name: (keys, options), ...}
+        self._specs = {}
+
+        # _keys:
+        #   {index_name: {key: {id_key, ...}, ...}, ...}
+        self._keys = {}
+
+        # _entries:
+        #   {id_key: {index_name: {key, ...}, ...}, ...}
+        self._entries = {}
+
+    def get(self, id_key):
+        return self._docs.get(id_key)
+
+    def scan(self):
+        return list(self._docs.values())
+
+    def lookup(self, name, keys):
+        index = self._keys.get(name, {})
+        ids = set()
+
+        for key in keys:
+            ids.update(index.get(key, ()))
+
+        return [self._docs[id_key] for id_key in sorted(ids, key=self._order.__getitem__)]
+
+    def _add_entries(self, id_key, name, keys):
+        self._entries.setdefault(id_key, {})[name] = keys
+
+        for key in keys:
+            self._keys[name].setdefault(key, set()).add(id_key)
+
+    def _remove_entries(self, id_key):
+        for name, keys in self._entries.pop(id_key, {}).items():
+            index = self._keys[name]
+
+            for key in keys:
+                index[key].discard(id_key)
+
+                if not index[key]:
+                    del index[key]
+
+    def put(self, id_key, doc, entries):
+        self._remove_entries(id_key)
+
+        if id_key not in self._docs:
+            self._order[id_key] = next(self._seq)
+
+        self._docs[id_key] = doc
+
+        for name, keys in entries.items():
+            self._add_entries(id_key, name, keys)
+
+    def delete(self, id_key):
+        self._remove_entries(id_key)
+        self._docs.pop(id_key, None)
+        self._order.pop(id_key, None)
+
+    def index_specs(self):
+        return dict(self._specs)
+
+    def add_index(self, name, keys, options, entries):
+        self._specs[name] = (keys, options)
+        self._keys[name] = {}
+
+        for id_key, index_keys in entries.items():
+            self._add_entries(id_key, name, index_keys)
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+
+class MemoryStorage(DocumentStorage):
+    '''
+    Storage backend which keeps the whole database in memory, so it needs no database server
+    at all. Everything is lost when the bot exits; this is meant for benchmarks and load tests.
+    '''
+    def open_store(self, full_name):
+        return MemoryStore()
+
+    def collection_names(self, database):
+        return [name.split('.', 1)[1] for name in self._engines if name.startswith(database + '.')]
+
+    async def run(self, func, *args):
+        return func(*args)
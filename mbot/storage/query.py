@@ -0,0 +1,555 @@
+'''
+Evaluation of mongo queries, updates, projections and sort orders on plain documents, for
+the storage backends which do not run on top of mongo. Only the parts of the query language
+which the bot actually uses are supported; anything else raises `OperationFailure`.
+'''
+import operator
+import itertools
+from copy import deepcopy
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure
+
+
+def resolve(doc, path):
+    '''
+    Return all values at the dotted `path` in `doc`. Like mongo, arrays of sub-documents
+    are traversed, so `ranking.server_id` yields the `server_id` of every element of `ranking`.
+    '''
+    values = [doc]
+
+    for part in path.split('.'):
+        found = []
+
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        found.append(value[int(part)])
+                else:
+                    found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+
+        values = found
+
+    return values
+
+
+def _expand(values):
+    '''The values themselves and the elements of those which are arrays, which is what equality matches against.'''
+    expanded = []
+
+    for value in values:
+        expanded.append(value)
+
+        if isinstance(value, list):
+            expanded.extend(value)
+
+    return expanded
+
+
+def _elements(values):
+    '''Like `_expand`, but arrays are replaced by their elements, which is what indexes and sorts use.'''
+    elements = []
+
+    for value in values:
+        if isinstance(value, list):
+            elements.extend(value or [None])
+        else:
+            elements.append(value)
+
+    return elements or [None]
+
+
+def naive_utc(value):
+    '''Convert a datetime to a naive datetime in UTC, which is how datetimes are stored.'''
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return value
+
+
+def sort_key(value):
+    '''Key which orders values of different types the same way mongo does.'''
+    if value is None:
+        return (1,)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, dict):
+        return (4, tuple((k, sort_key(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return (5, tuple(sort_key(v) for v in value))
+    if isinstance(value, bytes):
+        return (6, value)
+    if isinstance(value, ObjectId):
+        return (7, value.binary)
+    if isinstance(value, datetime):
+        return (9, naive_utc(value))
+
+    return (10, repr(value))
+
+
+def index_key(value):
+    '''Return a string which is equal for two values exactly when mongo considers them equal.'''
+    def hashable(value):
+        if value is None:
+            return ('z',)
+        if isinstance(value, bool):
+            return ('b', value)
+        if isinstance(value, (int, float)):
+            return ('n', int(value) if isinstance(value, float) and value.is_integer() else value)
+        if isinstance(value, dict):
+            return ('d', tuple((k, hashable(v)) for k, v in value.items()))
+        if isinstance(value, list):
+            return ('l', tuple(hashable(v) for v in value))
+        if isinstance(value, ObjectId):
+            return ('o', str(value))
+        if isinstance(value, datetime):
+            return ('t', naive_utc(value).isoformat())
+
+        return (type(value).__name__, value)
+
+    return repr(hashable(value))
+
+
+def index_keys(doc, keys):
+    '''
+    Return the keys of `doc` in an index on `keys`, as a tuple of the keys of the first field
+    (which are used to look documents up) and the keys of all fields (which are used to check
+    unique indexes). Like in mongo, an array produces a key for each of its elements.
+    '''
+    fields = [{index_key(value) for value in _elements(resolve(doc, field))} for field, _ in keys]
+    return fields[0], set(itertools.product(*fields))
+
+
+def equal(a, b):
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return list(a) == list(b) and all(equal(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(map(equal, a, b))
+    if isinstance(a, (dict, list)) or isinstance(b, (dict, list)):
+        return False
+
+    return a == b
+
+
+def _equals_any(values, target):
+    if target is None and not values:
+        # A missing field matches `None`.
+        return True
+
+    return any(equal(value, target) for value in _expand(values))
+
+
+_COMPARISONS = {'$gt': operator.gt, '$gte': operator.ge, '$lt': operator.lt, '$lte': operator.le}
+
+
+def _compare(values, target, op):
+    target = sort_key(target)
+    return any(
+        key[0] == target[0] and op(key, target) for key in (sort_key(value) for value in _expand(values))
+    )
+
+
+def _is_operator_dict(value):
+    return isinstance(value, dict) and value and all(key.startswith('$') for key in value)
+
+
+def _elem_match(element, query):
+    if _is_operator_dict(query):
+        return _match_operators([element], query)
+
+    return isinstance(element, dict) and match(element, query)
+
+
+def _match_operators(values, cond):
+    for op, arg in cond.items():
+        if op == '$eq':
+            ok = _equals_any(values, arg)
+        elif op == '$ne':
+            ok = not _equals_any(values, arg)
+        elif op in _COMPARISONS:
+            ok = _compare(values, arg, _COMPARISONS[op])
+        elif op == '$in':
+            ok = any(_equals_any(values, target) for target in arg)
+        elif op == '$nin':
+            ok = not any(_equals_any(values, target) for target in arg)
+        elif op == '$exists':
+            ok = bool(values) == bool(arg)
+        elif op == '$elemMatch':
+            ok = any(isinstance(v, list) and any(_elem_match(e, arg) for e in v) for v in values)
+        elif op == '$size':
+            ok = any(isinstance(v, list) and len(v) == arg for v in values)
+        elif op == '$all':
+            ok = all(_equals_any(values, target) for target in arg)
+        elif op == '$not':
+            ok = not _match_operators(values, arg)
+        else:
+            raise OperationFailure(f'unknown operator: {op}')
+
+        if not ok:
+            return False
+
+    return True
+
+
+def match_field(doc, path, cond):
+    values = resolve(doc, path)
+
+    if _is_operator_dict(cond):
+        return _match_operators(values, cond)
+
+    return _equals_any(values, cond)
+
+
+def match(doc, query):
+    '''Return `True` if `doc` matches the mongo query `query`.'''
+    for key, cond in query.items():
+        if key == '$and':
+            ok = all(match(doc, q) for q in cond)
+        elif key == '$or':
+            ok = any(match(doc, q) for q in cond)
+        elif key == '$nor':
+            ok = not any(match(doc, q) for q in cond)
+        elif key.startswith('$'):
+            raise OperationFailure(f'unknown top level operator: {key}')
+        else:
+            ok = match_field(doc, key, cond)
+
+        if not ok:
+            return False
+
+    return True
+
+
+def positional_index(doc, query, path):
+    '''
+    Return the index which the positional operator in the update path `path` (eg. `plugins.$.commands`)
+    stands for, i.e. the first element of the array which matches the conditions of `query` on that array.
+    '''
+    array_path = path[:path.index('.$')]
+    array = resolve(doc, array_path)
+
+    conditions = []
+
+    for key, cond in query.items():
+        if key == array_path:
+            conditions.append((None, cond))
+        elif key.startswith(array_path + '.'):
+            conditions.append((key[len(array_path) + 1:], cond))
+
+    if array and isinstance(array[0], list) and conditions:
+        for i, element in enumerate(array[0]):
+            matched = True
+
+            for sub_path, cond in conditions:
+                if sub_path is None and _is_operator_dict(cond) and '$elemMatch' in cond:
+                    matched = _elem_match(element, cond['$elemMatch'])
+                elif sub_path is None:
+                    matched = match_field({'e': element}, 'e', cond)
+                else:
+                    matched = isinstance(element, dict) and match_field(element, sub_path, cond)
+
+                if not matched:
+                    break
+
+            if matched:
+                return i
+
+    raise OperationFailure('The positional operator did not find the match needed from the query.')
+
+
+def _list_index(array, part):
+    if not str(part).isdigit():
+        raise OperationFailure(f'cannot use the part ({part}) to traverse the array {array!r}')
+
+    return int(part)
+
+
+def _parent(doc, path, position, create=True):
+    '''Return the container of the field at `path` and its key in the container, or `(None, None)`.'''
+    parts = path.split('.')
+
+    if '$' in parts:
+        parts[parts.index('$')] = str(position)
+
+    node = doc
+
+    for part in parts[:-1]:
+        if isinstance(node, list):
+            i = _list_index(node, part)
+
+            if i >= len(node):
+                if not create:
+                    return None, None
+
+                node.extend([None] * (i + 1 - len(node)))
+
+            if node[i] is None:
+                if not create:
+                    return None, None
+
+                node[i] = {}
+
+            node = node[i]
+        elif isinstance(node, dict):
+            if node.get(part) is None:
+                if not create:
+                    return None, None
+
+                node[part] = {}
+
+            node = node[part]
+        elif not create:
+            return None, None
+        else:
+            raise OperationFailure(f'cannot create field {part} in element {node!r}')
+
+    last = parts[-1]
+
+    if isinstance(node, list):
+        return node, _list_index(node, last)
+
+    if not isinstance(node, dict):
+        if not create:
+            return None, None
+
+        raise OperationFailure(f'cannot create field {last} in element {node!r}')
+
+    return node, last
+
+
+def _get(container, key, default=None):
+    if isinstance(container, list):
+        return container[key] if key < len(container) else default
+
+    if isinstance(container, dict):
+        return container.get(key, default)
+
+    return default
+
+
+def _assign(container, key, value):
+    if isinstance(container, list) and key >= len(container):
+        container.extend([None] * (key + 1 - len(container)))
+
+    container[key] = value
+
+
+def _array(container, key, op):
+    array = _get(container, key)
+
+    if array is None:
+        array = []
+        _assign(container, key, array)
+    elif not isinstance(array, list):
+        raise OperationFailure(f'the field {key} must be an array to apply {op}')
+
+    return array
+
+
+def _each(value, op):
+    if isinstance(value, dict) and '$each' in value:
+        if len(value) > 1:
+            raise OperationFailure(f'only $each is supported for {op}')
+
+        return value['$each']
+
+    return [value]
+
+
+def _set(doc, path, value, position):
+    container, key = _parent(doc, path, position)
+    _assign(container, key, deepcopy(value))
+
+
+def set_path(doc, path, value):
+    '''Set the field at the dotted `path` of `doc` to (a copy of) `value`, creating sub-documents as needed.'''
+    _set(doc, path, value, None)
+
+
+def _unset(doc, path, value, position):
+    container, key = _parent(doc, path, position, create=False)
+
+    if isinstance(container, dict):
+        container.pop(key, None)
+    elif isinstance(container, list) and key < len(container):
+        container[key] = None
+
+
+def _inc(doc, path, value, position):
+    container, key = _parent(doc, path, position)
+    current = _get(container, key, 0)
+
+    if isinstance(current, bool) or not isinstance(current, (int, float)):
+        raise OperationFailure(f'cannot apply $inc to {path}, which has the non-numeric value {current!r}')
+
+    _assign(container, key, current + value)
+
+
+def _push(doc, path, value, position):
+    container, key = _parent(doc, path, position)
+    _array(container, key, '$push').extend(deepcopy(_each(value, '$push')))
+
+
+def _add_to_set(doc, path, value, position):
+    container, key = _parent(doc, path, position)
+    array = _array(container, key, '$addToSet')
+
+    for item in _each(value, '$addToSet'):
+        if not any(equal(x, item) for x in array):
+            array.append(deepcopy(item))
+
+
+def _pull(doc, path, cond, position):
+    container, key = _parent(doc, path, position, create=False)
+    array = _get(container, key)
+
+    if not isinstance(array, list):
+        return
+
+    if _is_operator_dict(cond):
+        keep = [item for item in array if not _match_operators([item], cond)]
+    elif isinstance(cond, dict):
+        keep = [item for item in array if not (isinstance(item, dict) and match(item, cond))]
+    else:
+        keep = [item for item in array if not equal(item, cond)]
+
+    array[:] = keep
+
+
+_UPDATE_OPERATORS = {
+    '$set': _set,
+    '$setOnInsert': _set,
+    '$unset': _unset,
+    '$inc': _inc,
+    '$push': _push,
+    '$addToSet': _add_to_set,
+    '$pull': _pull
+}
+
+
+def apply_update(doc, update, query, inserting=False):
+    '''Return a copy of `doc` with the update operators of `update` applied to it.'''
+    if not update or not all(op.startswith('$') for op in update):
+        raise ValueError('update only works with $ operators')
+
+    new = deepcopy(doc)
+
+    for op, fields in update.items():
+        if op not in _UPDATE_OPERATORS:
+            raise OperationFailure(f'unknown modifier: {op}')
+
+        if op == '$setOnInsert' and not inserting:
+            continue
+
+        for path, value in fields.items():
+            position = positional_index(doc, query, path) if '$' in path.split('.') else None
+            _UPDATE_OPERATORS[op](new, path, value, position)
+
+    return new
+
+
+def upsert_document(query):
+    '''Return the document which an upsert starts from, i.e. the equality conditions of `query`.'''
+    doc = {}
+
+    for key, cond in query.items():
+        if key == '$and':
+            for sub_query in cond:
+                for path, value in upsert_document(sub_query).items():
+                    _set(doc, path, value, None)
+        elif key.startswith('$'):
+            continue
+        elif _is_operator_dict(cond):
+            if '$eq' in cond:
+                _set(doc, key, cond['$eq'], None)
+        else:
+            _set(doc, key, cond, None)
+
+    return doc
+
+
+def _copy_path(src, dst, parts):
+    key = parts[0]
+
+    if key not in src:
+        return
+
+    value = src[key]
+
+    if len(parts) == 1:
+        dst[key] = deepcopy(value)
+    elif isinstance(value, dict):
+        _copy_path(value, dst.setdefault(key, {}), parts[1:])
+    elif isinstance(value, list):
+        elements = [e for e in value if isinstance(e, dict)]
+
+        for element, projected in zip(elements, dst.setdefault(key, [{} for _ in elements])):
+            _copy_path(element, projected, parts[1:])
+
+
+def _remove_path(doc, parts):
+    if isinstance(doc, list):
+        for element in doc:
+            _remove_path(element, parts)
+    elif isinstance(doc, dict) and parts[0] in doc:
+        if len(parts) == 1:
+            del doc[parts[0]]
+        else:
+            _remove_path(doc[parts[0]], parts[1:])
+
+
+def project(doc, projection):
+    '''Return a copy of `doc` with only the fields selected by the (inclusive or exclusive) `projection`.'''
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = projection.get('_id', 1)
+    fields = {field: value for field, value in projection.items() if field != '_id'}
+
+    if any(fields.values()):
+        projected = {'_id': deepcopy(doc['_id'])} if include_id and '_id' in doc else {}
+
+        for field, value in fields.items():
+            if value:
+                _copy_path(doc, projected, field.split('.'))
+    else:
+        projected = deepcopy(doc)
+
+        for field in fields:
+            _remove_path(projected, field.split('.'))
+
+        if not include_id:
+            projected.pop('_id', None)
+
+    return projected
+
+
+def sort_spec(key_or_list, direction=None):
+    '''Normalize the arguments of `Cursor.sort` (or a `$sort` stage) into a list of `(field, direction)`.'''
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+
+    return [(field, direction) for field, direction in key_or_list]
+
+
+def sort_documents(docs, spec):
+    '''Sort `docs` in place by `spec`; an array sorts by its smallest (or largest, if descending) element.'''
+    for field, direction in reversed(spec):
+        pick = min if direction > 0 else max
+        docs.sort(key=lambda doc: pick(sort_key(v) for v in _elements(resolve(doc, field))), reverse=direction < 0)
+
+    return docs
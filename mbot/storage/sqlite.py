@@ -0,0 +1,166 @@
+import sqlite3
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import BSON
+
+from .engine import DocumentStorage
+
+log = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS documents ('
+    'collection TEXT NOT NULL, id TEXT NOT NULL, doc BLOB NOT NULL, PRIMARY KEY (collection, id))',
+
+    'CREATE TABLE IF NOT EXISTS index_specs ('
+    'collection TEXT NOT NULL, name TEXT NOT NULL, spec BLOB NOT NULL, PRIMARY KEY (collection, name))',
+
+    'CREATE TABLE IF NOT EXISTS index_entries ('
+    'collection TEXT NOT NULL, name TEXT NOT NULL, key TEXT NOT NULL, id TEXT NOT NULL)',
+
+    'CREATE INDEX IF NOT EXISTS index_entries_key ON index_entries (collection, name, key)',
+    'CREATE INDEX IF NOT EXISTS index_entries_id ON index_entries (collection, id)'
+)
+
+# Maximum number of keys looked up in a single statement; sqlite limits the number of parameters.
+LOOKUP_CHUNK = 500
+
+
+class SQLiteStore(object):
+    '''
+    Documents of a single collection in a SQLite database. Documents are stored as BSON, so they
+    are read back exactly as mongo would return them, and the keys of every document in each
+    secondary index are stored in `index_entries`.
+    '''
+    # Every read decodes a new copy of the document.
+    copies = True
+
+    def __init__(self, conn, collection):
+        self.conn = conn
+        self.collection = collection
+
+    def get(self, id_key):
+        row = self.conn.execute(
+            'SELECT doc FROM documents WHERE collection = ? AND id = ?', (self.collection, id_key)
+        ).fetchone()
+
+        return BSON(row[0]).decode() if row else None
+
+    def scan(self):
+        rows = self.conn.execute('SELECT doc FROM documents WHERE collection = ? ORDER BY rowid', (self.collection,))
+        return [BSON(row[0]).decode() for row in rows]
+
+    def lookup(self, name, keys):
+        keys, rows = list(keys), {}
+
+        for i in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[i:i + LOOKUP_CHUNK]
+
+            rows.update(self.conn.execute(
+                'SELECT DISTINCT documents.rowid, documents.doc FROM index_entries JOIN documents '
+                'ON documents.collection = index_entries.collection AND documents.id = index_entries.id '
+                'WHERE index_entries.collection = ? AND index_entries.name = ? '
+                f'AND index_entries.key IN ({", ".join("?" * len(chunk))})',
+                (self.collection, name, *chunk)
+            ))
+
+        return [BSON(rows[rowid]).decode() for rowid in sorted(rows)]
+
+    def _add_entries(self, id_key, entries):
+        self.conn.executemany(
+            'INSERT INTO index_entries (collection, name, key, id) VALUES (?, ?, ?, ?)',
+            [(self.collection, name, key, id_key) for name, keys in entries.items() for key in keys]
+        )
+
+    def put(self, id_key, doc, entries):
+        doc = BSON.encode(doc)
+
+        # An update keeps the rowid of the document, and with it the natural order of the collection.
+        cursor = self.conn.execute(
+            'UPDATE documents SET doc = ? WHERE collection = ? AND id = ?', (doc, self.collection, id_key)
+        )
+
+        if not cursor.rowcount:
+            self.conn.execute(
+                'INSERT INTO documents (collection, id, doc) VALUES (?, ?, ?)', (self.collection, id_key, doc)
+            )
+
+        self.conn.execute('DELETE FROM index_entries WHERE collection = ? AND id = ?', (self.collection, id_key))
+        self._add_entries(id_key, entries)
+
+    def delete(self, id_key):
+        self.conn.execute('DELETE FROM documents WHERE collection = ? AND id = ?', (self.collection, id_key))
+        self.conn.execute('DELETE FROM index_entries WHERE collection = ? AND id = ?', (self.collection, id_key))
+
+    def index_specs(self):
+        specs = {}
+
+        for name, spec in self.conn.execute(
+                'SELECT name, spec FROM index_specs WHERE collection = ?', (self.collection,)):
+            spec = BSON(spec).decode()
+            specs[name] = ([(field, direction) for field, direction in spec['keys']], spec['options'])
+
+        return specs
+
+    def add_index(self, name, keys, options, entries):
+        self.conn.execute(
+            'INSERT INTO index_specs (collection, name, spec) VALUES (?, ?, ?)',
+            (self.collection, name, BSON.encode({'keys': keys, 'options': options}))
+        )
+
+        for id_key, keys in entries.items():
+            self._add_entries(id_key, {name: keys})
+
+    def transaction(self):
+        # The connection commits when the block exits, or rolls back if it raises.
+        return self.conn
+
+
+class SQLiteStorage(DocumentStorage):
+    '''
+    Storage backend which keeps the whole database in a single SQLite file, for single node
+    deployments without a mongo server. All operations run one at a time on a dedicated thread,
+    each in its own transaction, so the event loop never waits on the disk.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+        self._executor = ThreadPoolExecutor(1)
+        self._conn = self._executor.submit(self._connect).result()
+
+        super().__init__()
+
+        log.debug(f'opened sqlite database at {path}')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+        return conn
+
+    def open_store(self, full_name):
+        return SQLiteStore(self._conn, full_name)
+
+    def collection_names(self, database):
+        names = set()
+
+        for table in ('documents', 'index_specs'):
+            for collection, in self._conn.execute(f'SELECT DISTINCT collection FROM {table}'):
+                if collection.startswith(database + '.'):
+                    names.add(collection.split('.', 1)[1])
+
+        return sorted(names)
+
+    async def run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    def close(self):
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown()
@@ -0,0 +1,166 @@
+import logging
+from functools import partial
+
+import asyncio
+
+from .scope import current_scope
+
+log = logging.getLogger(__name__)
+
+
+class TaskGroup(object):
+    '''The live tasks spawned by an owner for one purpose, e.g. `Anime.update_episode`, and their counters.'''
+    def __init__(self, owner, purpose, cap=None):
+        self.owner = owner
+        self.purpose = purpose
+        self.name = f'{owner}.{purpose}'
+        self.cap = cap
+
+        self.tasks = set()
+
+        # keys:
+        #   {key: Task, ...}
+        self.keys = {}
+
+        self.spawned = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.deduplicated = 0
+        self.last_error = None
+
+    def stats(self):
+        return {
+            'live': len(self.tasks),
+            'cap': self.cap,
+            'spawned': self.spawned,
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'rejected': self.rejected,
+            'deduplicated': self.deduplicated,
+            'last_error': self.last_error
+        }
+
+
+class TaskSupervisor(object):
+    '''
+    Registry of the background tasks of the bot and its plugins. Every task belongs to a group,
+    named after its owner (usually a plugin) and its purpose:
+
+        self.mbot.tasks.spawn(self._update_episode(anilist_id), 'Anime', 'update_episode', key=anilist_id)
+
+    Plugins should use `BasePlugin.spawn` instead. A group can be capped to a number of live
+    tasks, in which case tasks over the cap are not started at all; tasks with a `key` are
+    not started while a task with the same key is live in the group. Exceptions of tasks are
+    logged and counted, and the tasks of a plugin are cancelled when plugins are reloaded.
+    Tasks run in the scope named after their group, see `current_scope`.
+    '''
+    def __init__(self, mbot, caps=None):
+        self.mbot = mbot
+
+        # Caps from the config, which override the caps passed to `spawn`.
+        # caps:
+        #   {group_name: max_live_tasks, ...}
+        self.caps = caps or {}
+
+        # _groups:
+        #   {(owner, purpose): TaskGroup, ...}
+        self._groups = {}
+
+    def spawn(self, coro, owner, purpose, key=None, cap=None):
+        '''
+        Schedule the coroutine `coro` as a task of the group `owner.purpose`.
+
+        :param key: If given, the task is not started while another task with the same key is live in the group.
+        :param cap: The maximum number of live tasks in the group; unlimited by default.
+        :returns: The task, or `None` if it was not started.
+        '''
+        group = self._groups.get((owner, purpose))
+
+        if group is None:
+            group = self._groups[(owner, purpose)] = TaskGroup(owner, purpose)
+
+        group.cap = self.caps.get(group.name, cap)
+
+        if key is not None and key in group.keys:
+            coro.close()
+            group.deduplicated += 1
+            return None
+
+        if group.cap is not None and len(group.tasks) >= group.cap:
+            coro.close()
+            group.rejected += 1
+
+            log.debug(f'not starting a task of {group.name}, it is at its cap of {group.cap} tasks')
+            return None
+
+        # The task copies the current context, so it runs in the scope of its group;
+        # its CPU and wall time are charged to its owner.
+        token = current_scope.set(group.name)
+
+        try:
+            task = self.mbot.loop.create_task(self.mbot.accounting.measure(owner, coro))
+        finally:
+            current_scope.reset(token)
+
+        task.add_done_callback(partial(self._done, group, key))
+
+        group.tasks.add(task)
+        group.spawned += 1
+
+        if key is not None:
+            group.keys[key] = task
+
+        return task
+
+    def _done(self, group, key, task):
+        group.tasks.discard(task)
+
+        if key is not None and group.keys.get(key) is task:
+            del group.keys[key]
+
+        if task.cancelled():
+            group.cancelled += 1
+        elif task.exception() is not None:
+            group.failed += 1
+            group.last_error = repr(task.exception())
+
+            log.error(f'task of {group.name} failed', exc_info=task.exception())
+        else:
+            group.completed += 1
+
+    def cancel(self, owner, purpose=None):
+        '''
+        Cancel all live tasks of `owner`, or only those of the group `owner.purpose`.
+        The current task is never cancelled, e.g. when a command reloads the plugins.
+        '''
+        current = asyncio.current_task(self.mbot.loop)
+        tasks = []
+
+        for group in self._groups.values():
+            if group.owner == owner and purpose in (None, group.purpose):
+                tasks.extend(task for task in group.tasks if task is not current)
+
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            log.debug(f'cancelled {len(tasks)} task(s) of {owner if purpose is None else f"{owner}.{purpose}"}')
+
+        return tasks
+
+    async def shutdown(self, timeout=5):
+        '''Cancel all live tasks (except for the current task) and wait up to `timeout` seconds for them to finish.'''
+        current = asyncio.current_task(self.mbot.loop)
+        tasks = [task for group in self._groups.values() for task in group.tasks if task is not current]
+
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self):
+        return {group.name: group.stats() for group in self._groups.values()}
@@ -0,0 +1,218 @@
+import json
+import time
+import queue
+import random
+import logging
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+
+log = logging.getLogger(__name__)
+
+# The span which is open in the current task; `None` if the current message is not being traced.
+# Tasks created while a span is open inherit it, so their spans become its children.
+current_span = ContextVar('current_span', default=None)
+
+# Tells the writer thread of a `Tracer` to stop.
+_STOP = object()
+
+
+class Span(object):
+    '''
+    A timed operation of a trace. Spans are context managers which make themselves the current
+    span while they are open; they are exported when they are closed.
+    '''
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'attrs', 'timestamp', 'start', 'duration',
+                 '_token')
+
+    def __init__(self, tracer, trace_id, parent_id, name, attrs):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_span.reset(self._token)
+
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+
+        self.finish()
+
+    def finish(self, duration=None):
+        self.duration = time.perf_counter() - self.start if duration is None else duration
+        self.tracer.export(self)
+
+    def child(self, name, **attrs):
+        return Span(self.tracer, self.trace_id, self.span_id, name, attrs)
+
+    def record(self, name, duration, **attrs):
+        '''
+        Export a child span which took `duration` seconds and has just finished. This is meant
+        for operations which are timed elsewhere, such as database operations.
+        '''
+        span = self.child(name, **attrs)
+        span.timestamp -= duration
+        span.finish(duration)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'attrs': self.attrs
+        }
+
+
+class _NoSpan(object):
+    '''Stands in for a span when the current message is not traced; does nothing at all.'''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    '''
+    Traces a sample of the messages handled by the bot. A trace is started for a message in
+    `mBot.on_message`, and everything done while handling it (commands, database operations,
+    sent messages, ...) opens a child span of the current span:
+
+        with self.mbot.tracer.span('render', template=name):
+            ...
+
+    When the current message is not traced, `span` returns a shared no-op object, so spans
+    cost next to nothing unless sampling is turned on.
+
+    Finished spans are kept per trace for the last `buffer` traces, and written to `path`
+    as JSON lines if a path is given. Spans of tasks which outlive the message (such as the
+    command itself) are exported when they finish, after the root span. The file is written
+    by a background thread, which flushes it whenever it has caught up with the exported spans.
+    '''
+    def __init__(self, sample_rate=0, buffer=1000, path=None):
+        self.sample_rate = sample_rate
+        self.buffer = buffer
+        self.path = path
+
+        self._writes = queue.Queue()
+        self._writer = None
+
+        # Database operations are exported from the threads of motor's executor.
+        self._lock = threading.Lock()
+
+        # _traces:
+        #   {trace_id: [span_dict, ...], ...}
+        self._traces = OrderedDict()
+
+        self.traced = 0
+        self.exported = 0
+
+    def trace(self, name, **attrs):
+        '''Start a new trace with a root span named `name`, if the trace is sampled.'''
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return _NO_SPAN
+
+        self.traced += 1
+        return Span(self, f'{random.getrandbits(64):016x}', None, name, attrs)
+
+    def span(self, name, **attrs):
+        '''Open a child span of the current span, if the current message is being traced.'''
+        parent = current_span.get()
+
+        if parent is None:
+            return _NO_SPAN
+
+        return parent.child(name, **attrs)
+
+    def export(self, span):
+        data = span.to_dict()
+
+        with self._lock:
+            self._export(data)
+
+    def _export(self, data):
+        spans = self._traces.get(data['trace_id'])
+
+        if spans is None:
+            spans = self._traces[data['trace_id']] = []
+
+            if len(self._traces) > self.buffer:
+                self._traces.popitem(last=False)
+
+        spans.append(data)
+        self.exported += 1
+
+        if self.path is not None:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, args=(self.path,), name='trace-writer', daemon=True
+                )
+                self._writer.start()
+
+            self._writes.put(data)
+
+    def _write_loop(self, path):
+        try:
+            with open(path, 'a') as file:
+                while True:
+                    data = self._writes.get()
+
+                    # Write everything which is queued, then flush once.
+                    while data is not _STOP:
+                        file.write(json.dumps(data, default=str) + '\n')
+
+                        try:
+                            data = self._writes.get_nowait()
+                        except queue.Empty:
+                            break
+
+                    file.flush()
+
+                    if data is _STOP:
+                        return
+        except OSError as e:
+            log.error(f'could not export spans to {path}: {e}')
+            self.path = None
+
+    def recent(self, count=10):
+        '''Return the spans of the last `count` traces, oldest first.'''
+        with self._lock:
+            traces = list(self._traces.items())[-count:]
+
+        return [{'trace_id': trace_id, 'spans': list(spans)} for trace_id, spans in traces]
+
+    def stats(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'traced': self.traced,
+            'exported': self.exported,
+            'buffered': len(self._traces)
+        }
+
+    def close(self, timeout=5):
+        '''Stop the writer thread once it has written the spans which are already queued.'''
+        with self._lock:
+            writer, self._writer, self.path = self._writer, None, None
+
+        if writer is not None:
+            self._writes.put(_STOP)
+            writer.join(timeout)
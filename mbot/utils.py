@@ -1,15 +1,27 @@
 from functools import wraps, partial
 from discord import Client
 
+from .executors import IO, CPU
+from .render import register_cpu_task, run_cpu_task
 
-def long_running_task(send_typing=True):
+
+def long_running_task(send_typing=True, workload=IO, timeout=None):
     '''
     Decorator which can be used to run long running methods as a background task
     in the main loop. The method can then be used as a co-routine.
 
     :param send_typing: Bool indicating whether or not to send typing status to discord.
+    :param workload: `IO` for blocking I/O, which runs on the thread pool of `Executors`, or `CPU`
+        for CPU bound work, which runs on the worker processes of `RenderService` and counts against
+        the render jobs of the server of `_message`. `CPU` methods run in another process, so they
+        cannot use any state of the plugin and their arguments and return value must be picklable.
+    :param timeout: Seconds after which the call raises `asyncio.TimeoutError`.
+        Defaults to the timeout configured for the executor.
     '''
     def decorator(func):
+        if workload == CPU:
+            register_cpu_task(func)
+
         @wraps(func)
         async def wrapper(self, *args, _message=None, **kwargs):
             if isinstance(self, Client):
@@ -17,12 +29,18 @@ def long_running_task(send_typing=True):
             else:
                 mbot = self.mbot
 
-            f = partial(func, self, *args, **kwargs)
-
             if send_typing and _message is not None:
                 await mbot.send_typing(_message.channel)
 
-            return await mbot.loop.run_in_executor(None, f)
+            if workload == CPU:
+                server = _message.server if _message is not None else None
+
+                return await mbot.render.run(
+                    run_cpu_task, (func.__module__, func.__qualname__), args, kwargs,
+                    server_id=server.id if server is not None else None, timeout=timeout
+                )
+
+            return await mbot.executors.run(partial(func, self, *args, **kwargs), timeout=timeout)
         return wrapper
     return decorator
 
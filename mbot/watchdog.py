@@ -0,0 +1,157 @@
+import sys
+import time
+import logging
+import threading
+import traceback
+from collections import deque
+
+from .histogram import Histogram
+
+log = logging.getLogger(__name__)
+
+
+class LoopWatchdog(object):
+    '''
+    Measures the scheduling lag of the event loop and catches code which blocks it.
+
+    A callback on the loop beats every `interval` seconds, and the lag is how late each beat
+    runs. A monitor thread checks on the beats; when the loop has not beaten for `threshold`
+    seconds past the interval, it captures the stack of the loop's thread, which is whatever
+    is blocking the loop, and attributes the stall to the innermost plugin on that stack.
+    The stall is counted once the loop beats again, so its full duration is known.
+
+    The stack is a snapshot at the time the stall was detected; a loop which is slow because
+    of many short callbacks (rather than a single blocking one) is attributed to whichever
+    callback happened to be running.
+    '''
+    def __init__(self, mbot, interval=0.25, threshold=0.5, history=50):
+        self.mbot = mbot
+        self.interval = interval
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_id = None
+        self._handle = None
+        self._stopped = threading.Event()
+
+        self._last_beat = None
+        self._expected = None
+
+        # The stall which was detected since the last beat, if any.
+        self._stall = None
+
+        self.lag = Histogram()
+        self.last_lag = 0
+
+        self.stalls = 0
+        self.stalled = 0
+
+        # plugins:
+        #   {plugin_name: {'stalls': int, 'seconds': float, 'max': float}, ...}
+        self.plugins = {}
+
+        # The last `history` stalls, with their stacks.
+        self.recent = deque(maxlen=history)
+
+    def start(self):
+        '''Start watching the loop; must be called from the loop's thread.'''
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._expected = self._last_beat + self.interval
+        self._handle = self.mbot.loop.call_later(self.interval, self._beat)
+
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def _beat(self):
+        now = time.monotonic()
+
+        self.last_lag = max(now - self._expected, 0)
+        self.lag.observe(self.last_lag)
+
+        with self._lock:
+            stall, self._stall = self._stall, None
+            self._last_beat = now
+
+        if stall is not None:
+            self._stall_ended(stall, now - stall['since'] - self.interval)
+
+        self._expected = now + self.interval
+        self._handle = self.mbot.loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            with self._lock:
+                if self._stall is not None or time.monotonic() - self._last_beat - self.interval < self.threshold:
+                    continue
+
+                frame = sys._current_frames().get(self._thread_id)
+
+                if frame is None:
+                    continue
+
+                stall = self._stall = {
+                    'since': self._last_beat,
+                    'time': time.time(),
+                    'plugin': self._plugin_of(frame),
+                    'site': f'{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}',
+                    'stack': ''.join(traceback.format_stack(frame))
+                }
+
+            log.warning(
+                f'event loop blocked for over {self.threshold}s by {stall["plugin"] or "the bot"} '
+                f'at {stall["site"]}:\n{stall["stack"]}'
+            )
+
+    def _plugin_of(self, frame):
+        '''Return the name of the innermost plugin on the stack of `frame`, if any.'''
+        plugins = list(self.mbot.plugin_manager.plugins)
+        modules = {type(plugin).__module__: type(plugin).__name__ for plugin in plugins}
+
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+
+            if module in modules:
+                return modules[module]
+
+            if module.startswith('mbot.plugins.'):
+                return module
+
+            frame = frame.f_back
+
+    def _stall_ended(self, stall, duration):
+        duration = max(duration, self.threshold)
+        plugin = stall['plugin'] or 'mbot'
+
+        self.stalls += 1
+        self.stalled += duration
+
+        counters = self.plugins.setdefault(plugin, {'stalls': 0, 'seconds': 0, 'max': 0})
+        counters['stalls'] += 1
+        counters['seconds'] += duration
+        counters['max'] = max(counters['max'], duration)
+
+        self.recent.append({**stall, 'plugin': plugin, 'duration': duration})
+
+        log.warning(f'event loop was blocked for {duration:.2f}s by {plugin} at {stall["site"]}')
+
+    def stats(self, stacks=False):
+        return {
+            'interval': self.interval,
+            'threshold': self.threshold,
+            'lag': self.lag.stats(),
+            'last_lag': self.last_lag,
+            'stalls': self.stalls,
+            'stalled': self.stalled,
+            'plugins': {plugin: dict(counters) for plugin, counters in self.plugins.items()},
+            'recent': [
+                {key: value for key, value in stall.items() if stacks or key != 'stack'} for stall in self.recent
+            ]
+        }
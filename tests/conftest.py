@@ -0,0 +1,17 @@
+import pytest
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(request, monkeypatch):
+    '''A `FakeClock` in place of the `time` module of the module a test module names as `clocked`.'''
+    clock = FakeClock()
+    monkeypatch.setattr(request.module.clocked, 'time', clock)
+    return clock
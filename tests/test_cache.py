@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from mbot import cache
+from mbot.cache import TTLCache, ResponseCache, _normalize
+
+
+clocked = cache
+
+
+def test_normalize_ignores_whitespace_and_order():
+    assert _normalize('  Naruto   Shippuden ') == _normalize('Naruto Shippuden')
+    assert _normalize({'b': 1, 'a': 'X'}) == _normalize({'a': 'X', 'b': 1})
+    assert _normalize([1, 2]) != _normalize([2, 1])
+
+
+def test_normalize_only_ignores_case_with_casefold():
+    assert _normalize({'user': 'Alice'}) != _normalize({'user': 'alice'})
+    assert _normalize({'search': ' Naruto'}, casefold=True) == _normalize({'search': 'naruto'}, casefold=True)
+
+
+def test_normalize_sets_regardless_of_iteration_order():
+    # Sets of strings are iterated in an order which depends on the hash seed; sorting must not.
+    words = [f'word{i}' for i in range(50)]
+
+    assert _normalize(set(words)) == _normalize(set(reversed(words))) == _normalize(frozenset(words))
+    assert _normalize({1, 'a', None}) == _normalize({None, 'a', 1})
+    assert _normalize({1, 'a', None}, casefold=True) == _normalize({None, 'A', 1}, casefold=True)
+
+
+def test_ttl_cache_expires_entries(clock):
+    ttl_cache = TTLCache(maxsize=10, ttl=60)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2, ttl=120)
+
+    clock.now += 61
+
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.get('b') == 2
+    assert ttl_cache.stats()['hits'] == 1
+    assert ttl_cache.stats()['misses'] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    ttl_cache = TTLCache(maxsize=2, ttl=60)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    ttl_cache.get('a')
+    ttl_cache.set('c', 3)
+
+    assert 'a' in ttl_cache
+    assert 'b' not in ttl_cache
+    assert len(ttl_cache) == 2
+
+
+def test_response_cache_coalesces_concurrent_misses():
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'id': 1}
+
+    async def main():
+        responses = ResponseCache()
+        results = await asyncio.gather(*[
+            responses.fetch('anilist', {'q': query}, lookup, casefold=True) for query in ('Naruto', 'naruto ', 'NARUTO')
+        ])
+
+        # Cached once the request is done.
+        results.append(await responses.fetch('anilist', {'q': 'naruto'}, lookup, casefold=True))
+        return responses, results
+
+    responses, results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert responses.stats()['endpoints']['anilist'] == {'hits': 1, 'misses': 1, 'coalesced': 2}
+
+
+def test_response_cache_does_not_cache_failures():
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        raise ValueError
+
+    async def main():
+        responses = ResponseCache()
+
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await responses.fetch('steam', ('id',), lookup)
+
+        return responses
+
+    responses = asyncio.run(main())
+
+    assert len(calls) == 2
+    assert responses.stats()['size'] == 0
@@ -0,0 +1,102 @@
+import re
+
+import pytest
+
+from mbot.dispatcher import CommandIndex, pattern_key
+
+
+class FakeCommand(object):
+    '''Stands in for a command wrapper; only has what the index looks at.'''
+    def __init__(self, regex, name, aliases=None):
+        self._regex = regex
+        self._pattern = re.compile(
+            regex.replace(name, f'(?:{name}|{"|".join(aliases)})') if aliases else regex
+        )
+        self.info = {'name': name, 'aliases': aliases or []}
+
+    def __repr__(self):
+        return f'<FakeCommand {self.info["name"]}>'
+
+
+COMMANDS = [
+    FakeCommand('^anime (.*?)$', 'anime'),
+    FakeCommand('^anime-link (.*?)$', 'anime-link'),
+    FakeCommand('^badges craft$', 'badges craft'),
+    FakeCommand('^badges upgrade$', 'badges upgrade'),
+    FakeCommand('^trade accept (.*?) (.*?)$', 'trade accept'),
+    FakeCommand('^cc (.*?)(?: (.*?))?$', 'cc'),
+    FakeCommand('^cc-browse(?: (.*?))?$', 'cc-browse'),
+    FakeCommand('^colou?r (.*?)$', 'color'),
+    FakeCommand('^(?:hi|hello)$', 'hi'),
+    FakeCommand('^rank(?: (.*?))?$', 'rank', aliases=['level', 'lvl']),
+    FakeCommand('^\\d+$', 'number'),
+]
+
+MESSAGES = [
+    'anime naruto', 'anime-link 123', 'animenaruto', 'badges craft', 'badges upgrade', 'badges',
+    'trade accept 1 2', 'trade', 'cc foo bar', 'cc', 'cc-browse', 'cc-browse 2', 'color red', 'colour red',
+    'hi', 'hello', 'rank', 'rank @someone', 'level', 'lvl @someone', '42', '', 'unknown command'
+]
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('^badges craft$', ('badges craft', 'badges craft')),
+    ('^anime (.*?)$', ('anime', 'anime ')),
+    ('^cc-browse(?: (.*?))?$', ('cc-browse', 'cc-browse')),
+    ('^trade accept (.*?) (.*?)$', ('trade accept', 'trade accept ')),
+    ('^colou?r (.*?)$', (None, 'colo')),
+    ('^(?:hi|hello)$', (None, '')),
+    ('^a|b$', (None, '')),
+])
+def test_pattern_key(pattern, expected):
+    assert pattern_key(pattern) == expected
+
+
+@pytest.mark.parametrize('message', MESSAGES)
+def test_candidates_include_every_matching_command(message):
+    index = CommandIndex()
+    index.build(COMMANDS)
+
+    candidates = index.candidates(message)
+    matching = [command for command in COMMANDS if command._pattern.match(message)]
+
+    assert set(matching) <= set(candidates)
+    assert candidates == sorted(candidates, key=COMMANDS.index)
+
+
+def test_candidates_skip_other_commands():
+    index = CommandIndex()
+    index.build(COMMANDS)
+
+    names = {command.info['name'] for command in index.candidates('badges craft')}
+
+    assert 'badges craft' in names
+    assert not names & {'anime', 'trade accept', 'badges upgrade', 'rank'}
+
+
+def test_lookup_prefers_the_longest_name():
+    index = CommandIndex()
+    index.build(COMMANDS)
+
+    assert index.lookup('badges craft now').info['name'] == 'badges craft'
+    assert index.lookup('anime-link 5').info['name'] == 'anime-link'
+    assert index.lookup('anime-linked') is None
+    assert index.lookup('') is None
+
+
+def test_lookup_of_aliases():
+    index = CommandIndex()
+    index.build(COMMANDS)
+
+    assert index.lookup('lvl') is None
+    assert index.lookup('lvl', ignore_aliases=False).info['name'] == 'rank'
+    assert index.aliases['level'].info['name'] == 'rank'
+
+
+def test_build_replaces_the_index():
+    index = CommandIndex()
+    index.build(COMMANDS)
+    index.build(COMMANDS[:1])
+
+    assert index.candidates('badges craft') == []
+    assert index.lookup('anime x').info['name'] == 'anime'
@@ -0,0 +1,47 @@
+import pytest
+
+from mbot.histogram import Histogram, percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 0.5) == 51
+    assert percentile(values, 0.99) == 100
+    assert percentile(values, 1) == 100
+    assert percentile([3, 1, 2], 0) == 1
+    assert percentile([], 0.5) == 0
+
+
+def test_observe_fills_the_right_buckets():
+    histogram = Histogram(buckets=(1, 5, 10))
+
+    for value in (0.5, 1, 3, 10, 11, 50):
+        histogram.observe(value)
+
+    # A value equal to a bound falls into that bound's bucket; the last bucket is the overflow.
+    assert histogram.counts == [2, 1, 1, 2]
+    assert histogram.count == 6
+    assert histogram.sum == pytest.approx(75.5)
+    assert histogram.max == 50
+
+
+def test_quantiles_are_bucket_bounds_capped_at_the_max():
+    histogram = Histogram(buckets=(0.01, 0.1, 1))
+
+    for _ in range(90):
+        histogram.observe(0.005)
+
+    for _ in range(10):
+        histogram.observe(0.5)
+
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.95) == 0.5
+    assert histogram.quantile(0.9) == 0.01
+
+    histogram.observe(30)
+    assert histogram.quantile(1) == 30
+
+
+def test_stats_of_an_empty_histogram():
+    assert Histogram().stats() == {'count': 0, 'sum': 0, 'avg': 0, 'p50': 0, 'p95': 0, 'p99': 0, 'max': 0}
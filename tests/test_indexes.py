@@ -0,0 +1,108 @@
+import asyncio
+import pkgutil
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pymongo')
+
+from pymongo.errors import OperationFailure  # noqa: E402
+
+from mbot.indexes import IndexRegistry, index_name  # noqa: E402
+from mbot.storage.base import Storage  # noqa: E402
+
+
+class FakePlugin(object):
+    indexes = {
+        'reminders': [([('expires', 1)], {})],
+        'ranking': [([('server_id', 1), ('user_id', 1)], {'unique': True, 'name': 'server_user'})]
+    }
+
+
+class FakeCollection(object):
+    def __init__(self, created, fail):
+        self.created = created
+        self.fail = fail
+
+    async def create_index(self, keys, name=None, **options):
+        if name in self.fail:
+            raise OperationFailure('index exists with different options')
+
+        self.created[name] = (keys, options)
+        return name
+
+
+def fake_mbot(plugins, fail=()):
+    created = {}
+
+    class Database(dict):
+        def __missing__(self, name):
+            return self.setdefault(name, FakeCollection(created, fail))
+
+    mongo = SimpleNamespace(indexes=Storage.indexes, bot_data=Database(), plugin_data=Database())
+
+    return SimpleNamespace(mongo=mongo, plugin_manager=SimpleNamespace(plugins=plugins)), created
+
+
+def test_collect_declares_the_indexes_of_the_storage_and_the_plugins():
+    mbot, _ = fake_mbot([FakePlugin()])
+    registry = IndexRegistry(mbot)
+    registry.collect()
+
+    declared = registry._declared
+
+    assert declared[('plugin_data', 'reminders')] == {'expires_1': ([('expires', 1)], {}, 'FakePlugin')}
+    assert declared[('plugin_data', 'ranking')]['server_user'][1] == {'unique': True}
+    assert index_name([('expires_at', 1)]) in declared[('bot_data', 'cmd_history')]
+
+
+def test_collect_skips_malformed_declarations():
+    class Broken(object):
+        def indexes(self):
+            pass
+
+    mbot, _ = fake_mbot([Broken(), FakePlugin()])
+    registry = IndexRegistry(mbot)
+    registry.collect()
+
+    assert ('plugin_data', 'reminders') in registry._declared
+
+
+def test_ensure_creates_indexes_and_records_failures():
+    mbot, created = fake_mbot([FakePlugin()], fail={'server_user'})
+    registry = IndexRegistry(mbot)
+
+    asyncio.run(registry.ensure())
+
+    assert registry.ensured
+    assert 'expires_at_1' in created and 'expires_1' in created
+    assert list(registry.failed) == [('plugin_data', 'ranking', 'server_user')]
+
+
+def test_plugin_index_declarations_are_dicts():
+    '''Every plugin must keep `indexes` a dict; a command named `indexes` would shadow it.'''
+    pytest.importorskip('discord')
+
+    from mbot import plugins
+    from mbot.plugin_registry import PluginRegistry
+
+    for module in pkgutil.iter_modules(plugins.__path__):
+        try:
+            importlib.import_module(f'mbot.plugins.{module.name}')
+        except ImportError as e:
+            pytest.skip(f'cannot import the {module.name} plugin: {e}')
+
+    classes = [cls for cls in PluginRegistry.plugins if cls.__module__.startswith('mbot.plugins.')]
+    assert classes
+
+    for cls in classes:
+        assert isinstance(cls.indexes, dict), cls.__name__
+
+    # Plugins are not constructed, since that needs a running bot.
+    mbot, _ = fake_mbot([cls.__new__(cls) for cls in classes])
+    registry = IndexRegistry(mbot)
+    registry.collect()
+
+    owners = {owner for indexes in registry._declared.values() for _, _, owner in indexes.values()}
+    assert {'Storage', 'Anime', 'Ranking'} <= owners
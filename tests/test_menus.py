@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('discord')
+
+from mbot import menus  # noqa: E402
+from mbot.menus import MenuSessions  # noqa: E402
+from mbot.accounting import PluginAccounting  # noqa: E402
+from mbot.tasks import TaskSupervisor  # noqa: E402
+
+
+clocked = menus
+
+
+def message(channel_id, author_id, content=''):
+    return SimpleNamespace(
+        channel=SimpleNamespace(id=channel_id), author=SimpleNamespace(id=author_id), content=content
+    )
+
+
+def run(test, clock):
+    '''Run `test(sessions, clock)` on a loop; expiry is driven by the test through the fake clock.'''
+    async def main():
+        mbot = SimpleNamespace(loop=asyncio.get_running_loop())
+        mbot.accounting = PluginAccounting(mbot)
+        mbot.tasks = TaskSupervisor(mbot)
+        sessions = MenuSessions(mbot, tick=1, slots=64)
+
+        try:
+            return await test(sessions, clock)
+        finally:
+            if sessions._ticker is not None:
+                sessions._ticker.cancel()
+
+    return asyncio.run(main())
+
+
+def test_feed_resolves_the_oldest_matching_session(clock):
+    async def test(sessions, clock):
+        first = asyncio.ensure_future(sessions.wait('c1', 'u1', 20, check=lambda m: m.content.isdigit()))
+        second = asyncio.ensure_future(sessions.wait('c1', 'u1', 20))
+        await asyncio.sleep(0)
+
+        assert not sessions.feed(message('c2', 'u1', '1'))
+        assert not sessions.feed(message('c1', 'u2', '1'))
+        assert len(sessions) == 2
+
+        assert sessions.feed(message('c1', 'u1', 'text'))
+        assert (await second).content == 'text'
+
+        assert sessions.feed(message('c1', 'u1', '3'))
+        assert (await first).content == '3'
+
+        assert len(sessions) == 0
+        assert sessions.stats()['resolved'] == 2
+
+    run(test, clock)
+
+
+@pytest.mark.parametrize('step', [0.5, 3, 40, 200])
+def test_sessions_expire_on_time(step, clock):
+    async def test(sessions, clock):
+        start = clock.now
+        timeouts = [5, 20, 100, 600]
+        waiters = [asyncio.ensure_future(sessions.wait('c1', f'u{t}', t)) for t in timeouts]
+        await asyncio.sleep(0)
+
+        while clock.now - start < 700:
+            clock.now += step
+            sessions._expire(clock.now)
+            await asyncio.sleep(0)
+
+            for timeout, waiter in zip(timeouts, waiters):
+                if clock.now < start + timeout:
+                    assert not waiter.done()
+
+        assert [await waiter for waiter in waiters] == [None] * len(timeouts)
+        assert len(sessions) == 0
+        assert sessions.stats()['expired'] == len(timeouts)
+
+    run(test, clock)
@@ -0,0 +1,88 @@
+import pytest
+
+from mbot import ratelimit
+from mbot.ratelimit import RateLimiter
+
+
+clocked = ratelimit
+
+
+def test_limits_each_scope(clock):
+    limiter = RateLimiter({'user': (2, 10), 'channel': (3, 10)})
+
+    limiter.hit('u1', 'c1')
+    limiter.hit('u1', 'c1')
+
+    assert limiter.limited('u1', 'c1') == 'user'
+    assert limiter.limited('u2', 'c1') is None
+
+    limiter.hit('u2', 'c1')
+
+    assert limiter.limited('u3', 'c1') == 'channel'
+    assert limiter.limited('u3', 'c2') is None
+
+
+def test_retry_after(clock):
+    limiter = RateLimiter({'user': (2, 10)})
+
+    limiter.hit('u1')
+    limiter.hit('u1')
+
+    # One token comes back every 5 seconds.
+    assert limiter.retry_after('u1') == pytest.approx(5)
+
+    clock.now += 3
+    assert limiter.retry_after('u1') == pytest.approx(2)
+
+    clock.now += 2
+    assert limiter.limited('u1') is None
+    assert limiter.retry_after('u2') == 0
+
+
+def test_unlimited_scopes_are_ignored(clock):
+    limiter = RateLimiter({'user': (1, 10), 'server': None})
+
+    limiter.hit('u1', 'c1', 's1')
+
+    assert len(limiter) == 1
+    assert limiter.limited('u2', 'c1', 's1') is None
+
+
+def test_full_buckets_are_dropped(clock):
+    limiter = RateLimiter({'user': (5, 10)})
+
+    for user in range(100):
+        limiter.hit(user)
+
+    assert len(limiter) == 100
+
+    # Buckets are full again after 2 seconds; they are dropped on the next tick after that.
+    clock.now += 1
+    limiter.limited('someone')
+    assert len(limiter) == 100
+
+    clock.now += 2
+    limiter.limited('someone')
+    assert len(limiter) == 0
+
+
+@pytest.mark.parametrize('step', [0.5, 1, 7, 50, 300])
+def test_buckets_are_kept_until_full_and_then_dropped(clock, step):
+    # Refills take up to 20 minutes, far longer than the 64 seconds the wheel spans.
+    limiter = RateLimiter({'user': (1, 30), 'channel': (1, 1200)}, tick=1, slots=64)
+
+    limiter.hit('u1', 'c1')
+    clock.now += 10
+    limiter.hit('u2', 'c2')
+
+    full_at = {key: bucket.full_at() for key, bucket in limiter._buckets.items()}
+
+    for _ in range(int(1500 / step)):
+        clock.now += step
+        limiter.limited('nobody')
+
+        for key, at in full_at.items():
+            if clock.now < at:
+                assert key in limiter._buckets
+
+    assert len(limiter) == 0
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('pymongo')
+
+from pymongo.errors import DuplicateKeyError, OperationFailure  # noqa: E402
+
+from mbot.storage import MemoryStorage, SQLiteStorage  # noqa: E402
+from mbot.storage.query import match, apply_update, project, sort_documents, upsert_document  # noqa: E402
+
+
+CONFIG = {
+    '_id': 1,
+    'server_id': '10',
+    'prefix': '!',
+    'plugins': [{'name': 'Core', 'commands': ['help', 'info']}, {'name': 'Ranking', 'commands': ['rank']}],
+    'ranking': [{'user_id': 'a', 'xp': 50}, {'user_id': 'b', 'xp': 10}],
+    'tags': ['x', 'y']
+}
+
+
+@pytest.mark.parametrize('query, matches', [
+    ({'server_id': '10'}, True),
+    ({'server_id': '11'}, False),
+    ({'tags': 'y'}, True),
+    ({'tags': ['x', 'y']}, True),
+    ({'plugins.name': 'Ranking'}, True),
+    ({'plugins.commands': 'info'}, True),
+    ({'plugins.0.name': 'Core'}, True),
+    ({'plugins': {'$elemMatch': {'name': 'Core', 'commands': 'rank'}}}, False),
+    ({'plugins': {'$elemMatch': {'name': 'Ranking', 'commands': 'rank'}}}, True),
+    ({'ranking.xp': {'$gt': 40}}, True),
+    ({'ranking.xp': {'$gt': 50}}, False),
+    ({'ranking.xp': {'$gte': 10, '$lt': 11}}, True),
+    ({'prefix': {'$in': ['?', '!']}}, True),
+    ({'prefix': {'$nin': ['?', '!']}}, False),
+    ({'prefix': {'$ne': '!'}}, False),
+    ({'missing': {'$exists': False}}, True),
+    ({'missing': None}, True),
+    ({'tags': {'$size': 2}}, True),
+    ({'tags': {'$all': ['y', 'x']}}, True),
+    ({'ranking.xp': {'$not': {'$gt': 100}}}, True),
+    ({'$or': [{'prefix': '?'}, {'tags': 'x'}]}, True),
+    ({'$and': [{'prefix': '!'}, {'tags': 'z'}]}, False),
+    ({'$nor': [{'prefix': '?'}]}, True),
+])
+def test_match(query, matches):
+    assert match(CONFIG, query) is matches
+
+
+def test_unknown_operators_raise():
+    with pytest.raises(OperationFailure):
+        match(CONFIG, {'prefix': {'$regex': '!'}})
+
+    with pytest.raises(OperationFailure):
+        apply_update(CONFIG, {'$rename': {'prefix': 'p'}}, {})
+
+
+def test_apply_update_with_the_positional_operator():
+    query = {'server_id': '10', 'plugins': {'$elemMatch': {'name': 'Ranking'}}}
+    new = apply_update(CONFIG, {'$addToSet': {'plugins.$.commands': 'levels'}}, query)
+
+    assert new['plugins'][1]['commands'] == ['rank', 'levels']
+    assert CONFIG['plugins'][1]['commands'] == ['rank']
+
+    new = apply_update(new, {'$pull': {'plugins.$.commands': 'rank'}}, {'plugins.name': 'Ranking'})
+    assert new['plugins'][1]['commands'] == ['levels']
+
+
+def test_apply_update_operators():
+    new = apply_update(CONFIG, {
+        '$set': {'prefix': '?', 'nested.field': 1},
+        '$unset': {'tags': ''},
+        '$inc': {'ranking.0.xp': 5, 'count': 2},
+        '$push': {'plugins': {'name': 'Fun', 'commands': []}},
+        '$setOnInsert': {'created': True}
+    }, {})
+
+    assert new['prefix'] == '?' and new['nested'] == {'field': 1}
+    assert 'tags' not in new and 'created' not in new
+    assert new['ranking'][0]['xp'] == 55 and new['count'] == 2
+    assert new['plugins'][-1]['name'] == 'Fun'
+
+    with pytest.raises(ValueError):
+        apply_update(CONFIG, {'prefix': '?'}, {})
+
+
+def test_upsert_document():
+    query = {'server_id': '12', 'xp': {'$gt': 1}, '$and': [{'user_id': 'c'}], 'scope': {'$eq': 'global'}}
+    assert upsert_document(query) == {'server_id': '12', 'user_id': 'c', 'scope': 'global'}
+
+
+def test_project():
+    assert project(CONFIG, {'prefix': 1}) == {'_id': 1, 'prefix': '!'}
+    assert project(CONFIG, {'ranking.user_id': 1, '_id': 0}) == {'ranking': [{'user_id': 'a'}, {'user_id': 'b'}]}
+
+    excluded = project(CONFIG, {'plugins': 0, 'ranking': 0, 'tags': 0})
+    assert excluded == {'_id': 1, 'server_id': '10', 'prefix': '!'}
+
+
+def test_sort_documents():
+    docs = [{'a': 2, 'b': 1}, {'a': 1, 'b': 2}, {'a': 2, 'b': 0}, {'b': 5}, {'a': [0, 9], 'b': 3}]
+
+    assert [doc['b'] for doc in sort_documents(list(docs), [('a', 1), ('b', 1)])] == [5, 3, 2, 0, 1]
+    assert [doc['b'] for doc in sort_documents(list(docs), [('a', -1), ('b', -1)])] == [3, 1, 0, 2, 5]
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'memory':
+        storage = MemoryStorage()
+    else:
+        storage = SQLiteStorage(str(tmp_path / 'mbot.sqlite3'))
+
+    yield storage
+    storage.close()
+
+
+def test_collection_operations(storage):
+    async def main():
+        config = storage.config
+
+        await config.create_index([('server_id', 1)], unique=True)
+        await config.insert_many([
+            {'server_id': str(i), 'prefix': '!', 'plugins': [{'name': 'Core', 'commands': []}]} for i in range(20)
+        ])
+
+        with pytest.raises(DuplicateKeyError):
+            await config.insert_one({'server_id': '3'})
+
+        result = await config.update_one(
+            {'server_id': '3', 'plugins': {'$elemMatch': {'name': 'Core'}}},
+            {'$addToSet': {'plugins.$.commands': 'help'}}
+        )
+        assert result.modified_count == 1
+
+        doc = await config.find_one({'server_id': '3'}, {'plugins': 1, '_id': 0})
+        assert doc == {'plugins': [{'name': 'Core', 'commands': ['help']}]}
+
+        result = await config.update_one({'server_id': '99'}, {'$set': {'prefix': '?'}}, upsert=True)
+        assert result.upserted_id is not None
+        assert (await config.find_one({'server_id': '99'}))['prefix'] == '?'
+
+        docs = await config.find({'prefix': '!'}).sort('server_id', -1).skip(1).limit(3).to_list(None)
+        assert [doc['server_id'] for doc in docs] == ['8', '7', '6']
+
+        plan = await config.find({'server_id': '5'}).explain()
+        assert plan['queryPlanner']['winningPlan']['inputStage']['stage'] == 'IXSCAN'
+        assert plan['executionStats']['totalDocsExamined'] == 1
+
+        plan = await config.find({'prefix': '!'}).explain()
+        assert plan['queryPlanner']['winningPlan']['stage'] == 'COLLSCAN'
+
+        assert (await config.delete_many({'server_id': {'$in': ['1', '2', '99']}})).deleted_count == 3
+        assert len(await config.find().to_list(None)) == 18
+
+    asyncio.run(main())
@@ -22,12 +22,26 @@ if 'http://' in OAUTH2_REDIRECT_URI:
 
 
 # RPC
-def get_rpc_client():
-    client = zerorpc.Client()
-    client.connect(RPC_HOST)
+def get_rpc_client(host=RPC_HOST, timeout=30):
+    client = zerorpc.Client(timeout=timeout)
+    client.connect(host)
     return client
 
 
+def invalidate_server_config(server_id):
+    '''
+    Tell every shard (see `RPC_SHARD_HOSTS`) to drop its cached config of `server_id` after
+    an edit made from the dashboard. The edit is already saved, so a shard which cannot be
+    reached is only logged; it picks up the edit once the config expires from its cache
+    (see `cache.guild_config.ttl` in the bot config).
+    '''
+    for host in RPC_SHARD_HOSTS:
+        try:
+            get_rpc_client(host, timeout=5).invalidate_config(server_id)
+        except (zerorpc.LostRemote, zerorpc.TimeoutExpired, zerorpc.RemoteError) as e:
+            app.logger.warning(f'could not invalidate the cached config of server {server_id} on {host}: {e!r}')
+
+
 # MONGO
 def get_playlist(server_id):
     return db.plugin_data.voice_player.find_one({'server_id': server_id})
@@ -55,6 +69,7 @@ def mongo_enable_cmd(server_id, cmd):
             {'$addToSet': {'plugins.$.commands': cmd}}
         )
 
+        invalidate_server_config(server_id)
         return ret.modified_count > 0
     except PyMongoError:
         return False
@@ -82,6 +97,7 @@ def mongo_disable_cmd(server_id, cmd):
             {'$pull': {'plugins.$.commands': cmd}}
         )
 
+        invalidate_server_config(server_id)
         return ret.modified_count > 0
     except PyMongoError:
         return False
@@ -102,6 +118,7 @@ def set_prefix(server_id, prefix):
             {'$set': {'prefix': prefix}}
         )
 
+        invalidate_server_config(server_id)
         return ret.modified_count > 0
     except PyMongoError:
         return False
@@ -119,6 +136,7 @@ def mongo_enable_plugin(server_id, plugin):
             {'$push': {'plugins': {'name': plugin, 'commands': []}}}
         )
 
+        invalidate_server_config(server_id)
         return ret.modified_count > 0
     except PyMongoError:
         return False
@@ -136,6 +154,7 @@ def mongo_disable_plugin(server_id, plugin):
             {'$pull': {'plugins': {'name': plugin}}}
         )
 
+        invalidate_server_config(server_id)
         return ret.modified_count > 0
     except PyMongoError:
         return False
@@ -4,6 +4,7 @@ import os
 
 __all__ = [
     'RPC_HOST',
+    'RPC_SHARD_HOSTS',
     'MONGO_HOST',
     'OAUTH2_CLIENT_ID',
     'OAUTH2_CLIENT_SECRET',
@@ -14,6 +15,9 @@ __all__ = [
 ]
 
 RPC_HOST = os.environ.get('RPC_HOST', 'tcp://127.0.0.1:4243')
+# The RPC servers of all shards (comma separated), which are told about config edits; every shard
+# listens on `4242 + shard_id + 1`. Defaults to the single shard at `RPC_HOST`.
+RPC_SHARD_HOSTS = [host for host in os.environ.get('RPC_SHARD_HOSTS', '').split(',') if host] or [RPC_HOST]
 MONGO_HOST = os.environ.get('MONGO_HOST', 'mongodb://localhost:27017/')
 
 OAUTH2_CLIENT_ID = os.environ['OAUTH2_CLIENT_ID']